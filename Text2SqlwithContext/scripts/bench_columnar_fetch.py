@@ -0,0 +1,172 @@
+"""
+查询结果构建基准：逐行dict构建 DataFrame 与按列类型化缓冲区构建 DataFrame 的对比
+
+用法:
+    python bench_columnar_fetch.py --rows 100000 200000 --batch 1000
+
+两种数据源：
+    mysql  模拟 mysql.connector 游标（DECIMAL/DATE/DATETIME 列，带 type_code）
+    sqlite 内存SQLite表（description 不含类型，按数据推断；fee 为NUMERIC亲和性，整数值和小数混存）
+输出每种方式的耗时与峰值内存（tracemalloc），并校验列式结果与逐行结果的数值一致
+（包括整数值和小数分在不同批次的NUMERIC列）
+"""
+import os
+import sys
+import time
+import sqlite3
+import decimal
+import datetime
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.sql_to_data.columnar_fetch import ColumnarBuffer, column_kinds  # noqa: E402
+
+COLUMNS = ["id", "gender", "age", "bmi", "fee", "checkup_date", "created_at"]
+
+
+def make_rows(n):
+    base = datetime.date(2020, 1, 1)
+    genders = ("男", "女")
+    rows = []
+    for i in range(n):
+        day = base + datetime.timedelta(days=i % 1500)
+        rows.append((
+            i,
+            genders[i % 2],
+            18 + i % 70,
+            decimal.Decimal(f"{18 + (i % 200) / 10:.1f}"),
+            decimal.Decimal(f"{(i % 5000) / 100:.2f}") if i % 97 else None,
+            day,
+            datetime.datetime(day.year, day.month, day.day, i % 24, i % 60)
+        ))
+    return rows
+
+
+class FakeMySQLCursor:
+    """按 mysql.connector 的 description 格式返回元组行"""
+    # LONGLONG, VAR_STRING, LONG, NEWDECIMAL, NEWDECIMAL, DATE, DATETIME
+    TYPE_CODES = (8, 253, 3, 246, 246, 10, 12)
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._pos = 0
+        self.description = [(name, code, None, None, None, None, 1)
+                            for name, code in zip(COLUMNS, self.TYPE_CODES)]
+
+    def fetchmany(self, size):
+        batch = self._rows[self._pos:self._pos + size]
+        self._pos += len(batch)
+        return batch
+
+
+def make_sqlite_cursor(rows):
+    conn = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute("CREATE TABLE t (id INTEGER, gender TEXT, age INTEGER, bmi REAL, fee NUMERIC, "
+                 "checkup_date TEXT, created_at TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     [(r[0], r[1], r[2], float(r[3]), None if r[4] is None else float(r[4]),
+                       r[5].isoformat(), r[6].isoformat(sep=" ")) for r in rows])
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM t")
+    return cursor
+
+
+def fetch_dicts(cursor, batch_size, db_type):
+    """原实现：逐行 dict(zip(...)) 后由dict列表构建DataFrame"""
+    columns = [desc[0] for desc in cursor.description]
+    records = []
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        records.extend(dict(zip(columns, row)) for row in batch)
+    return pd.DataFrame(records)
+
+
+def fetch_tuples(cursor, batch_size, db_type):
+    """元组行列表直接构建DataFrame（无类型转换）"""
+    columns = [desc[0] for desc in cursor.description]
+    rows = []
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        rows.extend(batch)
+    return pd.DataFrame.from_records(rows, columns=columns)
+
+
+def fetch_columnar(cursor, batch_size, db_type):
+    """列式读取：每批直接转换为按列的NumPy数组"""
+    columns = [desc[0] for desc in cursor.description]
+    buffer = ColumnarBuffer(columns, column_kinds(cursor.description, db_type))
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        buffer.append(batch)
+    return buffer.to_dataframe()
+
+
+def check_mixed_numeric():
+    """SQLite NUMERIC列中整数值和小数分在不同批次时，列式结果不应截断小数"""
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE m (weight NUMERIC)")
+    conn.executemany("INSERT INTO m VALUES (?)", [(70.00,), (71.00,), (70.5,), (1,)])
+    cursor = conn.execute("SELECT weight FROM m")
+    values = fetch_columnar(cursor, 2, "sqlite")["weight"].tolist()
+    if values != [70.0, 71.0, 70.5, 1.0]:
+        print(f"NUMERIC列混合整数和小数时结果错误: {values}")
+        sys.exit(1)
+
+
+def measure(fn, make_cursor, batch_size, db_type):
+    cursor = make_cursor()
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = fn(cursor, batch_size, db_type)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    frame_bytes = df.memory_usage(deep=True).sum()
+    return elapsed, peak, frame_bytes, df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询结果构建基准")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 200000])
+    parser.add_argument("--batch", type=int, default=1000)
+    parser.add_argument("--source", choices=["mysql", "sqlite", "all"], default="all")
+    args = parser.parse_args()
+
+    check_mixed_numeric()
+    sources = ["mysql", "sqlite"] if args.source == "all" else [args.source]
+    methods = [("dict行", fetch_dicts), ("元组行", fetch_tuples), ("列式", fetch_columnar)]
+
+    print(f"{'数据源':<8}{'行数':>10}  {'方式':<8}{'耗时(s)':>10}{'峰值内存(MB)':>14}{'DataFrame(MB)':>15}")
+    for n in args.rows:
+        rows = make_rows(n)
+        for source in sources:
+            if source == "mysql":
+                make_cursor = lambda: FakeMySQLCursor(rows)  # noqa: E731
+            else:
+                make_cursor = lambda: make_sqlite_cursor(rows)  # noqa: E731
+            frames = {}
+            for name, fn in methods:
+                elapsed, peak, frame_bytes, frames[name] = measure(fn, make_cursor, args.batch, source)
+                print(f"{source:<8}{n:>10}  {name:<8}{elapsed:>10.3f}{peak / 2 ** 20:>14.1f}"
+                      f"{frame_bytes / 2 ** 20:>15.1f}")
+            df = frames["列式"]
+            print(f"{'':<20}列式结果类型: {', '.join(str(t) for t in df.dtypes)}")
+            expected = frames["dict行"]
+            for col in ("age", "bmi", "fee"):
+                if not np.allclose(df[col].astype(float), expected[col].astype(float), equal_nan=True):
+                    print(f"{'':<20}列式结果与逐行结果不一致: {col}")
+                    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+上下文摘要基准：原实现（全部历史轮次的完整SQL + 实体字典原样输出）与按token预算构建的摘要对比
+
+用法:
+    python bench_context_budget.py --turns 5 10 20 --budget 600 --full-turns 2
+
+模拟一个会话连续提问，每轮之后构建一次增强查询，统计提示token估计（平均/最大）和构建耗时
+（预算一列的耗时包含主题切换检测和指代消解）。
+最后一次提问换一个话题，展示检测到主题切换后裁剪历史的效果
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from statistics import mean
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.nlp_to_sql.context_manager import ContextualConversation  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.context_budget import estimate_tokens  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.session_store import MemorySessionStore  # noqa: E402
+
+FIELDS = [("年龄", "age"), ("体重", "weight"), ("血压", "blood_pressure"), ("空腹血糖", "fasting_glucose"),
+          ("总胆固醇", "total_cholesterol"), ("体质指数", "bmi")]
+
+
+def legacy_summary(session) -> str:
+    """原实现的上下文摘要"""
+    if not session["history"]:
+        return "这是对话的开始，没有历史上下文。"
+    lines = []
+    if session["entities"]:
+        lines.append("当前对话涉及的实体: " + ", ".join(f"{k}:{v}" for k, v in session["entities"].items()))
+    lines.append("最近的对话历史:")
+    for i, entry in enumerate(reversed(session["history"])):
+        lines.append(f"  [{i+1}] 用户: {entry['user_query']}")
+        lines.append(f"      SQL: {entry['generated_sql']}")
+    return "\n".join(lines)
+
+
+def make_turn(rng, n):
+    (name, column), (name2, column2) = rng.sample(FIELDS, 2)
+    age = rng.randint(30, 80)
+    query = f"查询{age}岁以上男性患者的{name}和{name2}分布"
+    sql = (f"SELECT patient_name, {column}, {column2}, checkup_date FROM medical_checkup "
+           f"WHERE age > {age} AND gender = '男' AND checkup_date >= '2024-01-01' "
+           f"ORDER BY {column} DESC LIMIT {100 + n}")
+    return query, sql
+
+
+def run(turns, args):
+    rng = random.Random(args.seed)
+    manager = ContextualConversation(max_history=turns, store=MemorySessionStore(turns, 3600, 0),
+                                     token_budget=args.budget, full_turns=args.full_turns)
+    legacy_tokens, legacy_ms, budget_tokens, budget_ms = [], [], [], []
+    for n in range(turns):
+        query, sql = make_turn(rng, n)
+        manager.add_history("bench", query, sql, {})
+        follow_up = "它们的平均值是多少"
+
+        start = time.perf_counter()
+        session = manager.get_session("bench")
+        prompt = legacy_summary(session) + follow_up
+        legacy_ms.append((time.perf_counter() - start) * 1000)
+        legacy_tokens.append(estimate_tokens(prompt))
+
+        start = time.perf_counter()
+        _, metrics = manager.enhance_query_with_metrics("bench", follow_up)
+        budget_ms.append((time.perf_counter() - start) * 1000)
+        budget_tokens.append(metrics["prompt_tokens"])
+
+    print(f"{turns:>4} 轮  原实现 平均 {mean(legacy_tokens):6.0f} / 最大 {max(legacy_tokens):6d} tokens "
+          f"{mean(legacy_ms):.3f} ms   预算 平均 {mean(budget_tokens):6.0f} / 最大 {max(budget_tokens):6d} tokens "
+          f"{mean(budget_ms):.3f} ms  (完整 {metrics['turns_full']}，摘要 {metrics['turns_digest']}，"
+          f"省略 {metrics['turns_omitted']})")
+
+    _, metrics = manager.enhance_query_with_metrics("bench", "统计心电图结果异常的人数")
+    print(f"       主题切换: {'已裁剪' if metrics['context_shift'] else '未检测到'}，"
+          f"提示 {metrics['prompt_tokens']} tokens，保留 {len(manager.get_session('bench')['history'])} 轮")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上下文摘要token预算基准")
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 10, 20], help="会话历史轮数（同时作为max_history）")
+    parser.add_argument("--budget", type=int, default=600)
+    parser.add_argument("--full-turns", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for turns in args.turns:
+        run(turns, args)
+
+
+if __name__ == "__main__":
+    main()
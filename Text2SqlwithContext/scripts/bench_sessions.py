@@ -0,0 +1,126 @@
+"""
+会话管理基准：每次访问全量扫描过期会话的原实现与按活动时间排序、惰性过期的实现对比
+
+用法:
+    python bench_sessions.py --sessions 1000 10000 100000 --lookups 20000
+
+先创建指定数量的活跃会话，再随机访问会话（每个请求约调用4次get_session），
+分别计时并校验过期清理和会话上限淘汰的结果
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.nlp_to_sql.context_manager import ContextualConversation  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.session_store import MemorySessionStore  # noqa: E402
+
+
+class LegacyConversation(ContextualConversation):
+    """原实现：普通字典，每次get_session都扫描全部会话"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sessions = {}
+
+    def create_session(self, session_id):
+        self.sessions[session_id] = {
+            "history": deque(maxlen=self.max_history),
+            "created_at": datetime.now(),
+            "last_activity": datetime.now(),
+            "entities": {}
+        }
+        return self.sessions[session_id]
+
+    def get_session(self, session_id):
+        self.clean_expired_sessions()
+        if session_id not in self.sessions:
+            return self.create_session(session_id)
+        self.sessions[session_id]["last_activity"] = datetime.now()
+        return self.sessions[session_id]
+
+    def clean_expired_sessions(self, now=None):
+        now = datetime.now()
+        expired_sessions = []
+        for session_id, session in self.sessions.items():
+            if (now - session["last_activity"]).total_seconds() > self.session_timeout:
+                expired_sessions.append(session_id)
+        for session_id in expired_sessions:
+            del self.sessions[session_id]
+
+
+def memory_conversation(session_timeout=1800, max_sessions=0):
+    """使用进程内会话存储（与 CONTEXT_STORE 配置无关）"""
+    return ContextualConversation(store=MemorySessionStore(5, session_timeout, max_sessions))
+
+
+def bench_lookups(manager, n_sessions, lookups, seed=0):
+    """返回每次get_session的平均耗时（微秒）"""
+    # 直接创建会话（原实现逐个get_session建立10万会话需要O(n²)次扫描）
+    for i in range(n_sessions):
+        manager.create_session(f"s{i}")
+    rng = random.Random(seed)
+    ids = [f"s{rng.randrange(n_sessions)}" for _ in range(lookups)]
+    start = time.perf_counter()
+    for session_id in ids:
+        manager.get_session(session_id)
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+def check_expiry(n_sessions):
+    """一半会话超时后，访问一次应清理掉全部过期会话"""
+    manager = memory_conversation(session_timeout=60)
+    for i in range(n_sessions):
+        manager.get_session(f"s{i}")
+    stale = datetime.now() - timedelta(seconds=120)
+    # 模拟前一半会话很久没有活动（保持按活动时间排序）
+    for i in range(n_sessions // 2):
+        manager.store.sessions[f"s{i}"]["last_activity"] = stale
+    start = time.perf_counter()
+    manager.get_session("probe")
+    elapsed = (time.perf_counter() - start) * 1000
+    sessions = manager.store.sessions
+    assert len(sessions) == n_sessions - n_sessions // 2 + 1, len(sessions)
+    assert "s0" not in sessions and f"s{n_sessions - 1}" in sessions
+    return elapsed
+
+
+def check_eviction(n_sessions):
+    """超过会话上限时淘汰最久未活动的会话，最近访问过的会话保留"""
+    cap = n_sessions // 2
+    manager = memory_conversation(max_sessions=cap)
+    for i in range(n_sessions):
+        manager.get_session(f"s{i}")
+        if i >= 1:
+            manager.get_session("s0")  # s0 一直活跃
+    assert len(manager.store) == cap
+    assert "s0" in manager.store.sessions and "s1" not in manager.store.sessions
+    assert manager.get_stats()["evicted"] == n_sessions - cap
+    return manager.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话管理基准")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--lookups", type=int, default=20000, help="每种规模的随机访问次数")
+    parser.add_argument("--legacy-lookups", type=int, default=200, help="原实现的访问次数（全量扫描较慢）")
+    args = parser.parse_args()
+
+    print(f"{'会话数':>10}{'原实现(us/次)':>16}{'新实现(us/次)':>16}{'加速比':>10}")
+    for n in args.sessions:
+        legacy = bench_lookups(LegacyConversation(max_sessions=0), n, args.legacy_lookups)
+        current = bench_lookups(memory_conversation(), n, args.lookups)
+        print(f"{n:>10}{legacy:>16.1f}{current:>16.2f}{legacy / current:>10.0f}x")
+
+    n = max(args.sessions)
+    print(f"\n{n} 个会话中一半过期，一次访问清理耗时: {check_expiry(n):.1f}ms")
+    print(f"{n} 个会话、上限 {n // 2}: {check_eviction(n)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+文本摘要基准：逐指标过滤排序的原实现与按指标分组聚合的实现对比
+
+用法:
+    python bench_summary.py --rows 10000 1000000 --metrics 40
+
+生成 patient_metrics 结构的合成数据，分别计时并校验两种实现输出的摘要文本一致
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.sql_to_data.data_processing import (  # noqa: E402
+    generate_textual_summary, get_medical_unit, translate_column
+)
+
+
+def legacy_metrics_summary(df):
+    """原实现：每个指标做一次布尔过滤和排序"""
+    summary = "## 核心分析结果\n\n"
+    metrics = df['metric_name'].unique()
+
+    for metric in metrics[:100]:
+        metric_df = df[df['metric_name'] == metric]
+        # 稳定排序使同一日期的多条记录取靠后的一条（原实现的快速排序在此情况下不确定）
+        latest = metric_df.sort_values('checkup_date', kind='stable').iloc[-1]
+        unit = latest['unit'] if 'unit' in df.columns else get_medical_unit(metric)
+
+        values = pd.to_numeric(metric_df['metric_value'], errors='coerce').dropna()
+        if len(values) > 1:
+            stats = (
+                f"最新值: {latest['metric_value']}{unit} "
+                f"(平均: {values.mean():.1f}{unit}, 范围: {values.min():.1f}-{values.max():.1f}{unit})"
+            )
+        else:
+            stats = f"最新值: {latest['metric_value']}{unit}"
+
+        summary += f"- {translate_column(metric)}: {stats}\n"
+
+    return summary
+
+
+def legacy_gender_summary(df):
+    """原实现：iterrows 逐行格式化"""
+    total = df['count'].sum()
+    summary = "\n核心分析结果\n"
+    for _, row in df.iterrows():
+        percentage = (row['count'] / total) * 100
+        summary += (
+            f"- {translate_column(row['gender'])}: "
+            f"{row['count']}人 ({percentage:.1f}%)\n"
+        )
+    return summary
+
+
+def make_metrics_frame(rows, metric_count, seed=0):
+    rng = np.random.default_rng(seed)
+    metric_names = np.array([f"metric_{i:03d}" for i in range(metric_count)], dtype=object)
+    units = np.array(["mmol/L", "mmHg", "U/L", "g/L"], dtype=object)
+    metric_idx = rng.integers(0, metric_count, rows)
+    # 记录ID递增，日期随机且允许重复
+    return pd.DataFrame({
+        "record_id": np.arange(rows),
+        "patient_id": rng.integers(0, max(rows // 20, 1), rows).astype(str),
+        "metric_name": metric_names[metric_idx],
+        "metric_value": np.round(rng.normal(50, 15, rows), 2),
+        "unit": units[metric_idx % len(units)],
+        "checkup_date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 1500, rows), unit="D"),
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本摘要基准")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 1000000])
+    parser.add_argument("--metrics", type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{'数据':<10}{'行数':>10}{'原实现(s)':>12}{'分组聚合(s)':>14}{'加速比':>9}  文本一致")
+    for rows in args.rows:
+        df = make_metrics_frame(rows, args.metrics)
+        old_time, old_text = timed(legacy_metrics_summary, df)
+        new_time, new_text = timed(generate_textual_summary, df)
+        print(f"{'指标记录':<10}{rows:>10}{old_time:>12.3f}{new_time:>14.3f}{old_time / new_time:>9.1f}  "
+              f"{old_text == new_text}")
+
+        genders = pd.DataFrame({"gender": ["male", "female"] * (min(rows, 100000) // 2),
+                                "count": np.arange(min(rows, 100000))})
+        old_time, old_text = timed(legacy_gender_summary, genders)
+        new_time, new_text = timed(generate_textual_summary, genders)
+        print(f"{'性别计数':<10}{len(genders):>10}{old_time:>12.3f}{new_time:>14.3f}{old_time / new_time:>9.1f}  "
+              f"{old_text == new_text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+索引顾问命令行：按查询负载推荐复合索引，并在本地数据库副本上对比建索引前后的耗时
+
+用法:
+    python index_advisor.py --db sqlite --path medical_copy.db
+    python index_advisor.py --db mysql --workload workload.jsonl --limit 3 --keep
+    python index_advisor.py --queries queries.sql          # 只输出建议和DDL
+
+负载来源（按优先级）：--workload 指定的 JSON Lines 文件（INDEX_ADVISOR_WORKLOAD_PATH 记录的负载）、
+--queries 指定的SQL文件（分号分隔），缺省使用内置的典型查询。
+指定 --db 时先逐条计时，按实测耗时推荐，再按收益顺序逐个创建索引并重新计时：负载总耗时没有下降
+至少 --min-gain 的索引视为无收益并立即删除（估计的选择率可能与实际数据不符）；
+未指定 --keep 时结束后删除其余新建的索引。
+SQLite 副本以 medical 库名附加，带库名的查询可以直接执行。
+"""
+import os
+import sys
+import time
+import sqlite3
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.basic_function.schema_registry import get_schema_snapshot  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.seed_loader import split_statements  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.index_advisor import (  # noqa: E402
+    WorkloadEntry, load_workload_file, recommend_indexes, existing_indexes, apply_indexes
+)
+
+# 生成的查询中常见的模式（已按库名限定）
+SAMPLE_QUERIES = [
+    "SELECT name, age, fasting_glucose FROM medical.medical_checkup WHERE checkup_date >= '2024-01-01' "
+    "AND fasting_glucose > 7.0 ORDER BY checkup_date DESC",
+    "SELECT name, age, bmi FROM medical.medical_checkup WHERE gender = '男' AND age > 60",
+    "SELECT gender, COUNT(*) AS count FROM medical.medical_checkup WHERE age BETWEEN 40 AND 60 GROUP BY gender",
+    "SELECT AVG(fasting_glucose) AS avg_glucose FROM medical.medical_checkup "
+    "WHERE gender = '女' AND checkup_date BETWEEN '2023-01-01' AND '2023-12-31'",
+    "SELECT metric_value, checkup_date FROM medical.patient_metrics WHERE patient_id = 'P0001' "
+    "AND metric_name = 'fasting_glucose' ORDER BY checkup_date",
+]
+DATABASE = 'medical'
+
+
+def open_connection(db_type, path):
+    if db_type == 'sqlite':
+        conn = sqlite3.connect(':memory:')
+        conn.execute("ATTACH DATABASE ? AS medical", (path,))
+        return conn
+    from Text2SqlwithContext.src.sql_to_data.connection_pool import get_connection_pool
+    return get_connection_pool('mysql', warm_up=False).acquire()
+
+
+def time_query(conn, sql, repeat):
+    """预热一次后多次执行取中位数（毫秒），执行失败返回None"""
+    timings = []
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        cursor.fetchall()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    except Exception as err:
+        print(f"  执行失败，跳过: {err}")
+        return None
+    finally:
+        cursor.close()
+    return statistics.median(timings)
+
+
+def time_workload(conn, entries, repeat):
+    """按负载中的执行次数加权的总耗时（毫秒），以及每条查询的耗时"""
+    timings = [time_query(conn, entry.sql, repeat) for entry in entries]
+    total = sum((ms or 0.0) * max(entry.count, 1) for entry, ms in zip(entries, timings))
+    return total, timings
+
+
+def drop_indexes(conn, db_type, created):
+    cursor = conn.cursor()
+    try:
+        for r in created:
+            if db_type == 'sqlite':
+                cursor.execute(f"DROP INDEX IF EXISTS {DATABASE}.{r['name']}")
+            else:
+                cursor.execute(f"DROP INDEX {r['name']} ON {DATABASE}.{r['table']}")
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def load_queries(args):
+    if args.workload:
+        return load_workload_file(args.workload)
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            statements = split_statements(f.read(), 'mysql')
+        return [WorkloadEntry(sql, 1, 0.0, 0.0) for sql in statements]
+    return [WorkloadEntry(sql, 1, 0.0, 0.0) for sql in SAMPLE_QUERIES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="索引顾问")
+    parser.add_argument("--workload", help="查询负载（JSON Lines）")
+    parser.add_argument("--queries", help="SQL文件（分号分隔）")
+    parser.add_argument("--db", choices=["sqlite", "mysql"], help="用于计时的本地数据库副本")
+    parser.add_argument("--path", help="SQLite数据库文件")
+    parser.add_argument("--limit", type=int, default=5, help="最多推荐的索引数")
+    parser.add_argument("--repeat", type=int, default=5, help="每条查询的计时次数")
+    parser.add_argument("--min-gain", type=float, default=0.05, help="保留索引所需的最小总耗时降幅")
+    parser.add_argument("--keep", action="store_true", help="保留有收益的新建索引")
+    args = parser.parse_args()
+    if args.db == 'sqlite' and not args.path:
+        parser.error("--db sqlite 需要 --path")
+
+    schema = get_schema_snapshot()
+    entries = load_queries(args)
+    conn = open_connection(args.db, args.path) if args.db else None
+    try:
+        existing = None
+        if conn is not None:
+            print(f"{len(entries)} 条查询，建索引前计时（中位数，{args.repeat}次）...")
+            measured = []
+            for entry in entries:
+                ms = time_query(conn, entry.sql, args.repeat)
+                if ms is not None:
+                    # 按实测耗时和负载中的执行次数估计总耗时
+                    measured.append(WorkloadEntry(entry.sql, max(entry.count, 1), ms * max(entry.count, 1), ms))
+            entries = measured
+            existing = existing_indexes(conn, args.db, DATABASE)
+
+        recommendations = recommend_indexes(entries, schema, existing=existing, limit=args.limit)
+        if not recommendations:
+            print("没有可推荐的索引")
+            return
+        print("\n推荐索引（按估计收益排序）:")
+        for r in recommendations:
+            print(f"  {r.ddl(args.db or 'mysql', DATABASE)};  -- 收益 {r.benefit_ms:.1f}ms，"
+                  f"{r.queries} 条查询 / {r.executions} 次执行")
+        if conn is None:
+            return
+
+        baseline = sum(entry.max_ms * max(entry.count, 1) for entry in entries)
+        before = [entry.max_ms for entry in entries]
+        created = []
+        print(f"\n{'索引':<48}{'状态':>8}{'负载总耗时(ms)':>16}")
+        print(f"{'(建索引前)':<48}{'':>8}{baseline:>16.2f}")
+        try:
+            for rec in recommendations:
+                result = apply_indexes(conn, args.db, [rec], DATABASE)[0]
+                if result['status'] != 'created':
+                    print(f"{rec.name:<48}{result['status']:>8}  {result.get('error', '')}")
+                    continue
+                total, timings = time_workload(conn, entries, args.repeat)
+                if total > baseline * (1 - args.min_gain):
+                    drop_indexes(conn, args.db, [result])
+                    print(f"{rec.name:<48}{'无收益':>8}{total:>16.2f}  已删除")
+                    continue
+                created.append(result)
+                baseline = total
+                print(f"{rec.name:<48}{'保留':>8}{total:>16.2f}")
+
+            if created:
+                _, after = time_workload(conn, entries, args.repeat)
+                print(f"\n{'建索引前(ms)':>12}{'建索引后(ms)':>14}{'加速比':>8}  查询")
+                for entry, b, a in zip(entries, before, after):
+                    if a is not None:
+                        print(f"{b:>12.2f}{a:>14.2f}{b / max(a, 1e-6):>8.1f}  {entry.sql[:80]}")
+        finally:
+            if created and not args.keep:
+                drop_indexes(conn, args.db, created)
+                print(f"\n已删除新建的 {len(created)} 个索引（使用 --keep 保留）")
+    finally:
+        if conn is not None:
+            if args.db == 'sqlite':
+                conn.close()
+            else:
+                from Text2SqlwithContext.src.sql_to_data.connection_pool import get_connection_pool
+                get_connection_pool('mysql', warm_up=False).release(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+"""
+回归用例：逐条校验曾出过问题的SQL改写等逻辑
+
+用法:
+    python regression_cases.py
+
+不依赖外部数据库（使用内存SQLite）；任一用例失败时以非零状态退出
+"""
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+# 需要真实执行查询的用例使用临时SQLite库（须在导入配置前设置）
+_SQLITE_DIR = tempfile.mkdtemp(prefix="text2sql_regression_")
+os.environ["SQLITE_PATH"] = os.path.join(_SQLITE_DIR, "medical.db")
+
+from Text2SqlwithContext.src.basic_function.schema_registry import get_schema_snapshot  # noqa: E402
+from Text2SqlwithContext.src.data_to_image.chart_store import ChartStore, estimate_spec_bytes  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.context_manager import ContextualConversation  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.schema_linker import link_schema  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.session_store import JournalSessionStore, MemorySessionStore  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.database_interaction import apply_row_limit, execute_query  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.data_processing import generate_textual_summary  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.summary_pushdown import summarize_with_pushdown  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.sqlite_engine import SQLiteEngine  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.sql_validator import validate_sql  # noqa: E402
+from Text2SqlwithContext.src.sql_to_data.index_advisor import (  # noqa: E402
+    WorkloadEntry, extract_access, recommend_indexes, _saving
+)
+
+
+def _medical_db(path=":memory:"):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE medical_checkup (id INTEGER, age INTEGER, gender TEXT)")
+    conn.executemany("INSERT INTO medical_checkup VALUES (?, ?, ?)",
+                     [(i, 20 + i % 60, "男" if i % 2 else "女") for i in range(200)])
+    conn.commit()
+    return conn
+
+
+def check_row_limit():
+    """apply_row_limit：结果行数受限，且原SQL末尾的注释不会吞掉下推的 ) 或 LIMIT"""
+    conn = _medical_db()
+    cases = [
+        # (原SQL, 下推的限制, 期望行数)
+        ("SELECT * FROM medical_checkup", 101, 101),
+        ("SELECT * FROM medical_checkup;", 101, 101),
+        ("SELECT * FROM medical_checkup ORDER BY age DESC LIMIT 5", 101, 5),
+        ("SELECT * FROM medical_checkup ORDER BY age DESC LIMIT 5 -- 年龄最大的5人", 101, 5),
+        ("SELECT * FROM medical_checkup ORDER BY age DESC LIMIT 5; -- 年龄最大的5人", 3, 3),
+        ("SELECT * FROM medical_checkup WHERE gender = '男' -- 男性患者", 10, 10),
+        ("SELECT * FROM medical_checkup /* 全部 */ WHERE gender = '--' ", 10, 0),
+    ]
+    problems = []
+    for sql, limit, expected in cases:
+        limited = apply_row_limit(sql, limit, 'sqlite')
+        try:
+            rows = conn.execute(limited).fetchall()
+        except sqlite3.Error as e:
+            problems.append(f"{sql!r} 改写后执行失败: {e}\n      {limited!r}")
+            continue
+        if len(rows) != expected:
+            problems.append(f"{sql!r} 返回 {len(rows)} 行，应为 {expected}\n      {limited!r}")
+    return problems
+
+
+def check_index_scoring():
+    """索引顾问：分组/排序列之后的范围列不能用于定位，不应因此得分"""
+    schema = get_schema_snapshot()
+    sql = ("SELECT gender, COUNT(*) FROM medical_checkup "
+           "WHERE checkup_date BETWEEN '2024-01-01' AND '2024-03-31' GROUP BY gender")
+    access = extract_access(sql, schema)["medical_checkup"]
+    problems = []
+    by_date = _saving(("checkup_date",), access)
+    grouped_first = _saving(("gender", "checkup_date"), access)
+    if grouped_first > _saving(("gender",), access) + 1e-9:
+        problems.append(f"(gender, checkup_date) 得分 {grouped_first:.2f}，高于只按 gender 分组的索引")
+    if grouped_first >= by_date:
+        problems.append(f"(gender, checkup_date) 得分 {grouped_first:.2f}，不低于 (checkup_date) 的 {by_date:.2f}")
+    # 等值列在前、分组列在后的索引仍然同时计入过滤和分组
+    eq_access = extract_access("SELECT age, COUNT(*) FROM medical_checkup WHERE gender = '男' GROUP BY age",
+                               schema)["medical_checkup"]
+    if _saving(("gender", "age"), eq_access) <= _saving(("gender",), eq_access):
+        problems.append("(gender, age) 没有计入 GROUP BY age 的收益")
+
+    workload = [WorkloadEntry(sql=sql, count=50, total_ms=5000.0)]
+    recommended = [r.columns for r in recommend_indexes(workload, schema, existing={}, limit=1)]
+    if recommended != [("checkup_date",)]:
+        problems.append(f"推荐了 {recommended}，应为 [('checkup_date',)]")
+    return problems
+
+
+def check_keyword_identifiers():
+    """SQL校验：被 sqlparse 识别为关键字的表名、列名（table_name、data、date、level 等）同样要校验"""
+    schema = get_schema_snapshot()
+    problems = []
+    rejected = ["SELECT * FROM data", "SELECT * FROM user", "SELECT result FROM medical_checkup",
+                "SELECT date, level FROM medical_checkup", "SELECT m.status FROM medical_checkup m"]
+    for sql in rejected:
+        if validate_sql(sql, schema, "medical").ok:
+            problems.append(f"{sql!r} 引用了不存在的表或列，却通过了校验")
+    rewritten = {
+        "SELECT * FROM table_name": "SELECT * FROM medical.medical_checkup",
+        "SELECT name FROM table_name WHERE age > 60": "SELECT name FROM medical.medical_checkup WHERE age > 60",
+    }
+    accepted = [
+        "SELECT gender, COUNT(*) AS count FROM medical_checkup GROUP BY gender ORDER BY count DESC",
+        "SELECT * FROM medical_checkup WHERE checkup_date >= CURRENT_DATE - INTERVAL 30 DAY",
+        "SELECT EXTRACT(YEAR FROM checkup_date) AS year, AVG(bmi) FROM medical_checkup GROUP BY year",
+        "SELECT CAST(age AS CHAR) AS a, CONVERT(bmi, DECIMAL) FROM medical_checkup",
+        "SELECT CASE WHEN age >= 60 THEN '老年' ELSE '其他' END AS level, COUNT(*) "
+        "FROM medical_checkup GROUP BY level",
+        "SELECT name, RANK() OVER (PARTITION BY gender ORDER BY bmi DESC) AS r FROM medical_checkup",
+    ]
+    for sql in list(rewritten) + accepted:
+        result = validate_sql(sql, schema, "medical")
+        if not result.ok:
+            problems.append(f"{sql!r} 未通过校验: {result.message}")
+        elif sql in rewritten and result.sql != rewritten[sql]:
+            problems.append(f"{sql!r} 改写为 {result.sql!r}，应为 {rewritten[sql]!r}")
+    return problems
+
+
+def check_summary_pushdown():
+    """文本摘要：结果超出预览行数时由数据库聚合，摘要应与读取完整结果时相同（含日期列）"""
+    conn = sqlite3.connect(os.environ["SQLITE_PATH"])
+    conn.execute("CREATE TABLE medical_checkup (id INTEGER, gender TEXT, age INTEGER, checkup_date DATE, bmi NUMERIC)")
+    conn.executemany("INSERT INTO medical_checkup VALUES (?, ?, ?, ?, ?)",
+                     [(i, "男" if i % 2 else "女", 20 + i % 50, f"2024-0{1 + i % 3}-1{i % 2}", 20.5 + i % 7)
+                      for i in range(300)])
+    conn.commit()
+    conn.close()
+    schema = get_schema_snapshot()
+    problems = []
+    queries = [
+        "SELECT gender, age, checkup_date, bmi FROM medical_checkup",
+        # 预览中只出现第一个日期，其余取值需要从数据库补齐
+        "SELECT checkup_date, bmi FROM medical_checkup WHERE checkup_date < '2024-02-11' ORDER BY checkup_date",
+    ]
+    for sql in queries:
+        full = generate_textual_summary(execute_query(sql, "sqlite", use_cache=False))
+        pushed = summarize_with_pushdown(sql, execute_query(sql, "sqlite", use_cache=False, max_rows=50),
+                                         schema, "sqlite")
+        if pushed is None or pushed[0] != full:
+            problems.append(f"{sql!r} 下推摘要与完整结果摘要不同:\n{full}\n----\n{pushed and pushed[0]}")
+    return problems
+
+
+def check_schema_linking():
+    """模式链接：只按表级关键词选中的表要带上查询所需的列"""
+    result = link_schema("张三的血压变化趋势")
+    if "patient_metrics" not in result.tables:
+        return [f"'张三的血压变化趋势' 没有选中 patient_metrics（选中 {result.tables}）"]
+    return [f"patient_metrics 缺少列 {column}" for column in ("metric_name", "metric_value", "unit")
+            if f"  {column} " not in result.schema_text]
+
+
+def check_context_shift():
+    """主题切换检测：不带代词的省略式追问不应被判定为切换并裁剪历史"""
+    problems = []
+    follow_ups = ["按年龄段分组统计", "只看60岁以上的", "女性患者呢", "那平均值是多少", "空腹血糖最高的10人"]
+    for query in follow_ups:
+        manager = ContextualConversation(max_history=5, store=MemorySessionStore(5, 3600, 0))
+        manager.add_history("s", "查询所有男性患者的平均空腹血糖",
+                            "SELECT AVG(fasting_glucose) FROM medical_checkup WHERE gender = '男'", {})
+        manager.add_history("s", "女性患者呢",
+                            "SELECT AVG(fasting_glucose) FROM medical_checkup WHERE gender = '女'", {})
+        _, metrics = manager.enhance_query_with_metrics("s", query)
+        kept = len(manager.get_session("s")["history"])
+        if metrics["context_shift"] or kept != 2:
+            problems.append(f"{query!r} 被判定为主题切换，历史保留 {kept} 轮")
+
+    # 换到会话中未出现过的字段，仍应检测为切换
+    manager = ContextualConversation(max_history=5, store=MemorySessionStore(5, 3600, 0))
+    manager.add_history("s", "查询所有男性患者的平均空腹血糖",
+                        "SELECT AVG(fasting_glucose) FROM medical_checkup WHERE gender = '男'", {})
+    manager.add_history("s", "女性患者呢",
+                        "SELECT AVG(fasting_glucose) FROM medical_checkup WHERE gender = '女'", {})
+    if not manager.detect_context_shift("s", "统计心电图结果异常的人数"):
+        problems.append("'统计心电图结果异常的人数' 未被判定为主题切换")
+    return problems
+
+
+def check_journal_lock():
+    """会话日志：同一目录只允许一个存储（进程）使用，关闭后可重新打开并恢复"""
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        first = JournalSessionStore(tmp, 5, 3600, 0, flush_interval=0.01)
+        first.create("s", datetime.now())
+        try:
+            second = JournalSessionStore(tmp, 5, 3600, 0, flush_interval=0.01)
+        except OSError:
+            pass
+        else:
+            second.close()
+            problems.append("第二个存储打开了已被占用的会话日志目录")
+        first.close()
+        try:
+            reopened = JournalSessionStore(tmp, 5, 3600, 0, flush_interval=0.01)
+        except OSError as e:
+            return problems + [f"关闭后无法重新打开会话日志目录: {e}"]
+        if reopened.get("s", datetime.now()) is None:
+            problems.append("重新打开后没有恢复会话")
+        reopened.close()
+    return problems
+
+
+def check_chart_pending():
+    """图表存储：待渲染的图表描述按总字节数淘汰，而不只是按数量"""
+    limit = 256 * 1024
+    store = ChartStore(max_bytes=1024 * 1024, spill_dir=None, max_pending=1024, max_pending_bytes=limit)
+    ids = []
+    for n in range(40):
+        spec = {"type": "line", "title": f"趋势{n}", "xlabel": "", "ylabel": "",
+                "x": list(range(5000)), "series": [{"name": "v", "label": "v", "values": [float(n)] * 5000}]}
+        ids.append(store.register_specs({"line": spec})["line"])
+    stats = store.get_stats()
+    problems = []
+    if stats["pending_bytes"] > limit:
+        problems.append(f"待渲染描述共 {stats['pending_bytes']} 字节，超过上限 {limit}")
+    if stats["pending"] >= len(ids):
+        problems.append(f"登记了 {len(ids)} 个大图表描述，一个都没有淘汰")
+    if ids[-1] not in store._pending:
+        problems.append("最新登记的图表描述被淘汰")
+    if stats["pending_bytes"] != sum(estimate_spec_bytes(spec) for spec, _ in store._pending.values()):
+        problems.append("pending_bytes 与实际登记的描述大小不一致")
+    return problems
+
+
+def check_sqlite_pool():
+    """SQLite引擎：每个请求线程不再各建一个连接，且默认不修改数据库文件的日志模式"""
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "medical.db")
+        _medical_db(path).close()
+
+        engine = SQLiteEngine(path, pool_size=3)
+
+        def request():
+            # 模拟Flask每个请求一个新线程
+            with engine.connection() as conn:
+                conn.execute("SELECT COUNT(*) FROM medical_checkup WHERE gender = '男'").fetchone()
+
+        for _ in range(10):
+            threads = [threading.Thread(target=request) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        stats = engine.get_stats()
+        if stats["connections_opened"] > 3:
+            problems.append(f"80 个请求线程打开了 {stats['connections_opened']} 个连接，上限为 3")
+        engine.close()
+
+        check = sqlite3.connect(path)
+        mode = check.execute("PRAGMA journal_mode").fetchone()[0]
+        check.close()
+        if mode.lower() == "wal":
+            problems.append("未开启 SQLITE_ENABLE_WAL 时数据库文件被切换为WAL模式")
+    return problems
+
+
+CHECKS = [check_row_limit, check_index_scoring, check_keyword_identifiers, check_summary_pushdown,
+          check_schema_linking, check_context_shift, check_journal_lock, check_chart_pending, check_sqlite_pool]
+
+
+def main():
+    failed = False
+    try:
+        for check in CHECKS:
+            problems = check()
+            print(f"{check.__name__}: {'通过' if not problems else '失败'}")
+            for problem in problems:
+                print(f"    {problem}")
+            failed = failed or bool(problems)
+    finally:
+        shutil.rmtree(_SQLITE_DIR, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
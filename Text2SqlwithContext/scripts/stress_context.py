@@ -0,0 +1,165 @@
+"""
+上下文管理器并发压力测试：多线程同时调用 enhance_query / add_history 等方法并校验不变量
+
+用法:
+    python stress_context.py --threads 16 --sessions 32 --ops 300
+    python stress_context.py --store journal --switch-interval 0.000001
+
+每个线程随机选择会话，交替增强查询、追加历史、检测主题切换和清除临时会话。结束后检查：
+  - 没有线程抛出异常
+  - 增强查询中只出现本会话的历史（不串会话）
+  - 每个会话保留最近 max_history 轮，同一线程写入的轮次保持先后顺序
+  - 实体计数等于该会话的 add_history 次数（并发读改写没有丢失更新）
+  - journal / sqlite 存储重新打开后恢复出相同的历史和实体
+任一检查失败时以非零状态退出
+"""
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from Text2SqlwithContext.src.nlp_to_sql.context_manager import ContextualConversation  # noqa: E402
+from Text2SqlwithContext.src.nlp_to_sql.session_store import (  # noqa: E402
+    MemorySessionStore, JournalSessionStore, SQLiteSessionStore
+)
+
+MAX_HISTORY = 5
+TIMEOUT = 3600
+USER_LINE = re.compile(r"用户: (\S+?)\|")
+
+
+def open_store(kind, directory):
+    if kind == "memory":
+        return MemorySessionStore(MAX_HISTORY, TIMEOUT, 0)
+    if kind == "journal":
+        return JournalSessionStore(os.path.join(directory, "journal"), MAX_HISTORY, TIMEOUT, 0,
+                                   flush_interval=0.01, snapshot_every=500)
+    return SQLiteSessionStore(os.path.join(directory, "sessions.sqlite3"), MAX_HISTORY, TIMEOUT, 0)
+
+
+def worker(manager, tid, session_ids, ops, seed, adds, adds_lock, errors):
+    rng = random.Random(seed)
+    try:
+        for n in range(ops):
+            session_id = rng.choice(session_ids)
+            action = rng.random()
+            if action < 0.45:
+                prompt = manager.enhance_query(session_id, "它的平均值是多少")
+                for owner in USER_LINE.findall(prompt):
+                    if owner != session_id:
+                        raise AssertionError(f"{session_id} 的上下文中出现了 {owner} 的历史")
+            elif action < 0.9:
+                manager.add_history(session_id, f"{session_id}|t{tid}|{n} 查询年龄",
+                                    f"SELECT age, bmi FROM medical_checkup WHERE id = {n}", {"rows": [[n]]})
+                with adds_lock:
+                    adds[session_id] += 1
+            elif action < 0.95:
+                manager.detect_context_shift(session_id, "查询血压")
+            else:
+                # 临时会话：反复创建、写入和清除，与其他会话并发进行
+                temp_id = f"tmp{rng.randrange(4)}"
+                manager.add_history(temp_id, f"{temp_id}|t{tid}|{n} 查询年龄", "SELECT age FROM medical_checkup", {})
+                manager.clear_session(temp_id)
+    except Exception as err:
+        errors.append(f"线程 {tid}: {type(err).__name__}: {err}")
+
+
+def snapshot_state(manager, session_ids):
+    state = {}
+    for session_id, session in manager.store.items():
+        if session_id in session_ids:
+            state[session_id] = ([h["user_query"] for h in session["history"]],
+                                 session["entities"].get("medical_checkup", {}).get("count", 0))
+    return state
+
+
+def check(manager, session_ids, adds):
+    problems = []
+    state = snapshot_state(manager, session_ids)
+    for session_id in session_ids:
+        if not adds[session_id]:
+            continue
+        if session_id not in state:
+            problems.append(f"{session_id} 丢失")
+            continue
+        history, count = state[session_id]
+        if len(history) != min(adds[session_id], MAX_HISTORY):
+            problems.append(f"{session_id} 历史 {len(history)} 轮，应为 {min(adds[session_id], MAX_HISTORY)}")
+        last_seen = {}
+        for query in history:
+            owner, tid, n = query.split(" ")[0].split("|")
+            if owner != session_id:
+                problems.append(f"{session_id} 的历史中出现了 {owner}")
+            if int(n) <= last_seen.get(tid, -1):
+                problems.append(f"{session_id} 中线程 {tid} 的轮次顺序错乱")
+            last_seen[tid] = int(n)
+        if count != adds[session_id]:
+            problems.append(f"{session_id} 实体计数 {count}，add_history 调用 {adds[session_id]} 次")
+    return problems, state
+
+
+def run(kind, args):
+    directory = tempfile.mkdtemp(prefix="stress_context_")
+    try:
+        manager = ContextualConversation(max_history=MAX_HISTORY, store=open_store(kind, directory))
+        session_ids = [f"s{i}" for i in range(args.sessions)]
+        adds, adds_lock, errors = Counter(), threading.Lock(), []
+        threads = [threading.Thread(target=worker, args=(manager, tid, session_ids, args.ops, args.seed + tid,
+                                                         adds, adds_lock, errors))
+                   for tid in range(args.threads)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+
+        problems, state = check(manager, session_ids, adds)
+        problems = errors + problems
+        if kind in ("journal", "sqlite"):
+            # 重新打开存储，恢复的状态应与内存中一致
+            if kind == "journal":
+                manager.store.flush()
+            manager.store.close()
+            reopened = ContextualConversation(max_history=MAX_HISTORY, store=open_store(kind, directory))
+            if snapshot_state(reopened, session_ids) != state:
+                problems.append("重新打开后恢复的会话与关闭前不一致")
+            reopened.store.close()
+
+        total = args.threads * args.ops
+        print(f"{kind:>8}: {total} 次操作 / {elapsed:.2f}s ({total / elapsed:,.0f} ops/s)，"
+              f"add_history {sum(adds.values())} 次，{'通过' if not problems else '失败'}")
+        for problem in problems[:20]:
+            print(f"          {problem}")
+        return not problems
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="上下文管理器并发压力测试")
+    parser.add_argument("--store", choices=["memory", "journal", "sqlite", "all"], default="all")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=300, help="每个线程的操作次数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--switch-interval", type=float, default=1e-5,
+                        help="解释器线程切换间隔（秒），调小以增加线程交错")
+    args = parser.parse_args()
+    sys.setswitchinterval(args.switch_interval)
+
+    kinds = ["memory", "journal", "sqlite"] if args.store == "all" else [args.store]
+    results = [run(kind, args) for kind in kinds]
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+本地OpenAI兼容桩服务，用于在不访问真实API的情况下联调LLM客户端
+
+用法:
+    python stub_openai_server.py --port 8808 --delay 0.5
+    OPENAI_API_BASE=http://127.0.0.1:8808 OPENAI_API_KEY=stub python app.py
+
+GET /stats 返回已收到的请求数
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_SQL = "SELECT gender, COUNT(*) AS count FROM medical_checkup GROUP BY gender;"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    sql = STUB_SQL
+    request_count = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json({"requests": StubHandler.request_count})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json({"error": "not found"}, 404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with StubHandler.lock:
+            StubHandler.request_count += 1
+        time.sleep(self.delay)
+        model = request.get("model", "stub")
+        created = int(time.time())
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            words = self.sql.split(" ")
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word + (" " if i < len(words) - 1 else "")},
+                                 "finish_reason": None}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            done = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+            self.wfile.flush()
+            return
+        self._send_json({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": self.sql}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI兼容桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--delay", type=float, default=0.5, help="每次响应前的延迟（秒）")
+    parser.add_argument("--sql", default=STUB_SQL, help="固定返回的SQL")
+    args = parser.parse_args()
+    StubHandler.delay = args.delay
+    StubHandler.sql = args.sql
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"桩服务已启动: http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
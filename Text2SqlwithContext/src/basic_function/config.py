@@ -19,6 +19,109 @@ SQLSERVER_PASSWORD = os.getenv("SQLSERVER_PASSWORD")
 SQLSERVER_DB = os.getenv("SQLSERVER_DB", "medical")
 SQLSERVER_SERVER = os.getenv("SQLSERVER_SERVER", "localhost")
 
+# 项目根目录 (Text2SqlWithContext)
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DB_SCHEMA_PATH = os.getenv("DB_SCHEMA_PATH", os.path.join(PROJECT_ROOT, "integration", "input", "db_schema.json"))
+
+# LLM响应缓存配置
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(PROJECT_ROOT, "integration", "cache", "llm_cache.sqlite3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))  # 秒
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))  # 进程内LRU条目数
+LLM_CACHE_DISK_SIZE = int(os.getenv("LLM_CACHE_DISK_SIZE", "10000"))  # 磁盘缓存条目数
+
+# 异步LLM客户端配置
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # 同时进行的LLM请求上限
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))  # httpx连接池大小
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # 秒
+
+# 模式链接（仅向LLM发送相关表/列）配置
+SCHEMA_LINKING_ENABLED = os.getenv("SCHEMA_LINKING_ENABLED", "1") == "1"
+SCHEMA_LINK_MIN_SCORE = float(os.getenv("SCHEMA_LINK_MIN_SCORE", "1.0"))  # 低于该置信度时回退到完整结构
+
+# SQL审计日志（JSON Lines），为空时不落盘
+SQL_AUDIT_PATH = os.getenv("SQL_AUDIT_PATH", "")
+
+# 图表渲染进程池配置
+CHART_RENDER_WORKERS = int(os.getenv("CHART_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0表示在请求线程中渲染
+CHART_RENDER_TIMEOUT = float(os.getenv("CHART_RENDER_TIMEOUT", "30"))  # 秒
+CHART_DPI = int(os.getenv("CHART_DPI", "100"))
+
+# 图表存储（内容寻址，内存LRU + 可选磁盘目录）
+CHART_STORE_MAX_BYTES = int(os.getenv("CHART_STORE_MAX_BYTES", str(64 * 1024 * 1024)))  # 内存中PNG总字节数上限
+CHART_STORE_SPILL_DIR = os.getenv("CHART_STORE_SPILL_DIR", "")  # 淘汰图表的磁盘目录，为空时不落盘
+CHART_CACHE_MAX_AGE = int(os.getenv("CHART_CACHE_MAX_AGE", str(365 * 24 * 3600)))  # 浏览器缓存时间（秒）
+
+# 图表返回模式：png（服务端渲染图片）或 spec（返回图表描述，由浏览器渲染，PNG仅在下载时按需生成）
+CHART_RESPONSE_MODE = os.getenv("CHART_RESPONSE_MODE", "png")
+CHART_SPEC_MAX_POINTS = int(os.getenv("CHART_SPEC_MAX_POINTS", "500"))  # 图表描述中每条折线的最大点数
+CHART_SPEC_MAX_PENDING = int(os.getenv("CHART_SPEC_MAX_PENDING", "1024"))  # 等待按需渲染的图表描述数量上限
+CHART_SPEC_MAX_PENDING_BYTES = int(os.getenv("CHART_SPEC_MAX_PENDING_BYTES", str(32 * 1024 * 1024)))  # 等待按需渲染的图表描述总字节数上限（按JSON长度估计）
+
+# SQL结果缓存（按表版本失效）
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # 缓存结果总内存上限
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(16 * 1024 * 1024)))  # 单个结果上限
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "600"))  # 秒，0表示仅按表版本失效
+RESULT_CACHE_PROBE_INTERVAL = float(os.getenv("RESULT_CACHE_PROBE_INTERVAL", "5"))  # 表变化探测间隔（秒），0表示不探测
+
+# 查询结果读取上限
+QUERY_PREVIEW_ROWS = int(os.getenv("QUERY_PREVIEW_ROWS", "100"))  # 第一阶段预览读取的行数
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "100000"))  # 单次查询最多读取的行数
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(256 * 1024 * 1024)))  # 单次查询读取数据的大致字节上限
+QUERY_FETCH_BATCH = int(os.getenv("QUERY_FETCH_BATCH", "1000"))  # fetchmany每批行数
+
+# 查询代价守卫：执行前EXPLAIN估计扫描行数
+QUERY_GUARD_ENABLED = os.getenv("QUERY_GUARD_ENABLED", "1") == "1"
+QUERY_GUARD_REJECT_ROWS = int(os.getenv("QUERY_GUARD_REJECT_ROWS", "50000000"))  # 估计扫描行数超过该值时拒绝执行，0表示不拒绝
+QUERY_GUARD_LIMIT_ROWS = int(os.getenv("QUERY_GUARD_LIMIT_ROWS", "2000000"))  # 超过该值时收紧LIMIT或缩短执行时限，0表示不处理
+QUERY_GUARD_LIMIT = int(os.getenv("QUERY_GUARD_LIMIT", "1000"))  # 高代价且可提前结束的查询最多返回的行数
+QUERY_DEADLINE_MS = int(os.getenv("QUERY_DEADLINE_MS", "30000"))  # 所有查询的执行时限（毫秒），0表示不限
+QUERY_GUARD_DEADLINE_MS = int(os.getenv("QUERY_GUARD_DEADLINE_MS", "10000"))  # 高代价查询的执行时限（毫秒）
+
+# 索引顾问：记录已执行查询的耗时，按负载推荐复合索引
+INDEX_ADVISOR_ENABLED = os.getenv("INDEX_ADVISOR_ENABLED", "1") == "1"
+INDEX_ADVISOR_MAX_QUERIES = int(os.getenv("INDEX_ADVISOR_MAX_QUERIES", "1000"))  # 内存中保留的查询模板数
+INDEX_ADVISOR_WORKLOAD_PATH = os.getenv("INDEX_ADVISOR_WORKLOAD_PATH", "")  # 负载追加写入的JSON Lines文件，为空时只保存在内存
+INDEX_ADVISOR_MAX_COLUMNS = int(os.getenv("INDEX_ADVISOR_MAX_COLUMNS", "3"))  # 复合索引最多列数
+
+# 多轮对话会话管理
+CONTEXT_SESSION_TIMEOUT = int(os.getenv("CONTEXT_SESSION_TIMEOUT", "1800"))  # 会话无活动超时（秒）
+CONTEXT_MAX_SESSIONS = int(os.getenv("CONTEXT_MAX_SESSIONS", "10000"))  # 最多保留的会话数，超出时淘汰最久未活动的会话，0表示不限
+CONTEXT_STORE = os.getenv("CONTEXT_STORE", "memory")  # 会话存储：memory（进程内）、journal（进程内+追加日志持久化）或 sqlite（同一主机的多个工作进程共享）
+CONTEXT_STORE_PATH = os.getenv("CONTEXT_STORE_PATH", os.path.join(PROJECT_ROOT, "integration", "cache", "sessions.sqlite3"))
+CONTEXT_JOURNAL_DIR = os.getenv("CONTEXT_JOURNAL_DIR", os.path.join(PROJECT_ROOT, "integration", "cache", "session_journal"))
+CONTEXT_JOURNAL_FLUSH_MS = int(os.getenv("CONTEXT_JOURNAL_FLUSH_MS", "50"))  # 组提交间隔（毫秒），崩溃时最多丢失该间隔内的事件
+CONTEXT_JOURNAL_SNAPSHOT_EVENTS = int(os.getenv("CONTEXT_JOURNAL_SNAPSHOT_EVENTS", "10000"))  # 每写入多少个事件做一次快照并压缩日志
+CONTEXT_JOURNAL_FSYNC = os.getenv("CONTEXT_JOURNAL_FSYNC", "1") == "1"  # 每次组提交后fsync
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "600"))  # 对话上下文的token预算（本地估计），0表示不限
+CONTEXT_FULL_TURNS = int(os.getenv("CONTEXT_FULL_TURNS", "2"))  # 最近几轮保留完整SQL，更早的轮次压缩为表/列/条件摘要
+CONTEXT_SHIFT_KEEP_TURNS = int(os.getenv("CONTEXT_SHIFT_KEEP_TURNS", "1"))  # 检测到主题切换时保留的最近轮数
+
+# 数据库连接池（各数据库统一）
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))  # 启动预热及保留的最少连接数
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))  # 最大连接数
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))  # 连接耗尽时最长等待时间（秒）
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # 连接最长使用时间（秒），0表示不限
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # 空闲超过该时间的连接被关闭（秒），0表示不限
+DB_POOL_VALIDATE_AFTER = float(os.getenv("DB_POOL_VALIDATE_AFTER", "30"))  # 空闲超过该时间的连接取出前先检测（秒）
+
+# SQLite引擎（只读连接池）
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射读取的字节数，0表示不使用
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))  # 每个连接的页缓存大小（KiB）
+SQLITE_STATEMENT_CACHE = int(os.getenv("SQLITE_STATEMENT_CACHE", "256"))  # 每个连接缓存的预编译语句数
+SQLITE_IN_MEMORY = os.getenv("SQLITE_IN_MEMORY", "0") == "1"  # 启动时将数据库整体载入内存副本
+SQLITE_REPLICA_CHECK_INTERVAL = float(os.getenv("SQLITE_REPLICA_CHECK_INTERVAL", "5"))  # 内存副本检查源文件变化的间隔（秒），0表示不检查
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))  # 只读连接池的最大连接数（同时执行的查询数）
+SQLITE_ENABLE_WAL = os.getenv("SQLITE_ENABLE_WAL", "0") == "1"  # 启动时将数据库文件切换为WAL模式（会持久修改数据库文件）
+
+# 种子数据导入
+SEED_BATCH_ROWS = int(os.getenv("SEED_BATCH_ROWS", "5000"))  # 连续INSERT合并后每批写入的行数
+SEED_MYSQL_LOAD_DATA = os.getenv("SEED_MYSQL_LOAD_DATA", "0") == "1"  # MySQL使用 LOAD DATA LOCAL INFILE（需服务端开启local_infile）
+
+# 摘要统计下推：结果超过预览行数时由数据库计算平均/范围/唯一值个数，不读取完整结果
+SUMMARY_PUSHDOWN_ENABLED = os.getenv("SUMMARY_PUSHDOWN_ENABLED", "1") == "1"
+
 # 文件路径
 INPUT_QUERY_PATH = os.path.join(os.getcwd(), "integration/input/user_query.json")
 OUTPUT_SQL_PATH = os.path.join(os.getcwd(), "integration/sql/generated_sql.json")
@@ -0,0 +1,286 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from dataclasses import dataclass, field
+from functools import cached_property
+from types import MappingProxyType
+from typing import Dict, FrozenSet, Iterable, Mapping, Optional, Tuple
+from Text2SqlwithContext.src.basic_function.config import DB_SCHEMA_PATH
+
+_NUMERIC_TYPES = {'INT', 'INTEGER', 'TINYINT', 'SMALLINT', 'MEDIUMINT', 'BIGINT',
+                  'DECIMAL', 'NUMERIC', 'FLOAT', 'DOUBLE', 'REAL'}
+_TEMPORAL_TYPES = {'DATE', 'DATETIME', 'TIMESTAMP', 'TIME', 'YEAR'}
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    """列结构"""
+    name: str
+    type: str
+    description: str = ""
+    constraint: str = ""
+    default: Optional[str] = None
+    auto_increment: bool = False
+
+    @property
+    def base_type(self) -> str:
+        """去掉长度/枚举参数后的类型名，如 DECIMAL(5,2) -> DECIMAL"""
+        return re.split(r'[\s(]', self.type.strip(), 1)[0].upper()
+
+    @property
+    def is_numeric(self) -> bool:
+        return self.base_type in _NUMERIC_TYPES
+
+    @property
+    def is_temporal(self) -> bool:
+        return self.base_type in _TEMPORAL_TYPES
+
+    @property
+    def is_primary_key(self) -> bool:
+        return self.description.lower() == 'primary key' or 'PRIMARY KEY' in self.constraint.upper()
+
+    @property
+    def nullable(self) -> bool:
+        return 'NOT NULL' not in self.constraint.upper() and not self.is_primary_key
+
+    @property
+    def enum_values(self) -> Tuple[str, ...]:
+        if self.base_type != 'ENUM':
+            return ()
+        return tuple(re.findall(r"'((?:[^']|'')*)'", self.type))
+
+
+@dataclass(frozen=True)
+class TableInfo:
+    """表结构"""
+    name: str
+    columns: Tuple[ColumnInfo, ...]
+
+    @property
+    def column_names(self) -> Tuple[str, ...]:
+        return tuple(c.name for c in self.columns)
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        for c in self.columns:
+            if c.name == name:
+                return c
+        return None
+
+
+@dataclass(frozen=True)
+class RelationshipInfo:
+    """外键关系"""
+    from_table: str
+    from_column: str
+    to_table: str
+    to_column: str
+    constraint: str = ""
+
+
+@dataclass(frozen=True)
+class IndexInfo:
+    """索引"""
+    table: str
+    name: str
+    columns: Tuple[str, ...]
+    purpose: str = ""
+
+
+@dataclass(frozen=True)
+class SchemaSnapshot:
+    """
+    数据库结构的不可变快照
+    包含解析后的表/列/关系/索引、原始文本、紧凑的提示词渲染及内容摘要
+    """
+    tables: Tuple[TableInfo, ...]
+    relationships: Tuple[RelationshipInfo, ...]
+    indexes: Tuple[IndexInfo, ...]
+    raw_text: str
+    schema_hash: str
+    mtime: float
+    compact_text: str = field(default="", compare=False)
+
+    @property
+    def table_names(self) -> Tuple[str, ...]:
+        return tuple(t.name for t in self.tables)
+
+    def table(self, name: str) -> Optional[TableInfo]:
+        for t in self.tables:
+            if t.name == name:
+                return t
+        return None
+
+    @cached_property
+    def columns_by_name(self) -> Mapping[str, ColumnInfo]:
+        """列名 -> 列结构（同名列取第一张表中的定义）"""
+        result: Dict[str, ColumnInfo] = {}
+        for t in self.tables:
+            for c in t.columns:
+                result.setdefault(c.name, c)
+        return MappingProxyType(result)
+
+    @cached_property
+    def numeric_columns(self) -> FrozenSet[str]:
+        return frozenset(name for name, c in self.columns_by_name.items() if c.is_numeric)
+
+    @cached_property
+    def temporal_columns(self) -> FrozenSet[str]:
+        return frozenset(name for name, c in self.columns_by_name.items() if c.is_temporal)
+
+    def render(self, tables: Optional[Iterable[str]] = None,
+               columns: Optional[Dict[str, Iterable[str]]] = None) -> str:
+        """
+        渲染紧凑的结构描述（用于提示词）
+
+        参数:
+            tables: 需要渲染的表，缺省为全部
+            columns: 表 -> 需要保留的列，缺省为全部列
+        """
+        wanted = set(tables) if tables is not None else set(self.table_names)
+        return render_compact(self, wanted, columns)
+
+
+def render_compact(snapshot: SchemaSnapshot, wanted: set,
+                   columns: Optional[Dict[str, Iterable[str]]] = None) -> str:
+    """按表/列子集渲染结构描述"""
+    lines = []
+    for t in snapshot.tables:
+        if t.name not in wanted:
+            continue
+        keep = set(columns[t.name]) if columns and t.name in columns else None
+        lines.append(f"TABLE {t.name}:")
+        for c in t.columns:
+            if keep is not None and c.name not in keep:
+                continue
+            flags = []
+            if c.is_primary_key:
+                flags.append("PK")
+            elif not c.nullable:
+                flags.append("NOT NULL")
+            if c.auto_increment:
+                flags.append("AUTO_INCREMENT")
+            desc = c.description if c.description and not c.is_primary_key else ""
+            parts = [f"  {c.name} {c.type}"] + flags + ([f"-- {desc}"] if desc else [])
+            lines.append(" ".join(parts))
+    for r in snapshot.relationships:
+        if r.from_table in wanted and r.to_table in wanted:
+            lines.append(f"FK {r.from_table}.{r.from_column} -> {r.to_table}.{r.to_column}")
+    for idx in snapshot.indexes:
+        if idx.table in wanted:
+            lines.append(f"INDEX {idx.name} ON {idx.table}({', '.join(idx.columns)})")
+    return "\n".join(lines)
+
+
+def parse_schema(raw_text: str, mtime: float = 0.0) -> SchemaSnapshot:
+    """
+    解析 db_schema.json 文本
+
+    Args:
+        raw_text: 文件内容
+        mtime: 文件修改时间
+
+    Returns:
+        SchemaSnapshot: 不可变的结构快照
+    """
+    if not raw_text.strip():
+        raise ValueError("数据库结构文件为空")
+    data = json.loads(raw_text)
+    tables = tuple(
+        TableInfo(
+            name=t['table_name'],
+            columns=tuple(
+                ColumnInfo(
+                    name=c['name'],
+                    type=c.get('type', ''),
+                    description=c.get('description', ''),
+                    constraint=c.get('constraint', ''),
+                    default=c.get('default'),
+                    auto_increment=bool(c.get('auto_increment', False))
+                ) for c in t.get('columns', [])
+            )
+        ) for t in data.get('tables', [])
+    )
+    relationships = tuple(
+        RelationshipInfo(r['from_table'], r['from_column'], r['to_table'], r['to_column'], r.get('constraint', ''))
+        for r in data.get('relationships', [])
+    )
+    indexes = tuple(
+        IndexInfo(i['table'], i['name'], tuple(i.get('columns', [])), i.get('purpose', ''))
+        for i in data.get('indexes', [])
+    )
+    snapshot = SchemaSnapshot(
+        tables=tables,
+        relationships=relationships,
+        indexes=indexes,
+        raw_text=raw_text,
+        schema_hash=hashlib.sha256(raw_text.encode('utf-8')).hexdigest(),
+        mtime=mtime
+    )
+    # frozen dataclass，预先渲染后写入
+    object.__setattr__(snapshot, 'compact_text', snapshot.render())
+    return snapshot
+
+
+class SchemaRegistry:
+    """
+    数据库结构注册表
+    只解析一次 db_schema.json，文件修改时间或内容摘要变化时才重新加载
+    """
+
+    def __init__(self, path: str = DB_SCHEMA_PATH):
+        self.path = path
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self._stat: Optional[Tuple[float, int]] = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def get(self) -> SchemaSnapshot:
+        """
+        获取当前结构快照
+
+        Returns:
+            SchemaSnapshot: 当前快照（文件未变化时返回同一对象）
+
+        Raises:
+            OSError: 文件无法读取
+            ValueError: 文件为空或格式无效
+        """
+        st = os.stat(self.path)
+        stat_key = (st.st_mtime, st.st_size)
+        snapshot = self._snapshot
+        if snapshot is not None and stat_key == self._stat:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and stat_key == self._stat:
+                return self._snapshot
+            with open(self.path, 'r', encoding='utf-8') as f:
+                raw_text = f.read()
+            digest = hashlib.sha256(raw_text.encode('utf-8')).hexdigest()
+            # 仅修改时间变化、内容未变时沿用旧快照
+            if self._snapshot is None or digest != self._snapshot.schema_hash:
+                self._snapshot = parse_schema(raw_text, st.st_mtime)
+                self.reloads += 1
+            self._stat = stat_key
+            return self._snapshot
+
+
+# 全局注册表
+_registry: Optional[SchemaRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_schema_registry() -> SchemaRegistry:
+    """获取全局结构注册表"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = SchemaRegistry()
+    return _registry
+
+
+def get_schema_snapshot() -> SchemaSnapshot:
+    """获取当前数据库结构快照"""
+    return get_schema_registry().get()
@@ -0,0 +1,224 @@
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+from Text2SqlwithContext.src.basic_function.config import CHART_RENDER_WORKERS, CHART_RENDER_TIMEOUT, CHART_DPI
+
+
+def render_png(spec: dict, dpi: int = CHART_DPI) -> Optional[bytes]:
+    """
+    将图表描述渲染为PNG字节（Figure + Agg画布，不使用pyplot）
+
+    参数:
+        spec: build_*_chart_spec 生成的图表描述
+        dpi: 输出分辨率
+
+    返回:
+        PNG字节，无法绘制时返回None
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg # type: ignore
+    from Text2SqlwithContext.src.data_to_image.visualization import draw_chart
+
+    fig = draw_chart(spec)
+    if fig is None:
+        return None
+    FigureCanvasAgg(fig)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=dpi)
+    return buffer.getvalue()
+
+
+def _init_worker():
+    """渲染进程初始化：提前加载Agg后端、字体缓存和绘图模块"""
+    import matplotlib # type: ignore
+    matplotlib.use('Agg')
+    from matplotlib import font_manager # type: ignore
+    from Text2SqlwithContext.src.data_to_image import visualization  # noqa: F401 设置字体参数
+    for family in matplotlib.rcParams['font.sans-serif']:
+        try:
+            font_manager.findfont(family, fallback_to_default=True)
+        except Exception:
+            pass
+    # 渲染一张最小的图，完成文字排版相关的首次初始化
+    render_png({"type": "bar", "title": "预热", "xlabel": "", "ylabel": "", "figsize": [1, 1],
+                "x": ["a"], "series": [{"name": "v", "label": "v", "values": [1.0]}]}, dpi=10)
+
+
+def _ping():
+    return os.getpid()
+
+
+class ChartRenderer:
+    """
+    进程池图表渲染器
+    每个工作进程启动时已加载后端与字体，接收普通数据的图表描述并返回PNG字节，
+    多个请求的图表可在多个CPU核上并行渲染
+    """
+
+    def __init__(self, max_workers: int = CHART_RENDER_WORKERS, timeout: float = CHART_RENDER_TIMEOUT,
+                 warm: bool = True):
+        """
+        参数:
+            max_workers: 渲染进程数，0表示在调用线程中直接渲染
+            timeout: 单张图表渲染超时（秒）
+            warm: 是否在创建时预热全部工作进程
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.stats = {"rendered": 0, "failed": 0, "inline": 0, "pool_resets": 0}
+        if warm:
+            self.warm_up()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.max_workers <= 0:
+            return None
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn：Flask是多线程的，fork后的子进程可能继承被占用的锁
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_init_worker
+                    )
+        return self._executor
+
+    def warm_up(self):
+        """启动并预热全部工作进程"""
+        executor = self._get_executor()
+        if executor is None:
+            return
+        try:
+            futures = [executor.submit(_ping) for _ in range(self.max_workers)]
+            for f in futures:
+                f.result(timeout=max(self.timeout, 60))
+        except Exception as e:
+            print(f"图表渲染进程预热失败: {e}")
+
+    def render(self, spec: dict) -> Optional[bytes]:
+        """渲染单张图表"""
+        return self.render_many({"chart": spec}).get("chart")
+
+    def render_many(self, specs: Dict[str, dict]) -> Dict[str, bytes]:
+        """
+        并行渲染多张图表
+
+        参数:
+            specs: 图表类型 -> 图表描述
+
+        返回:
+            dict: 图表类型 -> PNG字节（渲染失败的图表不包含在内）
+        """
+        results: Dict[str, bytes] = {}
+        executor = self._get_executor()
+        if executor is None:
+            for name, spec in specs.items():
+                self._count("inline")
+                self._collect(results, name, self._render_inline(spec))
+            return results
+
+        pending = {name: spec for name, spec in specs.items() if spec}
+        pending = self._render_in_pool(executor, pending, results)
+        if pending:
+            # 工作进程崩溃（如段错误、被OOM终止）后进程池不可再用：换一个新进程池重试一次。
+            # 不在当前进程中渲染，以免导致崩溃的图表拖垮服务进程
+            self._reset_executor(executor)
+            retry = self._get_executor()
+            pending = self._render_in_pool(retry, pending, results)
+            if pending:
+                self._reset_executor(retry)
+                for name in pending:
+                    self._collect(results, name, None)
+        return results
+
+    def _render_in_pool(self, executor: ProcessPoolExecutor, specs: Dict[str, dict],
+                        results: Dict[str, bytes]) -> Dict[str, dict]:
+        """
+        在进程池中渲染，结果写入 results
+
+        返回:
+            因进程池损坏而未能渲染的图表
+        """
+        futures, broken = {}, {}
+        for name, spec in specs.items():
+            try:
+                futures[name] = executor.submit(render_png, spec)
+            except (BrokenProcessPool, RuntimeError) as e:
+                # RuntimeError：进程池已被其他线程关闭
+                print(f"图表渲染进程池不可用: {name}: {e}")
+                broken[name] = spec
+        for name, future in futures.items():
+            try:
+                png = future.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                print(f"图表渲染超时: {name}")
+                png = None
+            except BrokenProcessPool as e:
+                print(f"图表渲染进程异常退出: {name}: {e}")
+                broken[name] = specs[name]
+                continue
+            except Exception as e:
+                print(f"图表渲染失败: {name}: {e}")
+                png = None
+            self._collect(results, name, png)
+        return broken
+
+    def _reset_executor(self, broken: Optional[ProcessPoolExecutor]):
+        """丢弃已损坏的进程池，下次使用时重新创建"""
+        if broken is None:
+            return
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+                self.stats["pool_resets"] += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _render_inline(self, spec):
+        try:
+            return render_png(spec)
+        except Exception as e:
+            print(f"图表渲染失败: {e}")
+            return None
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _collect(self, results, name, png):
+        if png:
+            results[name] = png
+            self._count("rendered")
+        else:
+            self._count("failed")
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+# 全局渲染器
+_renderer: Optional[ChartRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """获取全局图表渲染器（首次调用时创建并预热进程池）"""
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ChartRenderer()
+    return _renderer
+
+
+def render_charts(specs: Dict[str, dict]) -> Dict[str, bytes]:
+    """使用全局渲染器渲染图表"""
+    return get_chart_renderer().render_many(specs)
@@ -0,0 +1,257 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+from Text2SqlwithContext.src.basic_function.config import (
+    CHART_STORE_MAX_BYTES, CHART_STORE_SPILL_DIR, CHART_DPI, CHART_SPEC_MAX_PENDING, CHART_SPEC_MAX_PENDING_BYTES
+)
+from Text2SqlwithContext.src.data_to_image.chart_renderer import render_charts
+
+
+def make_chart_id(spec: dict, dpi: int = CHART_DPI) -> str:
+    """
+    按内容生成图表ID：图表类型、数据和标签相同则ID相同
+
+    参数:
+        spec: 图表描述
+        dpi: 输出分辨率（影响PNG内容，一并计入）
+
+    返回:
+        32位十六进制摘要
+    """
+    canonical = json.dumps({"spec": spec, "dpi": dpi}, ensure_ascii=False, sort_keys=True,
+                           separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:32]
+
+
+def estimate_spec_bytes(spec: dict) -> int:
+    """按紧凑JSON长度估计图表描述占用的字节数"""
+    return len(json.dumps(spec, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8'))
+
+
+def is_chart_id(value: str) -> bool:
+    """校验图表ID格式（防止通过ID访问任意文件）"""
+    return len(value) == 32 and all(c in '0123456789abcdef' for c in value)
+
+
+class ChartStore:
+    """
+    内容寻址的图表存储
+    PNG字节保存在按总字节数限制的LRU中，淘汰时可选写入磁盘目录；
+    相同内容的图表只渲染一次，并发请求同一图表时等待同一次渲染；
+    浏览器渲染模式下只登记图表描述，PNG在首次下载时才生成
+    """
+
+    def __init__(self, max_bytes: int = CHART_STORE_MAX_BYTES, spill_dir: Optional[str] = CHART_STORE_SPILL_DIR or None,
+                 max_pending: int = CHART_SPEC_MAX_PENDING, max_pending_bytes: int = CHART_SPEC_MAX_PENDING_BYTES):
+        """
+        参数:
+            max_bytes: 内存中PNG总字节数上限
+            spill_dir: 淘汰图表的磁盘目录，为None时直接丢弃
+            max_pending: 尚未渲染的图表描述数量上限
+            max_pending_bytes: 尚未渲染的图表描述总字节数上限（描述中是完整数据，单个可能很大）
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_pending = max_pending
+        self.max_pending_bytes = max_pending_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._pending: "OrderedDict[str, Tuple[dict, int]]" = OrderedDict()  # 图表ID -> (描述, 估计字节数)
+        self._bytes = 0
+        self._pending_bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "spill_hits": 0, "misses": 0, "renders": 0, "evictions": 0, "spills": 0,
+                      "registered": 0, "lazy_renders": 0, "pending_evictions": 0}
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, chart_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{chart_id}.png")
+
+    def get(self, chart_id: str) -> Optional[bytes]:
+        """按ID获取PNG字节，内存未命中时查找磁盘目录"""
+        with self._lock:
+            png = self._entries.get(chart_id)
+            if png is not None:
+                self._entries.move_to_end(chart_id)
+                self.stats["hits"] += 1
+                return png
+        if self.spill_dir and is_chart_id(chart_id):
+            try:
+                with open(self._spill_path(chart_id), 'rb') as f:
+                    png = f.read()
+            except OSError:
+                png = None
+            if png is not None:
+                self.stats["spill_hits"] += 1
+                self.put(chart_id, png)
+                return png
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def __contains__(self, chart_id: str) -> bool:
+        with self._lock:
+            if chart_id in self._entries:
+                return True
+        return bool(self.spill_dir) and is_chart_id(chart_id) and os.path.exists(self._spill_path(chart_id))
+
+    def put(self, chart_id: str, png: bytes):
+        """保存PNG字节，超出上限时淘汰最久未使用的图表"""
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(chart_id, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[chart_id] = png
+            self._bytes += len(png)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_id, old_png = self._entries.popitem(last=False)
+                self._bytes -= len(old_png)
+                self.stats["evictions"] += 1
+                evicted.append((old_id, old_png))
+        if self.spill_dir:
+            for old_id, old_png in evicted:
+                self._spill(old_id, old_png)
+
+    def _spill(self, chart_id: str, png: bytes):
+        path = self._spill_path(chart_id)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+            self.stats["spills"] += 1
+        except OSError as e:
+            print(f"图表写入磁盘失败: {e}")
+
+    def store_charts(self, specs: Dict[str, dict]) -> Dict[str, str]:
+        """
+        保存一组图表，只渲染尚未存储的图表
+
+        参数:
+            specs: 图表类型 -> 图表描述
+
+        返回:
+            dict: 图表类型 -> 图表ID（渲染失败的图表不包含在内）
+        """
+        ids = {chart_type: make_chart_id(spec) for chart_type, spec in specs.items() if spec}
+        owned: Dict[str, Future] = {}
+        waiting: Dict[str, Future] = {}
+        to_render: Dict[str, dict] = {}
+        for chart_type, chart_id in ids.items():
+            if chart_id in self:
+                continue
+            with self._lock:
+                future = self._inflight.get(chart_id)
+                if future is None:
+                    if chart_id in owned:
+                        continue
+                    future = Future()
+                    self._inflight[chart_id] = future
+                    owned[chart_id] = future
+                    to_render[chart_id] = specs[chart_type]
+                elif chart_id not in owned:
+                    waiting[chart_id] = future
+
+        if to_render:
+            rendered: Dict[str, bytes] = {}
+            try:
+                rendered = render_charts(to_render)
+            finally:
+                # 无论成功与否都唤醒等待者
+                for chart_id, future in owned.items():
+                    png = rendered.get(chart_id)
+                    if png:
+                        self.put(chart_id, png)
+                        self.stats["renders"] += 1
+                    with self._lock:
+                        self._inflight.pop(chart_id, None)
+                    future.set_result(png is not None)
+
+        ok = {chart_id: future.result() for chart_id, future in waiting.items()}
+        result = {}
+        for chart_type, chart_id in ids.items():
+            if ok.get(chart_id, True) and chart_id in self:
+                result[chart_type] = chart_id
+        return result
+
+    def register_specs(self, specs: Dict[str, dict]) -> Dict[str, str]:
+        """
+        登记图表描述但不渲染（浏览器渲染模式），返回的ID可用于按需下载PNG
+
+        参数:
+            specs: 图表类型 -> 图表描述
+
+        返回:
+            dict: 图表类型 -> 图表ID
+        """
+        ids = {}
+        sized = {}
+        for chart_type, spec in specs.items():
+            if not spec:
+                continue
+            ids[chart_type] = make_chart_id(spec)
+            sized[chart_type] = (spec, estimate_spec_bytes(spec))
+        with self._lock:
+            for chart_type, chart_id in ids.items():
+                if chart_id in self._entries:
+                    continue
+                old = self._pending.pop(chart_id, None)
+                if old is not None:
+                    self._pending_bytes -= old[1]
+                self._pending[chart_id] = sized[chart_type]
+                self._pending_bytes += sized[chart_type][1]
+                self.stats["registered"] += 1
+            # 按数量和总字节数淘汰最早登记的描述（至少保留最新的一个）
+            while len(self._pending) > 1 and (len(self._pending) > self.max_pending
+                                              or self._pending_bytes > self.max_pending_bytes):
+                _, (_, size) = self._pending.popitem(last=False)
+                self._pending_bytes -= size
+                self.stats["pending_evictions"] += 1
+        return ids
+
+    def get_or_render(self, chart_id: str) -> Optional[bytes]:
+        """获取PNG字节，仅登记了描述的图表此时才渲染"""
+        png = self.get(chart_id)
+        if png is not None:
+            return png
+        with self._lock:
+            entry = self._pending.get(chart_id)
+        if entry is None:
+            return None
+        self.store_charts({chart_id: entry[0]})
+        with self._lock:
+            entry = self._pending.pop(chart_id, None)
+            if entry is not None:
+                self._pending_bytes -= entry[1]
+            self.stats["lazy_renders"] += 1
+        return self.get(chart_id)
+
+    def get_stats(self) -> dict:
+        """存储统计"""
+        with self._lock:
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                        pending=len(self._pending), pending_bytes=self._pending_bytes,
+                        max_pending_bytes=self.max_pending_bytes)
+
+
+# 全局图表存储
+_store: Optional[ChartStore] = None
+_store_lock = threading.Lock()
+
+
+def get_chart_store() -> ChartStore:
+    """获取全局图表存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ChartStore()
+    return _store
@@ -1,17 +1,41 @@
-import matplotlib.pyplot as plt # type: ignore
+import math
+import warnings
 import numpy as np
 import pandas as pd # type: ignore
+import matplotlib # type: ignore
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure # type: ignore
 from Text2SqlwithContext.src.sql_to_data.data_processing import translate_column, get_medical_unit
 
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
+# 设置中文字体（只修改rcParams，不使用pyplot全局状态）
+matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+matplotlib.rcParams['axes.unicode_minus'] = False
+warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib")
 
-def plot_bar_chart(df, x_column, y_columns,xlabel=None,ylabel=None,title=None, figsize=(10, 6)):
-    """绘制柱状图，支持多个Y列"""
+# 图表描述（spec）只包含可序列化的普通数据，可直接传给渲染进程：
+# {"type": "bar"|"line"|"pie", "title": str, "xlabel": str, "ylabel": str, "figsize": [w, h],
+#  "x": [...], "x_is_date": bool, "series": [{"name": str, "label": str, "unit": str, "values": [...]}]}
+
+def _to_float_list(values):
+    """转换为float列表，NaN/None保留为None"""
+    result = []
+    for v in values:
+        try:
+            f = float(v)
+        except (TypeError, ValueError):
+            result.append(None)
+            continue
+        result.append(None if math.isnan(f) else f)
+    return result
+
+def _to_label_list(values):
+    """转换为字符串标签列表"""
+    return ['' if v is None or (isinstance(v, float) and math.isnan(v)) else str(v) for v in values]
+
+def build_bar_chart_spec(df, x_column, y_columns, xlabel=None, ylabel=None, title=None, figsize=(10, 6)):
+    """生成柱状图描述，支持多个Y列"""
     # 输入验证
-    if df is None or df.empty or not isinstance(df, pd.DataFrame):
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         return None
 
     # 检查姓名列是否存在，若存在则强制设为X轴
@@ -20,171 +44,305 @@ def plot_bar_chart(df, x_column, y_columns,xlabel=None,ylabel=None,title=None, f
         if col in df.columns and col != x_column:
             x_column = col  # 优先使用姓名列
             break
-    
+
     # 排除无效列
-    valid_y = [col for col in y_columns if col not in ['patient_name', 'patient_id']]
+    valid_y = [col for col in y_columns if col not in ['patient_name', 'patient_id'] and col in df.columns]
     if not valid_y or x_column not in df.columns:
         return None
-    
-    # 创建图形对象
-    fig = plt.figure(figsize=figsize)
-    
-    try:
-        # 限制最多显示15个条目
-        if len(df) > 15:
-            df = df.head(15).copy()
-        
-        x = np.arange(len(df[x_column]))
-        bar_width = 0.8 / len(valid_y)
-        
-        # 绘制每个Y列的柱状图
-        for i, y_col in enumerate(valid_y):
-            if y_col not in df.columns:
-                continue
-                
-            # 计算位置偏移
-            offset = (i - len(valid_y)/2) * bar_width + bar_width/2
-            plt.bar(x + offset, df[y_col], width=bar_width, label=translate_column(y_col))
-        
-        # 设置图表属性
-        plt.xlabel(translate_column(x_column))
-        plt.ylabel('指标值')
-        plt.title(f"{translate_column(x_column)}指标对比", fontsize=14)
-        plt.xticks(x, df[x_column], rotation=45, ha='right')
-        plt.legend()
-        plt.tight_layout()
-        
-        return fig
-    except Exception as e:
-        plt.close(fig)
-        print(f"生成柱状图时出错: {str(e)}")
-        return None
 
-# 折线图函数修改
-def plot_line_chart(df, x_column, y_columns, xlabel=None, ylabel=None, title=None, figsize=(10, 6)):
-    """绘制折线图，支持多个Y列"""
+    # 限制最多显示15个条目
+    if len(df) > 15:
+        df = df.head(15)
+
+    return {
+        "type": "bar",
+        "title": f"{translate_column(x_column)}指标对比",
+        "xlabel": translate_column(x_column),
+        "ylabel": '指标值',
+        "figsize": list(figsize),
+        "x": _to_label_list(df[x_column].tolist()),
+        "x_is_date": False,
+        "series": [{
+            "name": y_col,
+            "label": translate_column(y_col),
+            "unit": get_medical_unit(y_col),
+            "values": _to_float_list(df[y_col].tolist())
+        } for y_col in valid_y]
+    }
+
+def build_line_chart_spec(df, x_column, y_columns, xlabel=None, ylabel=None, title=None, figsize=(10, 6)):
+    """生成折线图描述，支持多个Y列"""
     # 1. 输入验证增强
-    if df is None or df.empty or not isinstance(df, pd.DataFrame):
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         print("错误：输入数据为空或非DataFrame")
         return None
-    
-    # 排除无效列）
+
+    # 排除无效列
     invalid_cols = ['patient_name', 'patient_id', 'id', 'record_id']
     valid_y = [col for col in y_columns if col not in invalid_cols and col in df.columns]
     if not valid_y or x_column not in df.columns:
         print(f"错误：有效Y列({valid_y})或X列({x_column})不存在")
         return None
-    
+
     # 2. 数据预处理
     try:
-        df = df.sort_values(x_column).copy()  # 强制排序避免折线乱序
-        if pd.api.types.is_datetime64_any_dtype(df[x_column]):
-            df[x_column] = pd.to_datetime(df[x_column])  # 确保日期类型统一
-    except Exception as e:
-        print(f"数据预处理失败: {str(e)}")
-        return None
-    
-    # 3. 创建图形对象
-    fig = plt.figure(figsize=figsize)
-    
-    try:
-        # 单指标处理
-        if len(valid_y) == 1:
-            y_col = valid_y[0]
-            unit = get_medical_unit(y_col)
-            translated_y = translate_column(y_col)
-            
-            plt.plot(df[x_column], df[y_col], marker='o')
-            plt.title(title if title else f"{translated_y}趋势分析")
-            plt.xlabel(xlabel if xlabel else translate_column(x_column))
-            plt.ylabel(ylabel if ylabel else f"{translated_y} ({unit})" if unit else translated_y)
-            
-            if pd.api.types.is_datetime64_any_dtype(df[x_column]):
-                plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-                plt.gcf().autofmt_xdate()
-        
-        # 多指标处理
+        df = df.sort_values(x_column)  # 强制排序避免折线乱序
+        x_is_date = pd.api.types.is_datetime64_any_dtype(df[x_column])
+        if x_is_date:
+            x_values = [None if pd.isna(v) else pd.Timestamp(v).isoformat() for v in df[x_column]]
         else:
-            axes = [fig.add_subplot(len(valid_y), 1, i+1) for i in range(len(valid_y))]
-            
-            for ax, y_col in zip(axes, valid_y):
-                unit = get_medical_unit(y_col)
-                translated_y = translate_column(y_col)
-                
-                ax.plot(df[x_column], df[y_col], marker='o')
-                ax.set_ylabel(f"{translated_y} ({unit})" if unit else translated_y)
-                ax.grid(True)
-                
-                # 仅最后一张图显示x轴标签
-                if ax == axes[-1]:
-                    ax.set_xlabel(xlabel if xlabel else translate_column(x_column))
-                
-                if pd.api.types.is_datetime64_any_dtype(df[x_column]):
-                    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-            
-            plt.suptitle(title if title else "医疗指标趋势分析", fontsize=14)
-        
-        plt.tight_layout()
-        if len(valid_y) > 1:
-            plt.subplots_adjust(top=0.9)  # 为总标题留出空间
-        return fig
-        
+            x_values = df[x_column].tolist()
     except Exception as e:
-        plt.close(fig)
-        print(f"绘图过程中出错: {str(e)}")
+        print(f"数据预处理失败: {str(e)}")
         return None
 
-# 饼图函数
-def plot_pie_chart(df, column_name, figsize=(8, 8), title=None, values=None):
-    """绘制饼图，支持自定义值列（如count）"""
-    if df is None or df.empty or not isinstance(df, pd.DataFrame):
+    series = []
+    for y_col in valid_y:
+        unit = get_medical_unit(y_col)
+        translated_y = translate_column(y_col)
+        series.append({
+            "name": y_col,
+            "label": f"{translated_y} ({unit})" if unit else translated_y,
+            "unit": unit,
+            "values": _to_float_list(df[y_col].tolist())
+        })
+
+    if len(valid_y) == 1:
+        translated_y = translate_column(valid_y[0])
+        default_title = f"{translated_y}趋势分析"
+        default_ylabel = series[0]["label"]
+    else:
+        default_title = "医疗指标趋势分析"
+        default_ylabel = ""
+
+    return {
+        "type": "line",
+        "title": title if title else default_title,
+        "xlabel": xlabel if xlabel else translate_column(x_column),
+        "ylabel": ylabel if ylabel else default_ylabel,
+        "figsize": list(figsize),
+        "x": x_values,
+        "x_is_date": bool(x_is_date),
+        "series": series
+    }
+
+def build_pie_chart_spec(df, column_name, figsize=(8, 8), title=None, values=None):
+    """生成饼图描述，支持自定义值列（如count）"""
+    if df is None or not isinstance(df, pd.DataFrame) or df.empty:
         return None
-    
+
     if column_name in ['patient_name', 'patient_id']:
         return None
-        
+
     if column_name not in df.columns:
         return None
-    
-    fig = plt.figure(figsize=figsize)
-    
+
+    # 支持自定义值列（如count）
+    if values and values in df.columns:
+        sizes = df[values].tolist()
+        labels = df[column_name].tolist()
+    else:
+        # 默认行为：计算value_counts
+        counts = df[column_name].value_counts()
+        if len(counts) > 8:
+            others_count = counts[8:].sum()
+            counts = counts.head(7)
+            counts["其他"] = others_count
+        sizes = counts.tolist()
+        labels = counts.index.tolist()
+
+    # 确保至少有两个类别
+    if len(sizes) < 2:
+        return None
+
+    return {
+        "type": "pie",
+        "title": f"{translate_column(column_name)}分布",
+        "xlabel": "",
+        "ylabel": "",
+        "figsize": list(figsize),
+        "x": _to_label_list(labels),
+        "x_is_date": False,
+        "series": [{
+            "name": values or column_name,
+            "label": translate_column(values or column_name),
+            "unit": "人",
+            "values": _to_float_list(sizes)
+        }]
+    }
+
+def _lttb_indices(values, threshold):
+    """
+    Largest-Triangle-Three-Buckets 降采样，返回保留点的下标
+    以下标作为x坐标，保留曲线的峰谷形状
+    """
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    ys = [0.0 if v is None else v for v in values]
+    indices = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 下一个桶的平均点
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        if next_start >= next_end:
+            next_start, next_end = n - 1, n
+        avg_x = (next_start + next_end - 1) / 2.0
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        # 当前桶中与上一个选中点、下一个桶平均点构成最大三角形的点
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((a - avg_x) * (ys[j] - ys[a]) - (a - j) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+def to_client_spec(spec, max_points=500):
+    """
+    生成供浏览器渲染的图表描述：折线图按 max_points 降采样，其余图表原样返回
+
+    参数:
+        spec: build_*_chart_spec 生成的图表描述
+        max_points: 每条折线保留的最大点数
+
+    返回:
+        新的图表描述，附带 total_points 和 downsampled 字段
+    """
+    if not spec:
+        return None
+    total = len(spec.get("x") or [])
+    client = dict(spec, total_points=total, downsampled=False)
+    if spec.get("type") != "line" or total <= max_points:
+        return client
+    # 多条折线共用x轴，按第一条折线的形状选点
+    keep = _lttb_indices(spec["series"][0]["values"], max_points)
+    client["x"] = [spec["x"][i] for i in keep]
+    client["series"] = [dict(s, values=[s["values"][i] for i in keep]) for s in spec["series"]]
+    client["downsampled"] = True
+    return client
+
+def _draw_bar(fig, spec):
+    ax = fig.add_subplot(1, 1, 1)
+    series = spec["series"]
+    x = np.arange(len(spec["x"]))
+    bar_width = 0.8 / len(series)
+
+    # 绘制每个Y列的柱状图
+    for i, s in enumerate(series):
+        # 计算位置偏移
+        offset = (i - len(series)/2) * bar_width + bar_width/2
+        heights = [np.nan if v is None else v for v in s["values"]]
+        ax.bar(x + offset, heights, width=bar_width, label=s["label"])
+
+    # 设置图表属性
+    ax.set_xlabel(spec["xlabel"])
+    ax.set_ylabel(spec["ylabel"])
+    ax.set_title(spec["title"], fontsize=14)
+    ax.set_xticks(x)
+    ax.set_xticklabels(spec["x"], rotation=45, ha='right')
+    ax.legend()
+    fig.tight_layout()
+
+def _line_x(spec):
+    if spec.get("x_is_date"):
+        return np.array(spec["x"], dtype='datetime64[ns]')
+    return spec["x"]
+
+def _draw_line(fig, spec):
+    x = _line_x(spec)
+    series = spec["series"]
+    is_date = spec.get("x_is_date")
+
+    # 单指标处理
+    if len(series) == 1:
+        ax = fig.add_subplot(1, 1, 1)
+        y = [np.nan if v is None else v for v in series[0]["values"]]
+        ax.plot(x, y, marker='o')
+        ax.set_title(spec["title"])
+        ax.set_xlabel(spec["xlabel"])
+        ax.set_ylabel(spec["ylabel"])
+        if is_date:
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+            fig.autofmt_xdate()
+        fig.tight_layout()
+        return
+
+    # 多指标处理
+    axes = [fig.add_subplot(len(series), 1, i+1) for i in range(len(series))]
+    for ax, s in zip(axes, series):
+        y = [np.nan if v is None else v for v in s["values"]]
+        ax.plot(x, y, marker='o')
+        ax.set_ylabel(s["label"])
+        ax.grid(True)
+
+        # 仅最后一张图显示x轴标签
+        if ax is axes[-1]:
+            ax.set_xlabel(spec["xlabel"])
+
+        if is_date:
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+
+    fig.suptitle(spec["title"], fontsize=14)
+    fig.tight_layout()
+    fig.subplots_adjust(top=0.9)  # 为总标题留出空间
+
+def _draw_pie(fig, spec):
+    ax = fig.add_subplot(1, 1, 1)
+    s = spec["series"][0]
+    sizes = [0.0 if v is None else v for v in s["values"]]
+    unit = s.get("unit") or ""
+    total = sum(sizes)
+
+    def my_autopct(pct):
+        val = int(round(pct*total/100.0))
+        return f'{pct:.1f}%\n({val}{unit})'
+
+    ax.pie(sizes,
+           labels=spec["x"],
+           autopct=my_autopct,
+           startangle=90)
+
+    ax.set_title(spec["title"], fontsize=14)
+    ax.axis('equal')
+
+_DRAWERS = {"bar": _draw_bar, "line": _draw_line, "pie": _draw_pie}
+
+def draw_chart(spec):
+    """
+    按图表描述绘制独立的Figure对象（面向对象API，不涉及pyplot全局状态，可在多线程中使用）
+
+    参数:
+        spec: build_*_chart_spec 生成的图表描述
+
+    返回:
+        Figure对象，出错时返回None
+    """
+    if not spec or spec.get("type") not in _DRAWERS:
+        return None
+    fig = Figure(figsize=tuple(spec.get("figsize") or (10, 6)))
     try:
-        # 新增：支持自定义值列（如count）
-        if values and values in df.columns:
-            sizes = df[values]
-            labels = df[column_name]
-        else:
-            # 默认行为：计算value_counts
-            counts = df[column_name].value_counts()
-            if len(counts) > 8:
-                others_count = counts[8:].sum()
-                counts = counts.head(7)
-                counts["其他"] = others_count
-            sizes = counts
-            labels = counts.index
-        
-        # 确保至少有两个类别
-        if len(sizes) < 2:
-            plt.close(fig)
-            return None
-            
-        def make_autopct(values):
-            def my_autopct(pct):
-                total = sum(values)
-                val = int(round(pct*total/100.0))
-                return f'{pct:.1f}%\n({val}人)'
-            return my_autopct
-        
-        plt.pie(sizes, 
-                labels=labels, 
-                autopct=make_autopct(sizes),
-                startangle=90)
-        
-        plt.title(f"{translate_column(column_name)}分布", fontsize=14)
-        plt.axis('equal')
-        
+        _DRAWERS[spec["type"]](fig, spec)
         return fig
     except Exception as e:
-        plt.close(fig)
-        print(f"生成饼图时出错: {str(e)}")
+        print(f"生成{spec.get('type')}图时出错: {str(e)}")
         return None
+
+def plot_bar_chart(df, x_column, y_columns, xlabel=None, ylabel=None, title=None, figsize=(10, 6)):
+    """绘制柱状图，支持多个Y列"""
+    return draw_chart(build_bar_chart_spec(df, x_column, y_columns, xlabel, ylabel, title, figsize))
+
+def plot_line_chart(df, x_column, y_columns, xlabel=None, ylabel=None, title=None, figsize=(10, 6)):
+    """绘制折线图，支持多个Y列"""
+    return draw_chart(build_line_chart_spec(df, x_column, y_columns, xlabel, ylabel, title, figsize))
+
+def plot_pie_chart(df, column_name, figsize=(8, 8), title=None, values=None):
+    """绘制饼图，支持自定义值列（如count）"""
+    return draw_chart(build_pie_chart_spec(df, column_name, figsize, title, values))
@@ -1,4 +1,5 @@
 import os
+import multiprocessing
 
 from pathlib import Path
 from src.basic_function.set_env import update_env_vars
@@ -6,7 +7,10 @@ from src.sql_to_data.sql_processor import SQLProcessor
 from src.nlp_to_sql.json_handler import read_json, write_json
 from src.nlp_to_sql.sql_generator import generate_sql_from_nl
 from src.nlp_to_sql.context_manager import ContextualConversation
-import matplotlib.pyplot as plt  # type: ignore # 加这一行
+from src.nlp_to_sql.schema_linker import link_schema
+from src.basic_function.schema_registry import get_schema_snapshot
+from src.basic_function.config import SQL_AUDIT_PATH
+from src.data_to_image.chart_renderer import render_charts
 import matplotlib # type: ignore
 matplotlib.use('Agg')  # 不用Tk，不弹窗，适合服务器和无界面环境
 import pandas as pd # type: ignore
@@ -14,21 +18,21 @@ import pandas as pd # type: ignore
 #设置env文件
 # update_env_vars(env_path=".env")
 
-# 初始化上下文管理器
-context_manager = ContextualConversation()
+# 初始化上下文管理器（图表渲染进程以spawn方式重新执行本模块时不创建会话存储）
+context_manager = ContextualConversation() if multiprocessing.parent_process() is None else None
 session_id = "user_session"  # 可根据实际需求动态生成
 
 def get_project_root():
     """获取项目根目录路径 (Text2SqlWithContext)"""
     return Path(__file__).resolve().parent.parent
 
-def run_sql_processor(sql_file_path):
-    """执行SQL并展示结果"""
+def run_sql_processor(generated_sql, query_meta=None):
+    """执行SQL并展示结果（SQL直接在内存中传递给处理器）"""
     print("\n" + "="*80)
     print("开始执行SQL并分析结果...")
     print("="*80)
     
-    processor = SQLProcessor(sql_file_path)
+    processor = SQLProcessor.from_sql(generated_sql, query_meta, audit_path=SQL_AUDIT_PATH or None)
     result = processor.process()
     
     if result['status'] == 'error':
@@ -40,17 +44,18 @@ def run_sql_processor(sql_file_path):
     print("医疗数据分析摘要:")
     print("="*80)
     print(result['summary'])
+    if result.get('truncated'):
+        print(f"（查询结果超过读取上限，仅分析了前{result['row_count']}行）")
     
     # 显示图表
     if processor.charts:
         print("\n" + "="*80)
         print("生成的数据可视化图表:")
         print("="*80)
-        for chart_type, fig in processor.charts.items():
-            if fig:  # 确保图表有效
-                plt.figure(fig.number)
-                plt.savefig(f"integration/output/{chart_type}_chart.png")
-                plt.close()
+        os.makedirs("integration/output", exist_ok=True)
+        for chart_type, png in render_charts(processor.charts).items():
+            with open(f"integration/output/{chart_type}_chart.png", 'wb') as f:
+                f.write(png)
     else:
         print("\n未生成任何图表")
     
@@ -70,15 +75,6 @@ def run_sql_processor(sql_file_path):
 
 def process_query_multi_turn():
     """处理多轮对话的SQL生成过程"""
-    project_root = get_project_root()
-    
-    # 构建正确的文件路径
-    db_schema_path = project_root / "integration" / "input" / "db_schema.json"
-    sql_output_path = project_root / "integration" / "sql" / "results.json"
-    
-    # 确保输出目录存在
-    sql_output_path.parent.mkdir(parents=True, exist_ok=True)
-    
     print("欢迎使用text2sql系统，输入 exit 退出。")
     
     while True:
@@ -91,21 +87,24 @@ def process_query_multi_turn():
             continue
 
         try:
-            with open(db_schema_path, "r", encoding="utf-8") as f:
-                db_schema = f.read()
-            if not db_schema.strip():
-                print("数据库结构文件为空，请检查文件内容。")
-                continue
+            # 结构文件只在修改后重新解析
+            schema_snapshot = get_schema_snapshot()
+        except ValueError as e:
+            print(f"数据库结构文件无效，请检查文件内容: {e}")
+            continue
         except Exception as e:
             print(f"读取数据库结构文件失败: {e}")
             continue
 
         # 上下文增强
         enhanced_query = context_manager.enhance_query(session_id, nl_query)
+        # 模式链接：仅向LLM发送相关的表和列
+        link_result = link_schema(enhanced_query, schema_snapshot)
         query_data = {
             "query_id": "q_user",
             "natural_language_query": enhanced_query,
-            "database_schema": db_schema
+            "database_schema": link_result.schema_text,
+            "schema_hash": link_result.schema_hash
         }
 
         # 先判断是否需要澄清
@@ -126,35 +125,18 @@ def process_query_multi_turn():
 
         # 不需要澄清，生成SQL并导出
         if result.get("status") == "success":
-            output_dir = os.path.dirname("integration/sql/generated_sql.json")
-            generated_sql_path = os.path.join(output_dir, "generated_sql.json")
-            results_path = os.path.join(output_dir, "results.json")
+            generated_sql_path = "integration/sql/generated_sql.json"
             
             # 写入 generated_sql.json
             if write_json(result, generated_sql_path):
                 print("结果已保存到: generated_sql.json")
             else:
                 print("结果保存失败")
-            # 写入 results.json，只保留 generated_sql 字段
-            results = {
-                "generated_sql": result.get("generated_sql", ""),
-            }
-            if write_json(results, results_path):
-                print("仅SQL结果已保存到: results.json")
-            else:
-                print("仅SQL结果保存失败")
             generated_sql = result.get("generated_sql")
             print("生成的SQL:", generated_sql)
             
-            # 保存SQL到文件
-            save_result = write_json(result, sql_output_path)
-            if save_result:
-                print(f"结果已保存到: {sql_output_path}")
-                
-                # 立即执行SQL并展示结果
-                run_sql_processor(sql_output_path)
-            else:
-                print("结果保存失败")
+            # 立即执行SQL并展示结果
+            run_sql_processor(generated_sql, result)
             
             # 记录历史
             context_manager.add_history(session_id, nl_query, generated_sql, result)
@@ -166,33 +148,28 @@ def process_query_multi_turn():
                 
                 # 上下文增强
                 enhanced_follow_up = context_manager.enhance_query(session_id, follow_up)
+                follow_up_link = link_schema(enhanced_follow_up, schema_snapshot)
                 follow_up_data = {
                     "query_id": "q_user_followup",
                     "natural_language_query": enhanced_follow_up,
-                    "database_schema": db_schema,
+                    "database_schema": follow_up_link.schema_text,
+                    "schema_hash": follow_up_link.schema_hash,
                     "previous_sql": generated_sql
                 }
                 
                 follow_up_result = generate_sql_from_nl(follow_up_data)
                 if follow_up_result.get("status") == "success":
                     print("完善后的SQL:", follow_up_result.get("generated_sql"))
-                    # 仅当生成的SQL没有包含“生成错误”时才写入results文件
+                    # 仅当生成的SQL没有包含“生成错误”时才执行
                     generated_sql = follow_up_result.get("generated_sql", "")
                     if write_json(follow_up_result, "integration/sql/generated_sql.json"):
                         print("结果已保存到: generated_sql.json")
                     else:
                         print("结果保存失败")
                     if "生成错误" not in str(generated_sql):
-                        results = {
-                            "generated_sql": generated_sql,
-                        }
-                        if write_json(results, results_path):
-                            print("仅SQL结果已保存到: results.json")
-                            run_sql_processor(sql_output_path)
-                        else:
-                            print("仅SQL结果保存失败")
+                        run_sql_processor(generated_sql, follow_up_result)
                     else:
-                        print("生成的SQL包含错误，未保存到results.json")
+                        print("生成的SQL包含错误，跳过执行")
                     context_manager.add_history(session_id, follow_up, generated_sql, follow_up_result)
                     result = follow_up_result  # 更新result以便多轮补充
                     new_sql = follow_up_result.get("generated_sql")
@@ -0,0 +1,186 @@
+import time
+import asyncio
+import threading
+import weakref
+from typing import Dict, Optional
+import httpx # type: ignore
+from openai import AsyncOpenAI # type: ignore
+from Text2SqlwithContext.src.basic_function.config import (
+    OPENAI_API_KEY, OPENAI_API_BASE, MODEL_NAME, LLM_MAX_CONCURRENCY, LLM_MAX_CONNECTIONS, LLM_TIMEOUT
+)
+from Text2SqlwithContext.src.nlp_to_sql.llm_cache import make_cache_key
+from Text2SqlwithContext.src.nlp_to_sql.llm_client import (
+    TEMPERATURE, build_prompts, resolve_schema_hash, lookup_cached, store_cached
+)
+
+
+class AsyncLLMClient:
+    """
+    基于 AsyncOpenAI 的异步LLM客户端
+    共享httpx连接池，信号量限制并发，相同提示的并发请求合并为一次调用（singleflight）
+    """
+
+    def __init__(self, api_key: Optional[str] = OPENAI_API_KEY, base_url: str = OPENAI_API_BASE,
+                 model: str = MODEL_NAME, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_connections: int = LLM_MAX_CONNECTIONS, timeout: float = LLM_TIMEOUT,
+                 http_client: Optional[httpx.AsyncClient] = None):
+        """
+        初始化客户端（需在事件循环中使用，且只绑定一个事件循环）
+
+        参数:
+            api_key: API密钥
+            base_url: OpenAI兼容接口地址，可指向本地桩服务
+            model: 模型名称
+            max_concurrency: 同时进行的上游请求上限
+            max_connections: httpx连接池大小
+            timeout: 请求超时（秒）
+            http_client: 外部提供的httpx.AsyncClient
+        """
+        self.model = model
+        self.http_client = http_client or httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout
+        )
+        self.client = AsyncOpenAI(api_key=api_key or "EMPTY", base_url=base_url, http_client=self.http_client)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "upstream_calls": 0, "errors": 0}
+
+    async def call(self, natural_language_query, schema_info=None, schema_hash=None) -> dict:
+        """
+        异步调用模型将自然语言转换为SQL
+
+        Args:
+            natural_language_query (str): 用户的自然语言查询
+            schema_info (str, optional): 数据库结构信息
+            schema_hash (str, optional): 数据库结构摘要
+
+        Returns:
+            dict: 与 call_llm_model 相同格式的结果
+        """
+        start_time = time.time()
+        self.stats["requests"] += 1
+        system_prompt, user_prompt = build_prompts(natural_language_query, schema_info)
+        schema_hash = resolve_schema_hash(schema_info, schema_hash)
+        cache_key = make_cache_key(system_prompt, user_prompt, schema_hash, self.model, TEMPERATURE)
+
+        cached = lookup_cached(cache_key, schema_hash, start_time)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return cached
+
+        # 相同提示已在请求中，等待同一个future
+        pending = self._inflight.get(cache_key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            result = dict(await asyncio.shield(pending))
+            result["metadata"] = dict(result.get("metadata", {}), coalesced=True)
+            return result
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await self._request(system_prompt, user_prompt, start_time)
+            if result["success"]:
+                store_cached(cache_key, schema_hash, result)
+            future.set_result(result)
+            return dict(result)
+        except BaseException as e:
+            # 取消等情况下也要唤醒等待者
+            future.set_result(self._error_result(e))
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def _request(self, system_prompt: str, user_prompt: str, start_time: float) -> dict:
+        async with self._semaphore:
+            self.stats["upstream_calls"] += 1
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=TEMPERATURE
+                )
+            except Exception as e:
+                self.stats["errors"] += 1
+                return self._error_result(e)
+        return {
+            "generated_sql": response.choices[0].message.content.strip(),
+            "success": True,
+            "metadata": {
+                "model": self.model,
+                "processing_time_ms": int((time.time() - start_time) * 1000),
+                "cache_hit": False
+            }
+        }
+
+    def _error_result(self, error: BaseException) -> dict:
+        return {
+            "generated_sql": None,
+            "success": False,
+            "error": str(error) or error.__class__.__name__,
+            "metadata": {
+                "model": self.model
+            }
+        }
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self.client.close()
+        await self.http_client.aclose()
+
+
+# 每个事件循环一个客户端（信号量和future不能跨事件循环使用）
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncLLMClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_llm_client() -> AsyncLLMClient:
+    """获取当前事件循环对应的共享客户端"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = AsyncLLMClient()
+        _clients[loop] = client
+    return client
+
+
+class _BackgroundLoop:
+    """在后台线程中运行的事件循环，供同步代码提交协程"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True)
+                    thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """在后台事件循环中执行协程并阻塞等待结果"""
+        future = asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+        return future.result(timeout)
+
+
+_background_loop = _BackgroundLoop()
+
+
+def run_sync(coro, timeout: Optional[float] = None):
+    """
+    同步执行协程（Flask工作线程与命令行共用同一个后台事件循环，
+    因此不同线程的相同请求也能被合并）
+    """
+    return _background_loop.run(coro, timeout)
+
+
+async def call_llm_model_async(natural_language_query, schema_info=None, schema_hash=None) -> dict:
+    """call_llm_model 的异步版本"""
+    return await get_async_llm_client().call(natural_language_query, schema_info, schema_hash)
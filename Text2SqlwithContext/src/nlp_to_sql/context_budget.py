@@ -0,0 +1,181 @@
+import re
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 估计token数：中文（含全角标点）每字约1个token，英文单词约每4个字母1个，数字约每3位1个，其他符号各1个
+_TOKEN_RE = re.compile(r"[　-〿一-鿿＀-￯]|[A-Za-z]+|\d+|\S")
+_WHERE_RE = re.compile(r"\bWHERE\b(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bUNION\b|\)\s*$|;|$)",
+                       re.IGNORECASE | re.DOTALL)
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([\w.`\"\[\]]+)", re.IGNORECASE)
+
+# 摘要中问题和条件的最大字符数
+_QUESTION_CHARS = 40
+_FILTER_CHARS = 80
+# 每轮的序号前缀和缩进（"  [1] "）约占的token数
+_TURN_PREFIX_TOKENS = 4
+# 实体行最多占用预算的比例
+_ENTITY_SHARE = 0.25
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """本地估计文本的token数（不调用分词器），用于控制提示长度"""
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if piece.isascii() and piece.isalpha():
+            tokens += math.ceil(len(piece) / 4)
+        elif piece.isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
+
+
+_OMITTED_LINE_TOKENS = estimate_tokens("  （更早的 100 轮已省略）")
+
+
+def _shorten(text: str, limit: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def sql_digest(sql: str, tables: Optional[Sequence[str]] = None, columns: Optional[Sequence[str]] = None) -> str:
+    """
+    将SQL压缩为 表/列/条件 摘要
+
+    参数:
+        sql: SQL语句
+        tables: 已解析出的表名，缺省按 FROM/JOIN 匹配
+        columns: 已解析出的查询列
+
+    返回:
+        如 "表: medical_checkup; 列: age, bmi; 条件: gender = '男' AND age > 60"
+    """
+    if not sql:
+        return "未生成SQL"
+    if not tables:
+        tables = [t.strip('`"[]').split(".")[-1] for t in _TABLE_RE.findall(sql)]
+    parts = []
+    if tables:
+        parts.append("表: " + ", ".join(dict.fromkeys(tables)))
+    if columns:
+        parts.append("列: " + ", ".join(dict.fromkeys(c for c in columns if c)))
+    match = _WHERE_RE.search(sql)
+    if match and match.group(1).strip():
+        parts.append("条件: " + _shorten(match.group(1), _FILTER_CHARS))
+    return "; ".join(parts) or _shorten(sql, _FILTER_CHARS)
+
+
+def turn_texts(user_query: str, generated_sql: str, digest: str) -> Tuple[str, str]:
+    """一轮对话的完整形式和摘要形式（不含序号前缀）"""
+    full = f"用户: {user_query}\n      SQL: {generated_sql}"
+    short = f"用户: {_shorten(user_query, _QUESTION_CHARS)} → {digest}"
+    return full, short
+
+
+def summarize_turn(user_query: str, generated_sql: str, tables: Optional[Sequence[str]] = None,
+                   columns: Optional[Sequence[str]] = None) -> Dict[str, object]:
+    """
+    在写入历史时预先计算该轮的摘要和token数，构建上下文时不再解析SQL
+
+    返回:
+        {"digest": 摘要, "tokens": {"full": 完整形式token数, "digest": 摘要形式token数}}
+    """
+    digest = sql_digest(generated_sql, tables, columns)
+    full, short = turn_texts(user_query, generated_sql, digest)
+    return {"digest": digest, "tokens": {"full": estimate_tokens(full), "digest": estimate_tokens(short)}}
+
+
+def _entity_line(entities: dict, budget: int) -> Tuple[str, int, int]:
+    """按出现次数从高到低列出实体，直到用完预算；返回 (文本, 列出数, 省略数)"""
+    ranked = sorted(entities.items(), key=lambda item: -(item[1] or {}).get("count", 0))
+    prefix = "当前对话涉及的实体: "
+    used = estimate_tokens(prefix)
+    shown = []
+    for name, info in ranked:
+        info = info or {}
+        columns = info.get("columns") or []
+        text = f"{name}({','.join(columns)})" if columns else name
+        if info.get("count", 0) > 1:
+            text += f"×{info['count']}"
+        cost = estimate_tokens(text) + 1
+        if used + cost > budget:
+            break
+        shown.append(text)
+        used += cost
+    if not shown:
+        return "", 0, len(ranked)
+    return prefix + ", ".join(shown), len(shown), len(ranked) - len(shown)
+
+
+def build_context(entities: dict, history: Sequence[dict], budget: int, full_turns: int) -> Tuple[str, Dict]:
+    """
+    在token预算内构建对话上下文：最近 full_turns 轮保留问题和完整SQL，更早的轮次使用写入历史时
+    预先计算的表/列/条件摘要，预算用完后省略更早的轮次
+
+    参数:
+        entities: 会话实体映射
+        history: 历史记录（从旧到新）
+        budget: token预算，<=0 表示不限
+        full_turns: 保留完整SQL的最近轮数
+
+    返回:
+        (上下文文本, 统计信息)
+    """
+    start = time.perf_counter()
+    unlimited = budget <= 0
+    header = "最近的对话历史:"
+    used = estimate_tokens(header)
+
+    lines, entity_text = [], ""
+    entities_shown = entities_omitted = 0
+    if entities:
+        entity_budget = math.inf if unlimited else int(budget * _ENTITY_SHARE)
+        entity_text, entities_shown, entities_omitted = _entity_line(entities, entity_budget)
+        used += estimate_tokens(entity_text)
+    # 为"更早的轮次已省略"一行预留预算
+    limit = math.inf if unlimited else budget - _OMITTED_LINE_TOKENS
+
+    turn_lines: List[str] = []
+    full = digested = 0
+    turns = list(reversed(history))
+    for i, entry in enumerate(turns):
+        summary = entry.get("digest")
+        tokens = entry.get("tokens")
+        if summary is None or tokens is None:
+            # 旧数据（如从文件导入的历史）没有预先计算的摘要
+            computed = summarize_turn(entry.get("user_query", ""), entry.get("generated_sql", ""))
+            summary, tokens = computed["digest"], computed["tokens"]
+        full_text, short_text = turn_texts(entry.get("user_query", ""), entry.get("generated_sql", ""), summary)
+        if i < full_turns and used + tokens["full"] + _TURN_PREFIX_TOKENS <= limit:
+            text, cost = full_text, tokens["full"]
+            full += 1
+        elif used + tokens["digest"] + _TURN_PREFIX_TOKENS <= limit:
+            text, cost = short_text, tokens["digest"]
+            digested += 1
+        else:
+            break
+        turn_lines.append(f"  [{i + 1}] {text}")
+        used += cost + _TURN_PREFIX_TOKENS
+
+    omitted = len(turns) - full - digested
+    if entity_text:
+        lines.append(entity_text)
+    lines.append(header)
+    lines.extend(turn_lines)
+    if omitted:
+        lines.append(f"  （更早的 {omitted} 轮已省略）")
+        used += estimate_tokens(lines[-1])
+    # token数由各部分预先计算的估计值累加，不再扫描整段文本
+    return "\n".join(lines), {
+        "budget": budget,
+        "context_tokens": used,
+        "turns_full": full,
+        "turns_digest": digested,
+        "turns_omitted": omitted,
+        "entities_shown": entities_shown,
+        "entities_omitted": entities_omitted,
+        "build_ms": round((time.perf_counter() - start) * 1000, 3)
+    }
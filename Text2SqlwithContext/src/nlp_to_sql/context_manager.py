@@ -1,30 +1,73 @@
 import re
 import json
+import threading
 from datetime import datetime
 from collections import deque
 from typing import Dict, List, Tuple, Optional
 import sqlparse # type: ignore
 from sqlparse.sql import IdentifierList, Identifier, TokenList # type: ignore
 from sqlparse.tokens import Keyword, DML # type: ignore
+from Text2SqlwithContext.src.basic_function.config import (
+    CONTEXT_SESSION_TIMEOUT, CONTEXT_MAX_SESSIONS, CONTEXT_TOKEN_BUDGET, CONTEXT_FULL_TURNS,
+    CONTEXT_SHIFT_KEEP_TURNS
+)
+from Text2SqlwithContext.src.nlp_to_sql.session_store import SessionStore, create_session_store
+from Text2SqlwithContext.src.nlp_to_sql.context_budget import build_context, estimate_tokens, summarize_turn
+
+# 会话锁分段数：同一会话的操作串行，不同会话（除哈希冲突外）互不阻塞
+_SESSION_LOCK_STRIPES = 64
+# 指代上文的代词：出现时视为追问，不判定为主题切换
+_PRONOUNS = ["这个", "这些", "它", "它们", "其", "该"]
+# 追问常用的开头：在上一轮结果上调整分组、过滤或统计方式
+_FOLLOW_UP_PREFIXES = ("按", "只", "仅", "再", "那", "其中", "还有", "换成", "改为", "改成", "分别", "同样", "然后", "并且")
+_STOPWORDS = {"的", "是", "在", "和", "有", "查询", "显示", "获取"}
+_STOPWORD_CHARS = re.compile(r"[的是在和有]+")
+_EMPTY_CONTEXT = "这是对话的开始，没有历史上下文。"
+# 增强查询模板中固定文字的token估计
+_PROMPT_TEMPLATE_TOKENS = estimate_tokens("基于以下对话上下文: 用户的新问题是: 请综合考虑上下文信息生成SQL。")
+
 
 class ContextualConversation:
     """
     上下文关联核心模块
     实现多轮对话管理、指代消解和上下文整合功能
+    线程安全：每个会话的读改写持有该会话的锁，会话索引的增删由会话存储自行加锁
     """
     
-    def __init__(self, max_history: int = 5, session_timeout: int = 1800):
+    def __init__(self, max_history: int = 5, session_timeout: int = CONTEXT_SESSION_TIMEOUT,
+                 max_sessions: int = CONTEXT_MAX_SESSIONS, store: Optional[SessionStore] = None,
+                 token_budget: int = CONTEXT_TOKEN_BUDGET, full_turns: int = CONTEXT_FULL_TURNS,
+                 shift_keep_turns: int = CONTEXT_SHIFT_KEEP_TURNS):
         """
         初始化上下文管理器
         
         参数:
             max_history: 每个会话保存的最大历史记录数
             session_timeout: 会话超时时间（秒）
+            max_sessions: 最多保留的会话数，超出时淘汰最久未活动的会话（0表示不限）
+            store: 会话存储，缺省按 CONTEXT_STORE 配置创建
+            token_budget: 上下文摘要的token预算（0表示不限）
+            full_turns: 保留完整SQL的最近轮数，更早的轮次压缩为表/列/条件摘要
+            shift_keep_turns: 检测到主题切换时保留的最近轮数
         """
-        self.sessions: Dict[str, dict] = {}
         self.max_history = max_history
         self.session_timeout = session_timeout
+        self.max_sessions = max_sessions
+        self.token_budget = token_budget
+        self.full_turns = full_turns
+        self.shift_keep_turns = shift_keep_turns
+        self.store = store if store is not None else create_session_store(max_history, session_timeout, max_sessions)
         self.entity_map = {}  # 实体映射表（用于指代消解）
+        # 按会话ID分段的可重入锁（add_history 等方法内部会再次获取同一会话的锁）
+        self._session_locks = [threading.RLock() for _ in range(_SESSION_LOCK_STRIPES)]
+        # 提示长度统计
+        self._prompt_lock = threading.Lock()
+        self._prompt_stats = {"prompts": 0, "prompt_tokens_total": 0, "prompt_tokens_max": 0,
+                              "turns_digest": 0, "turns_omitted": 0, "pruned": 0}
+
+    def _session_lock(self, session_id: str) -> threading.RLock:
+        """会话对应的锁"""
+        return self._session_locks[hash(session_id) % _SESSION_LOCK_STRIPES]
         
     def create_session(self, session_id: str) -> dict:
         """
@@ -36,13 +79,7 @@ class ContextualConversation:
         返回:
             新创建的会话对象
         """
-        self.sessions[session_id] = {
-            "history": deque(maxlen=self.max_history),
-            "created_at": datetime.now(),
-            "last_activity": datetime.now(),
-            "entities": {}  # 当前会话的实体映射
-        }
-        return self.sessions[session_id]
+        return self.store.create(session_id, datetime.now())
     
     def get_session(self, session_id: str) -> Optional[dict]:
         """
@@ -52,29 +89,28 @@ class ContextualConversation:
             session_id: 会话唯一标识
             
         返回:
-            会话对象或None(如果会话过期)
+            会话对象（已过期的会话会重新创建）
         """
-        self.clean_expired_sessions()
-        
-        if session_id not in self.sessions:
-            return self.create_session(session_id)
-        
-        # 更新最后活动时间
-        self.sessions[session_id]["last_activity"] = datetime.now()
-        return self.sessions[session_id]
-    
-    def clean_expired_sessions(self):
-        """清理过期的会话"""
         now = datetime.now()
-        expired_sessions = []
-        
-        for session_id, session in self.sessions.items():
-            elapsed = (now - session["last_activity"]).total_seconds()
-            if elapsed > self.session_timeout:
-                expired_sessions.append(session_id)
-        
-        for session_id in expired_sessions:
-            del self.sessions[session_id]
+        session = self.store.get(session_id, now)
+        if session is None:
+            return self.store.create(session_id, now)
+        return session
+    
+    def clean_expired_sessions(self, now: Optional[datetime] = None):
+        """清理过期的会话（存储在读取和创建会话时也会惰性清理）"""
+        self.store.clean_expired(now or datetime.now())
+
+    def get_stats(self) -> dict:
+        """会话存储类型、会话数量、过期/淘汰计数及提示长度统计"""
+        stats = self.store.get_stats()
+        with self._prompt_lock:
+            prompt = dict(self._prompt_stats)
+        prompt["prompt_tokens_avg"] = round(prompt["prompt_tokens_total"] / prompt["prompts"], 1) \
+            if prompt["prompts"] else 0
+        prompt["token_budget"] = self.token_budget
+        stats["prompt"] = prompt
+        return stats
     
     def add_history(self, session_id: str, user_query: str, generated_sql: str, result: dict):
         """
@@ -86,20 +122,23 @@ class ContextualConversation:
             generated_sql: 生成的SQL语句
             result: 查询结果
         """
-        session = self.get_session(session_id)
-        if not session:
-            return
-        
-        # 更新实体映射
-        self._update_entities(session_id, user_query, generated_sql)
-        
-        # 添加历史记录
-        session["history"].append({
-            "timestamp": datetime.now(),
-            "user_query": user_query,
-            "generated_sql": generated_sql,
-            "result": result
-        })
+        with self._session_lock(session_id):
+            session = self.get_session(session_id)
+            if not session:
+                return
+            
+            # 更新实体映射
+            tables, columns = self._update_entities(session_id, user_query, generated_sql)
+            
+            # 添加历史记录（按轮次增量写入会话存储），同时保存该轮的表/列/条件摘要和token估计，
+            # 构建上下文时直接使用，不再重新解析历史SQL
+            self.store.append_history(session_id, {
+                "timestamp": datetime.now(),
+                "user_query": user_query,
+                "generated_sql": generated_sql,
+                "result": result,
+                **summarize_turn(user_query, generated_sql, tables, columns)
+            })
     
     def get_context_summary(self, session_id: str) -> str:
         """
@@ -111,24 +150,17 @@ class ContextualConversation:
         返回:
             上下文摘要字符串
         """
-        session = self.get_session(session_id)
-        if not session or not session["history"]:
-            return "这是对话的开始，没有历史上下文。"
-        
-        context_lines = []
-        
-        # 添加实体摘要
-        if session["entities"]:
-            entity_summary = ", ".join([f"{k}:{v}" for k, v in session["entities"].items()])
-            context_lines.append(f"当前对话涉及的实体: {entity_summary}")
-        
-        # 添加最近的历史记录
-        context_lines.append("最近的对话历史:")
-        for i, entry in enumerate(reversed(session["history"])):
-            context_lines.append(f"  [{i+1}] 用户: {entry['user_query']}")
-            context_lines.append(f"      SQL: {entry['generated_sql']}")
-        
-        return "\n".join(context_lines)
+        return self._build_summary(session_id)[0]
+
+    def _build_summary(self, session_id: str) -> Tuple[str, dict]:
+        """在 token_budget 内构建上下文摘要：最近几轮完整，更早的轮次用摘要，超出预算的省略"""
+        with self._session_lock(session_id):
+            session = self.get_session(session_id)
+            if not session or not session["history"]:
+                return _EMPTY_CONTEXT, {"budget": self.token_budget, "context_tokens": estimate_tokens(_EMPTY_CONTEXT),
+                                        "turns_full": 0, "turns_digest": 0, "turns_omitted": 0,
+                                        "entities_shown": 0, "entities_omitted": 0, "build_ms": 0.0}
+            return build_context(session["entities"], session["history"], self.token_budget, self.full_turns)
     
     def resolve_references(self, session_id: str, query: str) -> str:
         """
@@ -141,21 +173,20 @@ class ContextualConversation:
         返回:
             替换代词后的查询
         """
-        session = self.get_session(session_id)
-        if not session or not session["entities"]:
+        with self._session_lock(session_id):
+            session = self.get_session(session_id)
+            if not session or not session["entities"]:
+                return query
+            
+            # 检测常见代词
+            for pronoun in _PRONOUNS:
+                if pronoun in query:
+                    # 尝试替换为最近提到的实体
+                    if session["entities"]:
+                        last_entity = list(session["entities"].keys())[-1]
+                        query = query.replace(pronoun, last_entity)
+            
             return query
-        
-        # 检测常见代词
-        pronouns = ["这个", "这些", "它", "它们", "其", "该"]
-        
-        for pronoun in pronouns:
-            if pronoun in query:
-                # 尝试替换为最近提到的实体
-                if session["entities"]:
-                    last_entity = list(session["entities"].keys())[-1]
-                    query = query.replace(pronoun, last_entity)
-        
-        return query
     
     def enhance_query(self, session_id: str, query: str) -> str:
         """
@@ -168,10 +199,26 @@ class ContextualConversation:
         返回:
             增强后的查询（包含上下文提示）
         """
-        resolved_query = self.resolve_references(session_id, query)
-        context_summary = self.get_context_summary(session_id)
-        
-        return f"""
+        return self.enhance_query_with_metrics(session_id, query)[0]
+
+    def enhance_query_with_metrics(self, session_id: str, query: str) -> Tuple[str, dict]:
+        """
+        增强用户查询，并返回本轮提示的长度统计
+
+        检测到主题切换时先裁剪会话历史，只保留最近 shift_keep_turns 轮，旧话题不再进入提示
+
+        返回:
+            (增强后的查询, 统计信息：预算、上下文/提示token估计、完整/摘要/省略的轮数、是否裁剪等)
+        """
+        # 主题切换检测、指代消解和上下文摘要基于同一时刻的会话状态
+        with self._session_lock(session_id):
+            pruned = self.detect_context_shift(session_id, query)
+            if pruned:
+                self.store.prune_history(session_id, self.shift_keep_turns)
+            resolved_query = self.resolve_references(session_id, query)
+            context_summary, metrics = self._build_summary(session_id)
+
+        prompt = f"""
         基于以下对话上下文:
         {context_summary}
         
@@ -180,6 +227,17 @@ class ContextualConversation:
         
         请综合考虑上下文信息生成SQL。
         """
+        metrics["context_shift"] = pruned
+        metrics["prompt_tokens"] = metrics["context_tokens"] + estimate_tokens(resolved_query) + _PROMPT_TEMPLATE_TOKENS
+        with self._prompt_lock:
+            stats = self._prompt_stats
+            stats["prompts"] += 1
+            stats["prompt_tokens_total"] += metrics["prompt_tokens"]
+            stats["prompt_tokens_max"] = max(stats["prompt_tokens_max"], metrics["prompt_tokens"])
+            stats["turns_digest"] += metrics["turns_digest"]
+            stats["turns_omitted"] += metrics["turns_omitted"]
+            stats["pruned"] += pruned
+        return prompt, metrics
     
     def detect_context_shift(self, session_id: str, current_query: str) -> bool:
         """
@@ -192,36 +250,69 @@ class ContextualConversation:
         返回:
             True 如果检测到主题切换
         """
-        session = self.get_session(session_id)
-        if not session or len(session["history"]) < 2:
-            return False
-        
-        # 提取最近查询的主题关键词
-        last_query = session["history"][-1]["user_query"]
-        last_keywords = self._extract_keywords(last_query)
-        
-        # 提取当前查询的主题关键词
-        current_keywords = self._extract_keywords(current_query)
-        
-        # 计算关键词相似度
-        common_keywords = set(last_keywords) & set(current_keywords)
-        similarity = len(common_keywords) / max(len(last_keywords), 1)
-        
-        return similarity < 0.3
+        with self._session_lock(session_id):
+            session = self.get_session(session_id)
+            if not session or len(session["history"]) < 2:
+                return False
+            
+            # 含指代词的查询、以追问词开头或以"呢"结尾的查询是对上文的补充（"女性患者呢"、"按年龄段分组统计"）
+            if any(pronoun in current_query for pronoun in _PRONOUNS):
+                return False
+            stripped = current_query.strip().rstrip("？?。.！! ")
+            if stripped.startswith(_FOLLOW_UP_PREFIXES) or stripped.endswith("呢"):
+                return False
+
+            # 没有提到任何表/字段的省略式追问（"只看60岁以上的"）依赖上文，不算切换；
+            # 提到的表/字段已在本会话中出现过，仍是同一主题
+            nouns = self._extract_nouns(current_query)
+            if not nouns:
+                return False
+            known = set()
+            for name, info in session["entities"].items():
+                known.add(name)
+                known.update((info or {}).get("columns") or [])
+            if known.intersection(nouns):
+                return False
+
+            # 与本会话全部历史问题（而不只是上一轮）的关键词比较
+            session_keywords = set()
+            for entry in session["history"]:
+                session_keywords.update(self._extract_keywords(entry["user_query"]))
+            current_keywords = set(self._extract_keywords(current_query))
+            
+            # 计算关键词相似度
+            common_keywords = session_keywords & current_keywords
+            similarity = len(common_keywords) / max(len(current_keywords), 1)
+            
+            return similarity < 0.3
     
     def _extract_keywords(self, text: str) -> List[str]:
         """提取查询中的关键词（简化实现）"""
+        keywords = []
+        for word in re.findall(r'[a-z0-9_]+|[\u4e00-\u9fff]+', text.lower()):
+            if not '\u4e00' <= word[0] <= '\u9fff':
+                keywords.append(word)
+                continue
+            # 中文没有空格分词，整句会成为一个"词"：按停用字切开后取二元组比较
+            for part in _STOPWORD_CHARS.split(word):
+                if len(part) <= 2:
+                    keywords.append(part)
+                else:
+                    keywords.extend(part[i:i + 2] for i in range(len(part) - 1))
         # 过滤停用词
-        stopwords = {"的", "是", "在", "和", "有", "查询", "显示", "获取"}
-        words = re.findall(r'[\w\u4e00-\u9fff]+', text.lower())
-        return [word for word in words if word not in stopwords]
+        return [word for word in keywords if word and word not in _STOPWORDS]
     
-    def _update_entities(self, session_id: str, user_query: str, sql: str):
-        """使用专业 SQL 解析库结构化维护实体和表关系，支持多表和嵌套查询"""
+    def _update_entities(self, session_id: str, user_query: str, sql: str) -> Tuple[List[str], List[str]]:
+        """
+        使用专业 SQL 解析库结构化维护实体和表关系，支持多表和嵌套查询
+
+        返回:
+            (SQL涉及的表, 查询的列)，供历史摘要复用
+        """
 
         session = self.get_session(session_id)
         if not session:
-            return
+            return [], []
 
         def extract_tables_and_columns(parsed):
             tables = set()
@@ -285,33 +376,37 @@ class ContextualConversation:
         # 从用户查询中提取实体名词
         nouns = self._extract_nouns(user_query)
 
-        # 结构化维护实体关系
-        if "entities" not in session or not isinstance(session["entities"], dict):
-            session["entities"] = {}
+        def merge_entities(entities: dict) -> dict:
+            """结构化维护实体关系（在会话存储中对同一会话原子地读改写）"""
+            if not isinstance(entities, dict):
+                entities = {}
 
-        # 维护表-字段映射
-        for table in tables:
-            if table not in session["entities"]:
-                session["entities"][table] = {"count": 1, "columns": set()}
-            else:
-                session["entities"][table]["count"] += 1
-                # 修正：如果 columns 是 list，转成 set
-                if isinstance(session["entities"][table]["columns"], list):
-                    session["entities"][table]["columns"] = set(session["entities"][table]["columns"])
-            session["entities"][table]["columns"].update(columns)
+            # 维护表-字段映射
+            for table in tables:
+                if table not in entities:
+                    entities[table] = {"count": 1, "columns": set()}
+                else:
+                    entities[table]["count"] += 1
+                    # 修正：如果 columns 是 list，转成 set
+                    if isinstance(entities[table]["columns"], list):
+                        entities[table]["columns"] = set(entities[table]["columns"])
+                entities[table]["columns"].update(columns)
 
+            # 维护名词实体出现次数
+            for noun in nouns:
+                if noun not in entities:
+                    entities[noun] = {"count": 1, "columns": set()}
+                else:
+                    entities[noun]["count"] += 1
 
-        # 维护名词实体出现次数
-        for noun in nouns:
-            if noun not in session["entities"]:
-                session["entities"][noun] = {"count": 1, "columns": set()}
-            else:
-                session["entities"][noun]["count"] += 1
+            # 将 set 转为 list 以便序列化
+            for entity in entities:
+                if isinstance(entities[entity].get("columns", None), set):
+                    entities[entity]["columns"] = list(entities[entity]["columns"])
+            return entities
 
-        # 将 set 转为 list 以便序列化
-        for entity in session["entities"]:
-            if isinstance(session["entities"][entity].get("columns", None), set):
-                session["entities"][entity]["columns"] = list(session["entities"][entity]["columns"])
+        self.store.update_entities(session_id, merge_entities)
+        return sorted(t for t in tables if t), sorted(c for c in columns if c)
     
     def _extract_nouns(self, text: str) -> List[str]:
         """从中文文本中提取名词，适配 medical_checkup 表及医学体检相关字段"""
@@ -340,13 +435,16 @@ class ContextualConversation:
     
     def clear_session(self, session_id: str):
         """清除指定会话"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        with self._session_lock(session_id):
+            self.store.delete(session_id)
     
     def save_to_file(self, file_path: str):
-        """将会话状态保存到文件"""
+        """
+        将全部会话导出为JSON文件（整体序列化，适合备份/迁移；
+        持续持久化请使用 CONTEXT_STORE=journal 的追加日志存储）
+        """
         serializable = {}
-        for session_id, session in self.sessions.items():
+        for session_id, session in self.store.items():
             serializable[session_id] = {
                 "history": list(session["history"]),
                 "created_at": session["created_at"].isoformat(),
@@ -355,21 +453,23 @@ class ContextualConversation:
             }
         
         with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(serializable, f, ensure_ascii=False, indent=2)
+            json.dump(serializable, f, ensure_ascii=False, indent=2, default=str)
     
     def load_from_file(self, file_path: str):
-        """从文件加载会话状态"""
+        """从 save_to_file 导出的文件导入会话"""
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 data = json.load(f)
             
+            loaded = {}
             for session_id, session_data in data.items():
-                self.sessions[session_id] = {
+                loaded[session_id] = {
                     "history": deque(session_data["history"], maxlen=self.max_history),
                     "created_at": datetime.fromisoformat(session_data["created_at"]),
                     "last_activity": datetime.fromisoformat(session_data["last_activity"]),
                     "entities": session_data["entities"]
                 }
+            self.store.put_many(loaded)
         except FileNotFoundError:
             print(f"警告: 会话文件 {file_path} 不存在")
         except json.JSONDecodeError:
@@ -1,11 +1,12 @@
 import json
 import os
 import datetime
+import threading
 
 def ensure_directory(file_path):
     """确保文件目录存在"""
     directory = os.path.dirname(file_path)
-    if not os.path.exists(directory):
+    if directory and not os.path.exists(directory):
         os.makedirs(directory)
 
 def read_json(file_path):
@@ -29,3 +30,36 @@ def write_json(data, file_path):
     except Exception as e:
         print(f"写入JSON文件失败: {e}")
         return False
+
+_append_lock = threading.Lock()
+
+def append_json_line(data, file_path):
+    """以JSON Lines格式追加一条记录（多个请求并发追加互不覆盖）"""
+    ensure_directory(file_path)
+
+    try:
+        line = json.dumps(data, ensure_ascii=False, default=str) + "\n"
+        with _append_lock:
+            with open(file_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        return True
+    except Exception as e:
+        print(f"追加JSON记录失败: {e}")
+        return False
+
+def read_json_lines(file_path):
+    """逐条读取JSON Lines文件，跳过无法解析的行（如写入中断的最后一行）"""
+    records = []
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except Exception as e:
+        print(f"读取JSON Lines文件失败: {e}")
+    return records
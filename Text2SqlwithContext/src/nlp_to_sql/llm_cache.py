@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+from Text2SqlwithContext.src.basic_function.config import (
+    LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MEMORY_SIZE, LLM_CACHE_DISK_SIZE
+)
+
+
+def normalize_text(text) -> str:
+    """归一化提示文本：合并连续空白，去除首尾空白"""
+    if text is None:
+        return ""
+    return " ".join(str(text).split())
+
+
+def hash_text(text) -> str:
+    """计算文本的SHA-256摘要"""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def make_cache_key(system_prompt: str, user_prompt: str, schema_hash: str, model: str, temperature: float) -> str:
+    """
+    生成缓存键
+
+    Args:
+        system_prompt: 系统提示
+        user_prompt: 用户提示（包含增强后的查询）
+        schema_hash: 数据库结构文件的摘要
+        model: 模型名称
+        temperature: 采样温度
+
+    Returns:
+        str: 归一化后各字段的SHA-256摘要
+    """
+    payload = json.dumps([
+        normalize_text(system_prompt),
+        normalize_text(user_prompt),
+        schema_hash or "",
+        model or "",
+        f"{float(temperature):.4f}"
+    ], ensure_ascii=False)
+    return hash_text(payload)
+
+
+class LLMResponseCache:
+    """
+    LLM响应缓存
+    进程内LRU保存热点条目，SQLite持久化保证重启后可用并在多个工作进程间共享。
+    数据库结构摘要变化时自动清除旧结构下的缓存。
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_PATH, ttl: int = LLM_CACHE_TTL,
+                 memory_size: int = LLM_CACHE_MEMORY_SIZE, disk_size: int = LLM_CACHE_DISK_SIZE):
+        """
+        初始化缓存
+
+        参数:
+            db_path: SQLite缓存文件路径，为None时仅使用内存缓存
+            ttl: 条目有效期（秒），<=0 表示不过期
+            memory_size: 进程内LRU最大条目数
+            disk_size: 磁盘缓存最大条目数
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created_at, schema_hash, value)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._schema_hash: Optional[str] = None
+        self._stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0,
+                       "writes": 0, "evictions": 0, "invalidations": 0}
+        if db_path:
+            self._init_db()
+
+    def _init_db(self):
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " cache_key TEXT PRIMARY KEY,"
+                " schema_hash TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)")
+            conn.commit()
+            self._conn = conn
+        except sqlite3.Error as e:
+            print(f"LLM缓存数据库初始化失败，仅使用内存缓存: {e}")
+            self._conn = None
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def _check_schema(self, schema_hash: str):
+        """数据库结构变化时清除旧结构对应的缓存条目（调用方需持有锁）"""
+        if schema_hash == self._schema_hash:
+            return
+        self._schema_hash = schema_hash
+        stale = [k for k, (_, h, _) in self._memory.items() if h != schema_hash]
+        for k in stale:
+            del self._memory[k]
+        removed = len(stale)
+        if self._conn is not None:
+            try:
+                cur = self._conn.execute("DELETE FROM llm_cache WHERE schema_hash != ?", (schema_hash,))
+                self._conn.commit()
+                removed += max(cur.rowcount, 0)
+            except sqlite3.Error as e:
+                print(f"LLM缓存失效处理失败: {e}")
+        if removed:
+            self._stats["invalidations"] += removed
+
+    def get(self, key: str, schema_hash: str) -> Optional[dict]:
+        """
+        查询缓存
+
+        参数:
+            key: make_cache_key 生成的缓存键
+            schema_hash: 当前数据库结构摘要
+
+        返回:
+            命中时返回缓存的结果字典，否则返回None
+        """
+        now = time.time()
+        with self._lock:
+            self._check_schema(schema_hash)
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    self._stats["memory_hits"] += 1
+                    return dict(entry[2])
+                del self._memory[key]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, created_at FROM llm_cache WHERE cache_key = ? AND schema_hash = ?",
+                        (key, schema_hash)
+                    ).fetchone()
+                    if row is not None:
+                        value, created_at = json.loads(row[0]), row[1]
+                        if not self._expired(created_at, now):
+                            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+                            self._conn.commit()
+                            self._remember(key, created_at, schema_hash, value)
+                            self._stats["hits"] += 1
+                            self._stats["disk_hits"] += 1
+                            return dict(value)
+                        self._conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                        self._conn.commit()
+                except (sqlite3.Error, ValueError) as e:
+                    print(f"LLM缓存读取失败: {e}")
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, schema_hash: str, value: dict):
+        """
+        写入缓存
+
+        参数:
+            key: make_cache_key 生成的缓存键
+            schema_hash: 当前数据库结构摘要
+            value: 可JSON序列化的结果字典
+        """
+        now = time.time()
+        with self._lock:
+            self._check_schema(schema_hash)
+            self._remember(key, now, schema_hash, value)
+            self._stats["writes"] += 1
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO llm_cache (cache_key, schema_hash, value, created_at, last_access)"
+                        " VALUES (?, ?, ?, ?, ?)",
+                        (key, schema_hash, json.dumps(value, ensure_ascii=False), now, now)
+                    )
+                    self._evict_disk(now)
+                    self._conn.commit()
+                except (sqlite3.Error, TypeError) as e:
+                    print(f"LLM缓存写入失败: {e}")
+
+    def _remember(self, key: str, created_at: float, schema_hash: str, value: dict):
+        self._memory[key] = (created_at, schema_hash, dict(value))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _evict_disk(self, now: float):
+        """按TTL和容量淘汰磁盘条目（最久未访问优先）"""
+        if self.ttl > 0:
+            cur = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            self._stats["evictions"] += max(cur.rowcount, 0)
+        cur = self._conn.execute(
+            "DELETE FROM llm_cache WHERE cache_key IN ("
+            " SELECT cache_key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.disk_size,)
+        )
+        self._stats["evictions"] += max(cur.rowcount, 0)
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM llm_cache")
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"LLM缓存清空失败: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        """返回命中/未命中等计数"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+            lookups = stats["hits"] + stats["misses"]
+            stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            return stats
+
+
+# 全局缓存实例
+_llm_cache: Optional[LLMResponseCache] = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """获取全局LLM缓存实例，未启用时返回None"""
+    global _llm_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    if _llm_cache is None:
+        with _llm_cache_lock:
+            if _llm_cache is None:
+                _llm_cache = LLMResponseCache()
+    return _llm_cache
+
+
+def get_llm_cache_stats() -> Dict[str, float]:
+    """获取全局LLM缓存的统计信息"""
+    cache = get_llm_cache()
+    return cache.stats() if cache else {}
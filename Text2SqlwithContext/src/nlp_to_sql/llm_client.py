@@ -1,36 +1,92 @@
 import openai # type: ignore
 from Text2SqlwithContext.src.basic_function.config import OPENAI_API_KEY, OPENAI_API_BASE, MODEL_NAME
+from Text2SqlwithContext.src.nlp_to_sql.llm_cache import get_llm_cache, make_cache_key, hash_text
+from Text2SqlwithContext.src.basic_function.schema_registry import get_schema_snapshot
 import time
 
 # 配置OpenAI客户端指向DeepSeek API
 openai.api_key = OPENAI_API_KEY
 openai.base_url = OPENAI_API_BASE
 
-def call_llm_model(natural_language_query, schema_info=None):
+# 采样温度，更低温度以获得更确定性的结果
+TEMPERATURE = 0.01
+
+# 系统提示
+SYSTEM_PROMPT = (
+    "你是一个专业的SQL专家，擅长将自然语言转换为准确的供mysql使用的查询语句。多表的关系和结构已经给出。如果表意明确，请仅返回适用于MYSQL语句，不要包含任何解释或额外文本或额外的格式处理。如果表意模糊，请返回“生成错误”，并生成给用户提示信息。如果需要结合上下文生成新的SQL，请在生成的SQL中包含上下文信息。请确保生成的SQL语句符合MYSQL语法规范。"
+)
+
+def build_prompts(natural_language_query, schema_info=None):
     """
-    调用DeepSeek模型通过OpenAI接口将自然语言转换为SQL
-    
+    构建系统提示和用户提示
+
     Args:
         natural_language_query (str): 用户的自然语言查询
-        schema_info (dict, optional): 数据库结构信息
-        
+        schema_info (str, optional): 数据库结构信息
+
     Returns:
-        dict: 包含生成的SQL和元数据的字典
+        tuple: (system_prompt, user_prompt)
     """
-    start_time = time.time()
-    
-    # 构建系统提示
-    system_prompt = (
-        "你是一个专业的SQL专家，擅长将自然语言转换为准确的供mysql使用的查询语句。多表的关系和结构已经给出。如果表意明确，请仅返回适用于MYSQL语句，不要包含任何解释或额外文本或额外的格式处理。如果表意模糊，请返回“生成错误”，并生成给用户提示信息。如果需要结合上下文生成新的SQL，请在生成的SQL中包含上下文信息。请确保生成的SQL语句符合MYSQL语法规范。"
-    )
-    
     # 构建用户提示
     user_prompt = f"请将以下自然语言描述转换为SQL查询：\n\n{natural_language_query}"
-    
+
     # 如果提供了数据库结构信息，添加到提示中
     if schema_info:
         user_prompt += f"\n\n数据库结构信息：\n{schema_info}"
-    
+    return SYSTEM_PROMPT, user_prompt
+
+def resolve_schema_hash(schema_info=None, schema_hash=None):
+    """缓存键使用的结构摘要，缺省时取当前结构快照的摘要"""
+    if schema_hash is not None:
+        return schema_hash
+    try:
+        return get_schema_snapshot().schema_hash
+    except (OSError, ValueError):
+        return hash_text(str(schema_info or ""))
+
+def lookup_cached(cache_key, schema_hash, start_time):
+    """查询LLM缓存，命中时返回带 cache_hit 标记的结果"""
+    cache = get_llm_cache()
+    if cache is None:
+        return None
+    cached = cache.get(cache_key, schema_hash)
+    if cached is None:
+        return None
+    metadata = dict(cached.get("metadata", {}))
+    metadata["cache_hit"] = True
+    metadata["processing_time_ms"] = int((time.time() - start_time) * 1000)
+    cached["metadata"] = metadata
+    return cached
+
+def store_cached(cache_key, schema_hash, result):
+    """仅缓存成功的结果"""
+    cache = get_llm_cache()
+    if cache is not None and result.get("success"):
+        cache.put(cache_key, schema_hash, result)
+
+def call_llm_model(natural_language_query, schema_info=None, schema_hash=None):
+    """
+    调用DeepSeek模型通过OpenAI接口将自然语言转换为SQL
+    相同提示在同一数据库结构下的结果直接从缓存返回
+
+    Args:
+        natural_language_query (str): 用户的自然语言查询
+        schema_info (dict, optional): 数据库结构信息
+        schema_hash (str, optional): 数据库结构摘要，缺省时取当前结构快照的摘要
+
+    Returns:
+        dict: 包含生成的SQL和元数据的字典
+    """
+    start_time = time.time()
+
+    system_prompt, user_prompt = build_prompts(natural_language_query, schema_info)
+
+    schema_hash = resolve_schema_hash(schema_info, schema_hash)
+    cache_key = make_cache_key(system_prompt, user_prompt, schema_hash, MODEL_NAME, TEMPERATURE)
+    cached = lookup_cached(cache_key, schema_hash, start_time)
+    if cached is not None:
+        return cached
+
     try:
         response = openai.chat.completions.create(
             model=MODEL_NAME,
@@ -38,23 +94,26 @@ def call_llm_model(natural_language_query, schema_info=None):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
             ],
-            temperature=0.01  # 更低温度以获得更确定性的结果
+            temperature=TEMPERATURE
         )
-        
+
         sql_query = response.choices[0].message.content.strip()
-        
+
         # 计算处理时间（毫秒）
         processing_time = int((time.time() - start_time) * 1000)
-        
-        return {
+
+        result = {
             "generated_sql": sql_query,
             "success": True,
             "metadata": {
                 "model": MODEL_NAME,
-                "processing_time_ms": processing_time
+                "processing_time_ms": processing_time,
+                "cache_hit": False
             }
         }
-        
+        store_cached(cache_key, schema_hash, result)
+        return result
+
     except Exception as e:
         return {
             "generated_sql": None,
@@ -63,4 +122,73 @@ def call_llm_model(natural_language_query, schema_info=None):
             "metadata": {
                 "model": MODEL_NAME
             }
-        }
\ No newline at end of file
+        }
+
+def stream_llm_model(natural_language_query, schema_info=None, schema_hash=None):
+    """
+    流式调用模型，逐段产出生成的SQL
+
+    Args:
+        natural_language_query (str): 用户的自然语言查询
+        schema_info (str, optional): 数据库结构信息
+        schema_hash (str, optional): 数据库结构摘要
+
+    Yields:
+        dict: 生成过程中为 {"delta": 文本片段}，最后一项为 {"done": True, "result": 与call_llm_model相同格式的结果}
+    """
+    start_time = time.time()
+
+    system_prompt, user_prompt = build_prompts(natural_language_query, schema_info)
+
+    schema_hash = resolve_schema_hash(schema_info, schema_hash)
+    cache_key = make_cache_key(system_prompt, user_prompt, schema_hash, MODEL_NAME, TEMPERATURE)
+    cached = lookup_cached(cache_key, schema_hash, start_time)
+    if cached is not None:
+        yield {"delta": cached["generated_sql"]}
+        yield {"done": True, "result": cached}
+        return
+
+    parts = []
+    first_token_ms = None
+    try:
+        stream = openai.chat.completions.create(
+            model=MODEL_NAME,
+            messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+            ],
+            temperature=TEMPERATURE,
+            stream=True
+        )
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if first_token_ms is None:
+                    first_token_ms = int((time.time() - start_time) * 1000)
+                parts.append(delta)
+                yield {"delta": delta}
+    except Exception as e:
+        yield {"done": True, "result": {
+            "generated_sql": None,
+            "success": False,
+            "error": str(e),
+            "metadata": {
+                "model": MODEL_NAME
+            }
+        }}
+        return
+
+    result = {
+        "generated_sql": "".join(parts).strip(),
+        "success": True,
+        "metadata": {
+            "model": MODEL_NAME,
+            "processing_time_ms": int((time.time() - start_time) * 1000),
+            "first_token_ms": first_token_ms,
+            "cache_hit": False
+        }
+    }
+    store_cached(cache_key, schema_hash, result)
+    yield {"done": True, "result": result}
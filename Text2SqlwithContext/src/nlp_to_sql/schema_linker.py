@@ -0,0 +1,278 @@
+import re
+import logging
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+from Text2SqlwithContext.src.basic_function.config import SCHEMA_LINKING_ENABLED, SCHEMA_LINK_MIN_SCORE
+from Text2SqlwithContext.src.basic_function.schema_registry import SchemaSnapshot, get_schema_snapshot
+from Text2SqlwithContext.src.sql_to_data.data_processing import MEDICAL_TRANSLATION
+
+logger = logging.getLogger(__name__)
+
+# 表级中文关键词（列名翻译见 MEDICAL_TRANSLATION）
+TABLE_LABELS: Dict[str, List[str]] = {
+    'patients': ['患者', '病人', '病史', '过敏'],
+    'medical_checkup': ['体检', '检查', '体检表'],
+    'patient_metrics': ['指标', '趋势', '变化', '历次', '记录', '收缩压']
+}
+
+# 列的口语化同义词
+COLUMN_SYNONYMS: Dict[str, List[str]] = {
+    'gender': ['男女', '男性', '女性'],
+    'age': ['岁', '老年', '年轻'],
+    'address': ['住址', '住在', '城市'],
+    'phone': ['电话', '手机'],
+    'fasting_glucose': ['血糖'],
+    'blood_pressure': ['高血压'],
+    'smoking_status': ['吸烟', '抽烟'],
+    'alcohol_consumption': ['饮酒', '喝酒']
+}
+
+# 每张被选中的表都会携带的常用列（若存在）
+ALWAYS_INCLUDE_COLUMNS = {'patient_id', 'name', 'checkup_date'}
+
+# 英文描述中不具区分度的词
+_DESCRIPTION_STOPWORDS = {'the', 'for', 'and', 'of', 'key', 'primary', 'result', 'record', 'time', 'patient',
+                          'count', 'rate', 'status', 'date', 'number', 'name', 'e.g'}
+
+_WORD_RE = re.compile(r'[a-z][a-z0-9_]*')
+_CJK_RE = re.compile(r'[一-鿿]+')
+
+
+@dataclass
+class LinkResult:
+    """模式链接结果"""
+    schema_text: str  # 发送给LLM的结构信息
+    schema_hash: str  # 完整结构的摘要（用于缓存键）
+    pruned: bool  # 是否使用了裁剪后的结构
+    confidence: float
+    tables: List[str] = field(default_factory=list)
+    full_chars: int = 0
+    pruned_chars: int = 0
+
+    @property
+    def saved_chars(self) -> int:
+        return self.full_chars - self.pruned_chars
+
+    @property
+    def saved_ratio(self) -> float:
+        return round(self.saved_chars / self.full_chars, 4) if self.full_chars else 0.0
+
+    def to_metadata(self) -> dict:
+        """用于接口返回/日志的提示词节省统计"""
+        return {
+            "pruned": self.pruned,
+            "confidence": round(self.confidence, 2),
+            "tables": self.tables,
+            "full_chars": self.full_chars,
+            "pruned_chars": self.pruned_chars,
+            "saved_chars": self.saved_chars,
+            "saved_ratio": self.saved_ratio
+        }
+
+
+def _strip_label(label: str) -> str:
+    """去掉中文标签中的单位说明，如 '身高(cm)' -> '身高'"""
+    return re.sub(r'[\(（].*?[\)）]', '', label).strip()
+
+
+class SchemaLinker:
+    """
+    模式链接器
+    基于表名、列名、列描述及中文标签建立倒排索引，按问题筛选最小结构片段
+    """
+
+    def __init__(self, snapshot: SchemaSnapshot, min_score: float = SCHEMA_LINK_MIN_SCORE):
+        """
+        初始化并建立索引
+
+        参数:
+            snapshot: 数据库结构快照
+            min_score: 最低置信度，低于该值时回退到完整结构
+        """
+        self.snapshot = snapshot
+        self.schema_text = snapshot.compact_text
+        self.schema_hash = snapshot.schema_hash
+        self.min_score = min_score
+        self.tables = {t.name: t for t in snapshot.tables}
+        self.relationships = snapshot.relationships
+        # term -> [(table, column or None, weight)]
+        self.english_index: Dict[str, List[Tuple[str, Optional[str], float]]] = defaultdict(list)
+        self.chinese_index: Dict[str, List[Tuple[str, Optional[str], float]]] = defaultdict(list)
+        self._build_index()
+
+    def _build_index(self):
+        column_tables: Dict[str, List[str]] = defaultdict(list)
+        for table_name, table in self.tables.items():
+            self.english_index[table_name.lower()].append((table_name, None, 2.0))
+            for part in table_name.lower().split('_'):
+                if len(part) >= 4:
+                    self.english_index[part].append((table_name, None, 1.0))
+            for label in TABLE_LABELS.get(table_name, []):
+                self.chinese_index[label].append((table_name, None, 1.0))
+            for column in table.columns:
+                column_tables[column.name].append(table_name)
+
+        # 中文标签的双字片段，只保留区分度高的（最多出现在两个列名中）
+        bigram_columns: Dict[str, Set[str]] = defaultdict(set)
+        for column_name in column_tables:
+            label = _strip_label(MEDICAL_TRANSLATION.get(column_name, ''))
+            for segment in _CJK_RE.findall(label):
+                for i in range(len(segment) - 1):
+                    bigram_columns[segment[i:i + 2]].add(column_name)
+
+        for column_name, table_names in column_tables.items():
+            terms_en = {column_name.lower(): 1.5}
+            for part in column_name.lower().split('_'):
+                if len(part) >= 3 and part not in _DESCRIPTION_STOPWORDS:
+                    terms_en.setdefault(part, 0.5)
+            label = MEDICAL_TRANSLATION.get(column_name)
+            terms_cn: Dict[str, float] = {synonym: 1.0 for synonym in COLUMN_SYNONYMS.get(column_name, [])}
+            if label:
+                terms_cn[label] = 1.5
+                terms_cn[_strip_label(label)] = 1.5
+                for segment in _CJK_RE.findall(_strip_label(label)):
+                    for i in range(len(segment) - 1):
+                        bigram = segment[i:i + 2]
+                        if len(bigram_columns[bigram]) <= 2:
+                            terms_cn.setdefault(bigram, 1.0)
+            for table_name in table_names:
+                column = self.tables[table_name].column(column_name)
+                for word in _WORD_RE.findall(column.description.lower()):
+                    if len(word) >= 3 and word not in _DESCRIPTION_STOPWORDS:
+                        terms_en.setdefault(word, 0.5)
+                for term, weight in terms_en.items():
+                    self.english_index[term].append((table_name, column_name, weight))
+                for term, weight in terms_cn.items():
+                    if term:
+                        self.chinese_index[term].append((table_name, column_name, weight))
+        self.column_tables = dict(column_tables)
+
+    def _match(self, question: str) -> Tuple[Dict[str, float], Dict[str, Set[str]], float]:
+        """返回 (表得分, 表 -> 命中列集合, 置信度)"""
+        table_scores: Dict[str, float] = defaultdict(float)
+        shared_scores: Dict[str, float] = defaultdict(float)
+        table_columns: Dict[str, Set[str]] = defaultdict(set)
+        confidence = 0.0
+        text = question.lower()
+        hits = [self.english_index[w] for w in set(_WORD_RE.findall(text)) if w in self.english_index]
+        hits += [postings for term, postings in self.chinese_index.items() if term in question]
+        for postings in hits:
+            confidence += max(weight for _, _, weight in postings)
+            for table_name, column_name, weight in postings:
+                if column_name:
+                    table_columns[table_name].add(column_name)
+                # 多表共有的列（如 patient_id、gender）不单独决定选表
+                if column_name and len(self.column_tables[column_name]) > 1:
+                    shared_scores[table_name] += weight
+                else:
+                    table_scores[table_name] += weight
+        if not table_scores and shared_scores:
+            best = max(shared_scores.values())
+            first = next(t for t in self.tables if shared_scores.get(t) == best)
+            table_scores[first] = best
+        return table_scores, table_columns, confidence
+
+    def _connect(self, selected: Set[str]) -> Set[str]:
+        """补齐连接被选表所需的中间表（关系图上的最短路径）"""
+        if len(selected) < 2:
+            return selected
+        graph: Dict[str, Set[str]] = defaultdict(set)
+        for rel in self.relationships:
+            graph[rel.from_table].add(rel.to_table)
+            graph[rel.to_table].add(rel.from_table)
+        result = set(selected)
+        targets = list(selected)
+        root = targets[0]
+        for target in targets[1:]:
+            # BFS 寻找 root 到 target 的路径
+            parents = {root: None}
+            queue = [root]
+            while queue and target not in parents:
+                node = queue.pop(0)
+                for neighbor in graph[node]:
+                    if neighbor not in parents:
+                        parents[neighbor] = node
+                        queue.append(neighbor)
+            node = target if target in parents else None
+            while node is not None:
+                result.add(node)
+                node = parents[node]
+        return result
+
+    def link(self, question: str) -> LinkResult:
+        """
+        为问题生成最小结构片段
+
+        参数:
+            question: 增强后的用户问题
+
+        返回:
+            LinkResult，置信度不足时包含完整结构
+        """
+        table_scores, table_columns, confidence = self._match(question or "")
+        full_chars = len(self.schema_text)
+        if not SCHEMA_LINKING_ENABLED or not table_scores or confidence < self.min_score:
+            return LinkResult(self.schema_text, self.schema_hash, False, confidence,
+                              list(self.tables), full_chars, full_chars)
+
+        selected = self._connect({t for t, score in table_scores.items() if score > 0})
+        join_columns: Dict[str, Set[str]] = defaultdict(set)
+        for rel in self.relationships:
+            if rel.from_table in selected and rel.to_table in selected:
+                join_columns[rel.from_table].add(rel.from_column)
+                join_columns[rel.to_table].add(rel.to_column)
+
+        keep_columns = {}
+        for table_name in selected:
+            columns = self.tables[table_name].columns
+            if table_name in table_scores and not table_columns[table_name]:
+                # 只按表级关键词（如"趋势"）选中、没有命中任何列的表保留全部列，
+                # 否则 patient_metrics 这类名称/数值表缺少 metric_name、metric_value 无法查询
+                keep_columns[table_name] = [c.name for c in columns]
+                continue
+            wanted = table_columns[table_name] | join_columns[table_name] | ALWAYS_INCLUDE_COLUMNS
+            keep_columns[table_name] = [c.name for c in columns if c.name in wanted or c.is_primary_key]
+        fragment_text = self.snapshot.render(tables=selected, columns=keep_columns)
+        if len(fragment_text) >= full_chars:
+            return LinkResult(self.schema_text, self.schema_hash, False, confidence,
+                              list(self.tables), full_chars, full_chars)
+        return LinkResult(fragment_text, self.schema_hash, True, confidence,
+                          [t for t in self.tables if t in selected], full_chars, len(fragment_text))
+
+
+# 与当前结构快照对应的链接器（结构变化时自动重建索引）
+_linker: Optional[SchemaLinker] = None
+_linker_lock = threading.Lock()
+
+
+def get_schema_linker(snapshot: Optional[SchemaSnapshot] = None) -> SchemaLinker:
+    """获取与结构快照对应的链接器，仅在结构变化时重建索引"""
+    global _linker
+    if snapshot is None:
+        snapshot = get_schema_snapshot()
+    linker = _linker
+    if linker is None or linker.schema_hash != snapshot.schema_hash:
+        with _linker_lock:
+            if _linker is None or _linker.schema_hash != snapshot.schema_hash:
+                _linker = SchemaLinker(snapshot)
+            linker = _linker
+    return linker
+
+
+def link_schema(question: str, snapshot: Optional[SchemaSnapshot] = None) -> LinkResult:
+    """
+    为问题裁剪数据库结构
+
+    参数:
+        question: 增强后的用户问题
+        snapshot: 数据库结构快照，缺省为注册表中的当前快照
+
+    返回:
+        LinkResult，置信度不足时包含完整结构
+    """
+    result = get_schema_linker(snapshot).link(question)
+    logger.debug(f"模式链接: 表={result.tables} 结构字符 {result.full_chars} -> {result.pruned_chars} "
+                 f"(节省 {result.saved_ratio:.0%})")
+    return result
@@ -0,0 +1,297 @@
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows：不做跨进程互斥
+    fcntl = None
+
+# 记录格式：4字节负载长度 + 4字节CRC32（大端）+ UTF-8 JSON负载
+_HEADER = struct.Struct(">II")
+_JOURNAL_RE = re.compile(r"^journal-(\d{8})\.log$")
+_SNAPSHOT_RE = re.compile(r"^snapshot-(\d{8})\.bin$")
+_LOCK_NAME = "journal.lock"
+
+
+def _json_default(value):
+    """时间转为ISO格式，其他无法序列化的值（如numpy标量）转为字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_record(payload) -> bytes:
+    """将一个事件编码为带长度前缀和校验和的记录"""
+    data = json.dumps(payload, ensure_ascii=False, default=_json_default, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def read_records(path: str) -> Tuple[List[dict], int]:
+    """
+    顺序读取文件中的记录，遇到不完整或校验失败的记录（崩溃时写了一半）即停止
+
+    返回:
+        (记录列表, 最后一条完整记录的结束偏移)
+    """
+    records, offset = [], 0
+    with open(path, "rb") as f:
+        data = f.read()
+    while offset + _HEADER.size <= len(data):
+        length, crc = _HEADER.unpack_from(data, offset)
+        start = offset + _HEADER.size
+        body = data[start:start + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            break
+        try:
+            records.append(json.loads(body.decode("utf-8")))
+        except ValueError:
+            break
+        offset = start + length
+    return records, offset
+
+
+class SessionJournal:
+    """
+    会话事件日志（仅追加）
+    请求线程只把事件放入内存缓冲区，后台线程按间隔成组写入并fsync（组提交）；
+    事件数达到阈值时写快照并切换到新的日志段，旧日志段删除（压缩）。
+    启动恢复时读取最新快照，只重放其后的日志段。
+
+    文件: snapshot-<代>.bin 保存该代之前的全部状态，journal-<代>.log 保存之后的事件。
+    同一目录只允许一个进程使用（恢复时对 journal.lock 加排他锁，直到 close）：
+    多个进程同时追加和压缩会互相删除对方仍在写入的日志段。
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 0.05, snapshot_every: int = 10000,
+                 fsync: bool = True):
+        """
+        参数:
+            directory: 日志目录
+            flush_interval: 组提交间隔（秒），崩溃时最多丢失该间隔内的事件
+            snapshot_every: 每写入多少个事件做一次快照和压缩
+            fsync: 每次组提交后是否fsync
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        self._cond = threading.Condition()
+        self._pending: List[dict] = []
+        self._appended = 0  # 已放入缓冲区的事件数
+        self._written = 0  # 已写入文件的事件数
+        self._flush_requested = False
+        self._closed = False
+        self._file = None
+        self._generation = 0
+        self._since_snapshot = 0
+        self._thread: Optional[threading.Thread] = None
+        self._lock = None
+        self._lock_file = None
+        self._export: Optional[Callable[[], list]] = None
+        self.stats = {"events": 0, "batches": 0, "bytes": 0, "fsyncs": 0, "snapshots": 0, "write_errors": 0,
+                      "recovered_events": 0, "recovery_ms": 0.0, "last_batch_ms": 0.0, "last_snapshot_ms": 0.0}
+
+    def _path(self, kind: str, generation: int) -> str:
+        suffix = "log" if kind == "journal" else "bin"
+        return os.path.join(self.directory, f"{kind}-{generation:08d}.{suffix}")
+
+    def _generations(self, pattern) -> List[int]:
+        return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(self.directory)) if m)
+
+    def _acquire_directory(self):
+        """对目录加排他锁，已被其他进程持有时抛出 OSError"""
+        if fcntl is None or self._lock_file is not None:
+            return
+        lock_file = open(os.path.join(self.directory, _LOCK_NAME), "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            lock_file.close()
+            raise OSError(f"会话日志目录 {self.directory} 已被其他进程使用"
+                          f"（多个工作进程或调试重载器请使用 sqlite 会话存储）: {e}") from e
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._lock_file = lock_file
+
+    def _release_directory(self):
+        if self._lock_file is not None:
+            # 关闭文件即释放锁
+            self._lock_file.close()
+            self._lock_file = None
+
+    def recover(self) -> Tuple[Optional[list], List[dict]]:
+        """
+        对日志目录加排他锁，读取最新的有效快照及其后的日志事件，截断日志末尾写了一半的记录
+
+        返回:
+            (快照中的会话列表或None, 需要按顺序重放的事件)
+
+        Raises:
+            OSError: 目录已被其他进程使用
+        """
+        self._acquire_directory()
+        start = time.perf_counter()
+        snapshot, base = None, 0
+        for generation in reversed(self._generations(_SNAPSHOT_RE)):
+            records, _ = read_records(self._path("snapshot", generation))
+            if records:
+                snapshot, base = records[0]["sessions"], generation
+                break
+            print(f"会话快照 {generation} 不完整，尝试上一个快照")
+
+        events = []
+        journals = [g for g in self._generations(_JOURNAL_RE) if g >= base]
+        for generation in journals:
+            path = self._path("journal", generation)
+            records, end = read_records(path)
+            events.extend(records)
+            if end < os.path.getsize(path):
+                print(f"会话日志 {os.path.basename(path)} 末尾有 {os.path.getsize(path) - end} 字节不完整记录，已截断")
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        self._generation = journals[-1] if journals else base
+        self._remove_before(base)
+        self._since_snapshot = len(events)
+        self.stats["recovered_events"] = len(events)
+        self.stats["recovery_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return snapshot, events
+
+    def start(self, lock, export: Callable[[], list]):
+        """
+        打开当前日志段并启动后台写入线程
+
+        参数:
+            lock: 会话存储的锁，append 须在持有该锁时调用，快照在该锁内导出状态以与日志切分点一致
+            export: 返回全部会话（可JSON序列化）的函数
+        """
+        self._lock = lock
+        self._export = export
+        self._file = open(self._path("journal", self._generation), "ab")
+        self._thread = threading.Thread(target=self._run, name="session-journal", daemon=True)
+        self._thread.start()
+
+    def append(self, event: dict):
+        """放入缓冲区，由后台线程写入（不等待磁盘）"""
+        with self._cond:
+            self._pending.append(event)
+            self._appended += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待当前缓冲区中的事件写入文件"""
+        with self._cond:
+            target = self._appended
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._written >= target or self._thread is None
+                                       or not self._thread.is_alive(), timeout)
+
+    def _take_pending(self) -> List[dict]:
+        with self._cond:
+            pending, self._pending = self._pending, []
+            self._flush_requested = False
+            return pending
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and not self._flush_requested:
+                    self._cond.wait(self.flush_interval)
+                closing = self._closed
+            if self.snapshot_every and self._since_snapshot >= self.snapshot_every:
+                self._snapshot()
+            else:
+                self._write(self._take_pending())
+            if closing:
+                return
+
+    def _write(self, events: List[dict]):
+        """组提交：一次写入整批记录并fsync"""
+        if events:
+            start = time.perf_counter()
+            try:
+                data = b"".join(encode_record(event) for event in events)
+                self._file.write(data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                    self.stats["fsyncs"] += 1
+                self.stats["events"] += len(events)
+                self.stats["batches"] += 1
+                self.stats["bytes"] += len(data)
+                self.stats["last_batch_ms"] = round((time.perf_counter() - start) * 1000, 3)
+                self._since_snapshot += len(events)
+            except (OSError, TypeError, ValueError) as e:
+                self.stats["write_errors"] += 1
+                print(f"会话日志写入失败: {e}")
+        with self._cond:
+            self._written += len(events)
+            self._cond.notify_all()
+
+    def _snapshot(self):
+        """写快照并切换日志段：快照保存到切分点为止的全部状态，之前的日志段和快照随后删除"""
+        start = time.perf_counter()
+        with self._lock:
+            sessions = self._export()
+            events = self._take_pending()
+        # 切分点之前的事件仍写入旧日志段，快照写入失败时可以从旧日志段恢复
+        self._write(events)
+        generation = self._generation + 1
+        try:
+            new_file = open(self._path("journal", generation), "ab")
+            path = self._path("snapshot", generation)
+            with open(path + ".tmp", "wb") as f:
+                f.write(encode_record({"generation": generation, "sessions": sessions}))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+        except (OSError, TypeError, ValueError) as e:
+            self.stats["write_errors"] += 1
+            print(f"会话快照写入失败: {e}")
+            self._since_snapshot = 0
+            return
+        old_file, self._file, self._generation = self._file, new_file, generation
+        old_file.close()
+        self._remove_before(generation)
+        self._since_snapshot = 0
+        self.stats["snapshots"] += 1
+        self.stats["last_snapshot_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    def _remove_before(self, generation: int):
+        for pattern, kind in ((_JOURNAL_RE, "journal"), (_SNAPSHOT_RE, "snapshot")):
+            for old in self._generations(pattern):
+                if old < generation:
+                    try:
+                        os.remove(self._path(kind, old))
+                    except OSError as e:
+                        print(f"删除旧会话日志失败: {e}")
+
+    def close(self):
+        """写入剩余事件并停止后台线程"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        if self._file is not None:
+            self._file.close()
+        self._release_directory()
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._cond:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending)
+        stats["generation"] = self._generation
+        stats["since_snapshot"] = self._since_snapshot
+        return stats
@@ -0,0 +1,603 @@
+import os
+import copy
+import json
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from Text2SqlwithContext.src.basic_function.config import (
+    CONTEXT_STORE, CONTEXT_STORE_PATH, CONTEXT_JOURNAL_DIR, CONTEXT_JOURNAL_FLUSH_MS,
+    CONTEXT_JOURNAL_SNAPSHOT_EVENTS, CONTEXT_JOURNAL_FSYNC
+)
+from Text2SqlwithContext.src.nlp_to_sql.session_journal import SessionJournal
+
+
+def _json_default(value):
+    """历史记录中的时间转为ISO格式，其他无法序列化的值（如numpy标量）转为字符串"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class SessionStore:
+    """
+    会话存储接口
+    会话对象为 {"history": deque, "created_at", "last_activity", "entities"}；
+    历史记录和实体按轮次增量写入，不整体序列化全部会话
+    """
+
+    def __init__(self, max_history: int, session_timeout: int, max_sessions: int):
+        """
+        参数:
+            max_history: 每个会话保存的最大历史记录数
+            session_timeout: 会话超时时间（秒）
+            max_sessions: 最多保留的会话数，超出时淘汰最久未活动的会话（0表示不限）
+        """
+        self.max_history = max_history
+        self.session_timeout = session_timeout
+        self.max_sessions = max_sessions
+        self.expired_count = 0
+        self.evicted_count = 0
+
+    def _expired(self, last_activity: datetime, now: datetime) -> bool:
+        return (now - last_activity).total_seconds() > self.session_timeout
+
+    def _new_session(self, now: datetime) -> dict:
+        return {
+            "history": deque(maxlen=self.max_history),
+            "created_at": now,
+            "last_activity": now,
+            "entities": {}  # 当前会话的实体映射
+        }
+
+    def get(self, session_id: str, now: datetime) -> Optional[dict]:
+        """获取未过期的会话并更新最后活动时间，不存在或已过期时返回None"""
+        raise NotImplementedError
+
+    def create(self, session_id: str, now: datetime) -> dict:
+        """创建（或重置已过期的）会话"""
+        raise NotImplementedError
+
+    def append_history(self, session_id: str, entry: dict):
+        """追加一轮对话，只保留最近 max_history 轮"""
+        raise NotImplementedError
+
+    def prune_history(self, session_id: str, keep: int):
+        """只保留最近 keep 轮历史（检测到主题切换时丢弃旧话题）"""
+        raise NotImplementedError
+
+    def update_entities(self, session_id: str, update: Callable[[dict], dict]):
+        """以当前实体映射调用 update 并保存其返回值（同一会话的读改写不会交错）"""
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """删除会话"""
+        raise NotImplementedError
+
+    def clean_expired(self, now: datetime):
+        """清理过期会话"""
+        raise NotImplementedError
+
+    def put_many(self, sessions: Dict[str, dict]):
+        """批量写入完整的会话（用于从文件导入）"""
+        raise NotImplementedError
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        """遍历全部会话"""
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def get_stats(self) -> dict:
+        return {
+            "store": self.__class__.__name__,
+            "sessions": len(self),
+            "max_sessions": self.max_sessions,
+            "session_timeout": self.session_timeout,
+            "expired": self.expired_count,
+            "evicted": self.evicted_count
+        }
+
+
+class MemorySessionStore(SessionStore):
+    """
+    进程内会话存储
+    会话按最后活动时间从旧到新排列：过期和淘汰都只需检查头部，均摊O(1)。
+    _lock 只保护会话索引（OrderedDict）的O(1)增删和移动；会话内容的读改写由调用方持有的会话锁保护
+    """
+
+    def __init__(self, max_history: int, session_timeout: int, max_sessions: int):
+        super().__init__(max_history, session_timeout, max_sessions)
+        self.sessions: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, session_id: str, now: datetime) -> Optional[dict]:
+        with self._lock:
+            self.clean_expired(now)
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            # 更新最后活动时间并移到末尾，保持按活动时间排序
+            session["last_activity"] = now
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def create(self, session_id: str, now: datetime) -> dict:
+        with self._lock:
+            self.sessions.pop(session_id, None)
+            session = self.sessions[session_id] = self._new_session(now)
+            self._evict_overflow()
+            return session
+
+    def append_history(self, session_id: str, entry: dict):
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session["history"].append(entry)
+
+    def prune_history(self, session_id: str, keep: int):
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            history = session["history"]
+            while len(history) > keep:
+                history.popleft()
+
+    def update_entities(self, session_id: str, update: Callable[[dict], dict]):
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is not None:
+            session["entities"] = update(session["entities"])
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self.sessions.pop(session_id, None)
+
+    def clean_expired(self, now: datetime):
+        with self._lock:
+            while self.sessions:
+                session_id, session = next(iter(self.sessions.items()))
+                if not self._expired(session["last_activity"], now):
+                    break
+                del self.sessions[session_id]
+                self.expired_count += 1
+
+    def _evict_overflow(self):
+        """会话数超过上限时淘汰最久未活动的会话"""
+        if self.max_sessions:
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted_count += 1
+
+    def put_many(self, sessions: Dict[str, dict]):
+        # 与已有会话合并后按最后活动时间重新排序
+        with self._lock:
+            merged = dict(self.sessions)
+            merged.update(sessions)
+            self.sessions = OrderedDict(sorted(merged.items(), key=lambda item: item[1]["last_activity"]))
+            self._evict_overflow()
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        with self._lock:
+            return iter(list(self.sessions.items()))
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+
+def _parse_time(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+class JournalSessionStore(MemorySessionStore):
+    """
+    进程内会话存储 + 追加日志持久化（单进程；多个工作进程共享会话请使用 sqlite）
+    每次变更记录一个事件（create/history/prune/entities/expire/put），由 SessionJournal 在后台成组写盘，
+    请求线程只做内存操作；启动时从最新快照和其后的日志恢复
+    """
+
+    def __init__(self, directory: str, max_history: int, session_timeout: int, max_sessions: int,
+                 flush_interval: float = CONTEXT_JOURNAL_FLUSH_MS / 1000,
+                 snapshot_every: int = CONTEXT_JOURNAL_SNAPSHOT_EVENTS, fsync: bool = CONTEXT_JOURNAL_FSYNC):
+        super().__init__(max_history, session_timeout, max_sessions)
+        # 内存变更和写入日志缓冲区在同一个 _lock 临界区内（均为O(1)操作），
+        # 保证快照导出的状态与日志切分点一致
+        self._replaying = False
+        self.journal = SessionJournal(directory, flush_interval, snapshot_every, fsync)
+        snapshot, events = self.journal.recover()
+        self._restore(snapshot, events)
+        self.journal.start(self._lock, self._export)
+        atexit.register(self.close)
+
+    def _append(self, event: dict):
+        if not self._replaying:
+            self.journal.append(event)
+
+    def create(self, session_id: str, now: datetime) -> dict:
+        with self._lock:
+            session = super().create(session_id, now)
+            self._append({"op": "create", "sid": session_id, "ts": now})
+            return session
+
+    def append_history(self, session_id: str, entry: dict):
+        with self._lock:
+            if session_id in self.sessions:
+                super().append_history(session_id, entry)
+                self._append({"op": "history", "sid": session_id, "entry": entry})
+
+    def prune_history(self, session_id: str, keep: int):
+        with self._lock:
+            if session_id in self.sessions:
+                super().prune_history(session_id, keep)
+                self._append({"op": "prune", "sid": session_id, "keep": keep})
+
+    def update_entities(self, session_id: str, update: Callable[[dict], dict]):
+        with self._lock:
+            if session_id in self.sessions:
+                super().update_entities(session_id, update)
+                # 实体映射会被后续轮次原地修改，写入日志的是当前副本
+                self._append({"op": "entities", "sid": session_id,
+                              "entities": copy.deepcopy(self.sessions[session_id]["entities"])})
+
+    def delete(self, session_id: str):
+        with self._lock:
+            if self.sessions.pop(session_id, None) is not None:
+                self._append({"op": "expire", "sid": session_id})
+
+    def clean_expired(self, now: datetime):
+        with self._lock:
+            while self.sessions:
+                session_id, session = next(iter(self.sessions.items()))
+                if not self._expired(session["last_activity"], now):
+                    break
+                del self.sessions[session_id]
+                self.expired_count += 1
+                self._append({"op": "expire", "sid": session_id})
+
+    def _evict_overflow(self):
+        if self.max_sessions:
+            while len(self.sessions) > self.max_sessions:
+                session_id, _ = self.sessions.popitem(last=False)
+                self.evicted_count += 1
+                self._append({"op": "expire", "sid": session_id})
+
+    def put_many(self, sessions: Dict[str, dict]):
+        with self._lock:
+            super().put_many(sessions)
+            for session_id, session in sessions.items():
+                if session_id in self.sessions:
+                    self._append({"op": "put", "sid": session_id, "session": self._dump(session)})
+
+    @staticmethod
+    def _dump(session: dict) -> dict:
+        return {
+            "created_at": session["created_at"],
+            "last_activity": session["last_activity"],
+            "history": list(session["history"]),
+            "entities": copy.deepcopy(session["entities"])
+        }
+
+    def _load(self, data: dict) -> dict:
+        history = deque(maxlen=self.max_history)
+        for entry in data["history"]:
+            history.append(dict(entry, timestamp=_parse_time(entry.get("timestamp"))))
+        return {
+            "history": history,
+            "created_at": _parse_time(data["created_at"]),
+            "last_activity": _parse_time(data["last_activity"]),
+            "entities": data["entities"]
+        }
+
+    def _export(self) -> list:
+        """快照内容：按最后活动时间排列的全部会话（由日志线程在持有锁时调用）"""
+        return [[session_id, self._dump(session)] for session_id, session in self.sessions.items()]
+
+    def _restore(self, snapshot: Optional[list], events: List[dict]):
+        """载入快照并按顺序重放其后的事件"""
+        self._replaying = True
+        try:
+            for session_id, data in snapshot or []:
+                self.sessions[session_id] = self._load(data)
+            for event in events:
+                op, session_id = event.get("op"), event.get("sid")
+                if op == "create":
+                    MemorySessionStore.create(self, session_id, _parse_time(event["ts"]))
+                elif op == "history" and session_id in self.sessions:
+                    session = self.sessions[session_id]
+                    entry = dict(event["entry"], timestamp=_parse_time(event["entry"].get("timestamp")))
+                    session["history"].append(entry)
+                    if isinstance(entry["timestamp"], datetime):
+                        session["last_activity"] = max(session["last_activity"], entry["timestamp"])
+                    self.sessions.move_to_end(session_id)
+                elif op == "prune" and session_id in self.sessions:
+                    MemorySessionStore.prune_history(self, session_id, event["keep"])
+                elif op == "entities" and session_id in self.sessions:
+                    self.sessions[session_id]["entities"] = event["entities"]
+                elif op == "expire":
+                    self.sessions.pop(session_id, None)
+                elif op == "put":
+                    MemorySessionStore.put_many(self, {session_id: self._load(event["session"])})
+        finally:
+            self._replaying = False
+
+    def flush(self) -> bool:
+        """等待已记录的事件写入磁盘"""
+        return self.journal.flush()
+
+    def close(self):
+        self.journal.close()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = super().get_stats()
+        stats["journal"] = self.journal.get_stats()
+        return stats
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite会话存储（WAL模式），同一台机器上的多个工作进程共享会话
+    会话元数据和每轮历史分表保存：每次请求只读取一个会话的最近几轮，追加一轮只写入一行；
+    每个线程使用自己的连接，读取在WAL下互不阻塞，也不写库。
+
+    SQLite没有行级锁：写入使用 BEGIN IMMEDIATE 短事务，持有的是整个数据库的写锁，
+    所有会话、所有工作进程的写入串行执行（同一会话的读改写因此不会交错覆盖）。
+    每个事务只涉及一个会话的几行、在内存页上完成提交（synchronous=NORMAL，不逐次fsync），
+    持锁时间为亚毫秒级，远小于一次LLM调用和SQL查询，对单机的几个工作进程足够；
+    需要更高写并发时应改用服务端数据库。为缩短写路径，读取会话不单独刷新最后活动时间，
+    最后活动时间随追加历史等写操作一并更新（会话超时从最后一次写入算起）
+    """
+
+    # 过期/超量会话的清理间隔（秒）
+    CLEANUP_INTERVAL = 60.0
+
+    def __init__(self, path: str, max_history: int, session_timeout: int, max_sessions: int):
+        super().__init__(max_history, session_timeout, max_sessions)
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()  # 保护连接列表和计数
+        self._next_cleanup = 0.0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " last_activity REAL NOT NULL,"
+            " entities TEXT NOT NULL DEFAULT '{}')"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_activity ON sessions (last_activity)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_history ("
+            " session_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " entry TEXT NOT NULL,"
+            " PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """当前线程的连接（自动提交模式，事务由 _transaction 显式开启）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 获取写锁（线程和进程间忙时按timeout等待）"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load(self, conn, session_id: str, row) -> dict:
+        created_at, last_activity, entities = row
+        history = deque(maxlen=self.max_history)
+        rows = conn.execute(
+            "SELECT entry FROM session_history WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+            (session_id, self.max_history)
+        ).fetchall()
+        for (entry,) in reversed(rows):
+            item = json.loads(entry)
+            if isinstance(item.get("timestamp"), str):
+                item["timestamp"] = datetime.fromisoformat(item["timestamp"])
+            history.append(item)
+        return {
+            "history": history,
+            "created_at": datetime.fromtimestamp(created_at),
+            "last_activity": datetime.fromtimestamp(last_activity),
+            "entities": json.loads(entities)
+        }
+
+    def get(self, session_id: str, now: datetime) -> Optional[dict]:
+        try:
+            conn = self._connection()
+            # 会话行和历史在同一个读事务中读取
+            conn.execute("BEGIN")
+            try:
+                row = conn.execute(
+                    "SELECT created_at, last_activity, entities FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is None or now.timestamp() - row[1] > self.session_timeout:
+                    return None
+                session = self._load(conn, session_id, row)
+            finally:
+                conn.execute("COMMIT")
+            # 最后活动时间由 append_history / update_entities 在各自的事务中更新，读取不另开写事务
+            return session
+        except (sqlite3.Error, ValueError) as e:
+            print(f"会话读取失败: {e}")
+            return None
+
+    def create(self, session_id: str, now: datetime) -> dict:
+        ts = now.timestamp()
+        try:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT created_at, last_activity, entities FROM sessions WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                if row is not None and ts - row[1] <= self.session_timeout:
+                    # 其他工作进程已创建该会话
+                    return self._load(conn, session_id, row)
+                conn.execute("DELETE FROM session_history WHERE session_id = ?", (session_id,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, created_at, last_activity, entities)"
+                    " VALUES (?, ?, ?, '{}')", (session_id, ts, ts)
+                )
+        except (sqlite3.Error, ValueError) as e:
+            print(f"会话创建失败，本次请求不保存上下文: {e}")
+        self._maybe_cleanup(now)
+        return self._new_session(now)
+
+    def append_history(self, session_id: str, entry: dict):
+        try:
+            payload = json.dumps(entry, ensure_ascii=False, default=_json_default)
+            with self._transaction() as conn:
+                seq = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) + 1 FROM session_history WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+                conn.execute("INSERT INTO session_history (session_id, seq, entry) VALUES (?, ?, ?)",
+                             (session_id, seq, payload))
+                conn.execute("DELETE FROM session_history WHERE session_id = ? AND seq <= ?",
+                             (session_id, seq - self.max_history))
+                conn.execute("UPDATE sessions SET last_activity = MAX(last_activity, ?) WHERE session_id = ?",
+                             (datetime.now().timestamp(), session_id))
+        except sqlite3.Error as e:
+            print(f"会话历史写入失败: {e}")
+
+    def prune_history(self, session_id: str, keep: int):
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "DELETE FROM session_history WHERE session_id = ? AND seq <= "
+                    "(SELECT COALESCE(MAX(seq), 0) FROM session_history WHERE session_id = ?) - ?",
+                    (session_id, session_id, keep)
+                )
+        except sqlite3.Error as e:
+            print(f"会话历史清理失败: {e}")
+
+    def update_entities(self, session_id: str, update: Callable[[dict], dict]):
+        try:
+            with self._transaction() as conn:
+                row = conn.execute("SELECT entities FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+                if row is None:
+                    return
+                entities = update(json.loads(row[0]))
+                conn.execute("UPDATE sessions SET entities = ?, last_activity = MAX(last_activity, ?)"
+                             " WHERE session_id = ?",
+                             (json.dumps(entities, ensure_ascii=False, default=_json_default),
+                              datetime.now().timestamp(), session_id))
+        except (sqlite3.Error, ValueError) as e:
+            print(f"会话实体写入失败: {e}")
+
+    def delete(self, session_id: str):
+        try:
+            with self._transaction() as conn:
+                self._delete_ids(conn, [session_id])
+        except sqlite3.Error as e:
+            print(f"会话删除失败: {e}")
+
+    @staticmethod
+    def _delete_ids(conn, session_ids):
+        rows = [(session_id,) for session_id in session_ids]
+        conn.executemany("DELETE FROM session_history WHERE session_id = ?", rows)
+        conn.executemany("DELETE FROM sessions WHERE session_id = ?", rows)
+
+    def _maybe_cleanup(self, now: datetime):
+        """新建会话时按间隔清理，避免每次请求都写库"""
+        if now.timestamp() >= self._next_cleanup:
+            self.clean_expired(now)
+
+    def clean_expired(self, now: datetime):
+        self._next_cleanup = now.timestamp() + self.CLEANUP_INTERVAL
+        try:
+            with self._transaction() as conn:
+                expired = [r[0] for r in conn.execute(
+                    "SELECT session_id FROM sessions WHERE last_activity < ?",
+                    (now.timestamp() - self.session_timeout,)
+                )]
+                self._delete_ids(conn, expired)
+                evicted = []
+                if self.max_sessions:
+                    evicted = [r[0] for r in conn.execute(
+                        "SELECT session_id FROM sessions ORDER BY last_activity DESC LIMIT -1 OFFSET ?",
+                        (self.max_sessions,)
+                    )]
+                    self._delete_ids(conn, evicted)
+            with self._lock:
+                self.expired_count += len(expired)
+                self.evicted_count += len(evicted)
+        except sqlite3.Error as e:
+            print(f"过期会话清理失败: {e}")
+
+    def put_many(self, sessions: Dict[str, dict]):
+        with self._transaction() as conn:
+            self._delete_ids(conn, list(sessions))
+            for session_id, session in sessions.items():
+                conn.execute(
+                    "INSERT INTO sessions (session_id, created_at, last_activity, entities) VALUES (?, ?, ?, ?)",
+                    (session_id, session["created_at"].timestamp(), session["last_activity"].timestamp(),
+                     json.dumps(session["entities"], ensure_ascii=False, default=_json_default))
+                )
+                conn.executemany(
+                    "INSERT INTO session_history (session_id, seq, entry) VALUES (?, ?, ?)",
+                    [(session_id, seq, json.dumps(entry, ensure_ascii=False, default=_json_default))
+                     for seq, entry in enumerate(list(session["history"])[-self.max_history:], 1)]
+                )
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        conn = self._connection()
+        rows = conn.execute(
+            "SELECT session_id, created_at, last_activity, entities FROM sessions ORDER BY last_activity"
+        ).fetchall()
+        sessions = [(r[0], self._load(conn, r[0], r[1:])) for r in rows]
+        return iter(sessions)
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def create_session_store(max_history: int, session_timeout: int, max_sessions: int,
+                         kind: str = CONTEXT_STORE, path: str = CONTEXT_STORE_PATH) -> SessionStore:
+    """
+    按配置创建会话存储
+
+    参数:
+        kind: memory（进程内）、journal（进程内+追加日志持久化）或 sqlite（多个工作进程共享）
+        path: SQLite会话库路径
+    """
+    if kind == "journal":
+        try:
+            return JournalSessionStore(CONTEXT_JOURNAL_DIR, max_history, session_timeout, max_sessions)
+        except OSError as e:
+            print(f"会话日志初始化失败，使用进程内会话存储: {e}")
+    elif kind == "sqlite":
+        try:
+            return SQLiteSessionStore(path, max_history, session_timeout, max_sessions)
+        except sqlite3.Error as e:
+            print(f"会话数据库初始化失败，使用进程内会话存储: {e}")
+    elif kind != "memory":
+        print(f"未知的会话存储类型 {kind}，使用进程内会话存储")
+    return MemorySessionStore(max_history, session_timeout, max_sessions)
@@ -1,32 +1,18 @@
-from Text2SqlwithContext.src.nlp_to_sql.llm_client import call_llm_model
+from Text2SqlwithContext.src.nlp_to_sql.async_llm_client import call_llm_model_async, run_sync
 import datetime
 import uuid
 
-def generate_sql_from_nl(query_data):
-    """
-    从自然语言查询生成SQL
-    
-    Args:
-        query_data (dict): 包含查询信息的字典
-        
-    Returns:
-        dict: 包含生成SQL和元数据的字典
-    """
-    # 提取查询信息
+def _build_output(query_data, natural_language_query, result):
+    """根据LLM结果组装输出数据"""
     query_id = query_data.get("query_id", str(uuid.uuid4()))
-    natural_language_query = query_data.get("natural_language_query")
-    schema_info = query_data.get("database_schema")
-    
-    # 调用大模型生成SQL
-    result = call_llm_model(natural_language_query, schema_info)
-    
+
     # 准备输出数据
     output = {
         "query_id": query_id,
         "natural_language_query": natural_language_query,
         "timestamp": datetime.datetime.utcnow().isoformat() + "Z"
     }
-    
+
     # 添加SQL生成结果
     if result["success"]:
         output["generated_sql"] = result["generated_sql"]
@@ -39,5 +25,39 @@ def generate_sql_from_nl(query_data):
         # 若不是，请确保llm_client返回的error字段就是print的中文内容
         output["error"] = result["error"]  # 只保留中文错误信息
         output["metadata"] = result["metadata"]
-    
+
     return output
+
+async def generate_sql_from_nl_async(query_data):
+    """
+    从自然语言查询生成SQL（异步版本）
+
+    Args:
+        query_data (dict): 包含查询信息的字典
+
+    Returns:
+        dict: 包含生成SQL和元数据的字典
+    """
+    # 提取查询信息
+    natural_language_query = query_data.get("natural_language_query")
+    schema_info = query_data.get("database_schema")
+    schema_hash = query_data.get("schema_hash")
+
+    # 调用大模型生成SQL（命中缓存或相同请求进行中时不重复发起）
+    result = await call_llm_model_async(natural_language_query, schema_info, schema_hash)
+    return _build_output(query_data, natural_language_query, result)
+
+def generate_sql_from_nl(query_data):
+    """
+    从自然语言查询生成SQL
+
+    同步封装：在共享的后台事件循环中执行 generate_sql_from_nl_async，
+    供 app.py 和 main.py 直接调用
+
+    Args:
+        query_data (dict): 包含查询信息的字典
+
+    Returns:
+        dict: 包含生成SQL和元数据的字典
+    """
+    return run_sync(generate_sql_from_nl_async(query_data))
@@ -0,0 +1,164 @@
+import datetime
+import decimal
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+import pandas as pd # type: ignore
+
+# 列类型：按 cursor.description 的 type_code 映射，无法识别时按首个非空值推断
+INT, FLOAT, DECIMAL, DATE, DATETIME, BOOL, OBJECT = 'int', 'float', 'decimal', 'date', 'datetime', 'bool', 'object'
+
+# mysql.connector FieldType
+_MYSQL_TYPES = {
+    0: DECIMAL, 246: DECIMAL,
+    1: INT, 2: INT, 3: INT, 8: INT, 9: INT, 13: INT,
+    4: FLOAT, 5: FLOAT,
+    10: DATE, 14: DATE,
+    7: DATETIME, 12: DATETIME
+}
+
+# PostgreSQL 类型OID
+_POSTGRES_TYPES = {
+    20: INT, 21: INT, 23: INT,
+    700: FLOAT, 701: FLOAT,
+    1700: DECIMAL,
+    1082: DATE,
+    1114: DATETIME,
+    16: BOOL
+}
+
+# pyodbc 的 type_code 为Python类型
+_PYTHON_TYPES = {
+    int: INT, float: FLOAT, decimal.Decimal: DECIMAL,
+    datetime.date: DATE, datetime.datetime: DATETIME, bool: BOOL
+}
+
+
+def column_kinds(description: Sequence, db_type: str) -> List[Optional[str]]:
+    """
+    根据 cursor.description 确定每列的类型，None表示需按数据推断
+
+    参数:
+        description: DB-API cursor.description
+        db_type: 数据库类型
+
+    返回:
+        每列的类型
+    """
+    kinds = []
+    for desc in description:
+        type_code = desc[1]
+        if db_type == 'mysql':
+            kinds.append(_MYSQL_TYPES.get(type_code, OBJECT if type_code is not None else None))
+        elif db_type == 'postgresql':
+            kinds.append(_POSTGRES_TYPES.get(type_code, OBJECT if type_code is not None else None))
+        elif db_type == 'sqlserver':
+            kinds.append(_PYTHON_TYPES.get(type_code, OBJECT if type_code is not None else None))
+        else:
+            # SQLite的description不含类型
+            kinds.append(None)
+    return kinds
+
+
+def _infer_kind(values) -> str:
+    for v in values:
+        if v is None:
+            continue
+        if isinstance(v, bool):
+            return BOOL
+        if isinstance(v, int):
+            return INT
+        if isinstance(v, float):
+            return FLOAT
+        if isinstance(v, decimal.Decimal):
+            return DECIMAL
+        if isinstance(v, datetime.datetime):
+            return DATETIME
+        if isinstance(v, datetime.date):
+            return DATE
+        return OBJECT
+    return OBJECT
+
+
+def _object_array(values) -> np.ndarray:
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _float_array(values) -> np.ndarray:
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+
+
+def _convert(values: tuple, kind: str) -> np.ndarray:
+    """将一批同列的值转换为NumPy数组，转换失败时退回object数组"""
+    try:
+        if kind == INT:
+            # SQLite按NUMERIC亲和性把 70.00 存为整数、70.5 存为实数，同一列可能混有int和float：
+            # 只有整批都是int时才用int64，否则按float64转换，避免截断小数
+            if all(type(v) is int for v in values):
+                return np.fromiter(values, dtype=np.int64, count=len(values))
+            return _float_array(values)
+        if kind in (FLOAT, DECIMAL):
+            return _float_array(values)
+        if kind in (DATE, DATETIME):
+            if any(getattr(v, 'tzinfo', None) is not None for v in values):
+                return _object_array(values)
+            # 经pandas向量化解析，比 np.array(..., dtype='datetime64') 逐个转换快一个数量级
+            return pd.to_datetime(_object_array(values)).to_numpy().astype('datetime64[ns]', copy=False)
+        if kind == BOOL and None not in values:
+            return np.fromiter(values, dtype=np.bool_, count=len(values))
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return _object_array(values)
+
+
+class ColumnarBuffer:
+    """
+    按列累积查询结果：每批元组行转置后直接转换为带类型的NumPy数组，
+    不为每行创建dict，最后由各列数组构建DataFrame
+    """
+
+    def __init__(self, columns: Sequence[str], kinds: Optional[Sequence[Optional[str]]] = None):
+        self.columns = list(columns)
+        self.kinds: List[Optional[str]] = list(kinds) if kinds is not None else [None] * len(self.columns)
+        self._chunks: List[List[np.ndarray]] = [[] for _ in self.columns]
+        self.rows = 0
+
+    def append(self, batch: Sequence[Tuple]):
+        """追加一批元组行"""
+        if not batch:
+            return
+        for i, values in enumerate(zip(*batch)):
+            kind = self.kinds[i]
+            if kind is None:
+                kind = _infer_kind(values)
+                self.kinds[i] = kind
+            array = _convert(values, kind)
+            if kind == INT and array.dtype == np.float64:
+                # 后续批次出现小数或NULL时提升为FLOAT，已有的int64批次在合并时转为float64
+                self.kinds[i] = FLOAT
+            self._chunks[i].append(array)
+        self.rows += len(batch)
+
+    def _concat(self, chunks: List[np.ndarray]) -> np.ndarray:
+        if len(chunks) == 1:
+            return chunks[0]
+        if any(c.dtype == object for c in chunks):
+            # 有批次退回了object，整列统一为object
+            chunks = [c if c.dtype == object else _object_array(c.tolist()) for c in chunks]
+        return np.concatenate(chunks)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """由各列数组构建DataFrame（不再复制数据）"""
+        if self.rows == 0:
+            return pd.DataFrame(columns=self.columns)
+        arrays = [self._concat(chunks) for chunks in self._chunks]
+        if len(set(self.columns)) != len(self.columns):
+            # 重名列无法作为dict的键，先按位置构建再设置列名
+            frame = pd.DataFrame(dict(enumerate(arrays)), copy=False)
+            frame.columns = self.columns
+            return frame
+        return pd.DataFrame(dict(zip(self.columns, arrays)), columns=self.columns, copy=False)
@@ -0,0 +1,411 @@
+import time
+import tempfile
+import sqlite3
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Optional
+from ..basic_function.config import (
+    get_db_config, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX_LIFETIME, DB_POOL_IDLE_TIMEOUT, DB_POOL_VALIDATE_AFTER, SEED_MYSQL_LOAD_DATA
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(TimeoutError):
+    """连接池耗尽且等待超时"""
+
+
+def _connect_mysql(config: dict):
+    import mysql.connector  # type: ignore
+    if SEED_MYSQL_LOAD_DATA:
+        # 种子导入使用 LOAD DATA LOCAL INFILE，只允许读取临时目录中的文件
+        config = dict(config, allow_local_infile_in_path=tempfile.gettempdir())
+    return mysql.connector.connect(**config)
+
+
+def _connect_postgresql(config: dict):
+    import psycopg2  # type: ignore
+    return psycopg2.connect(
+        host=config['host'],
+        user=config['user'],
+        password=config['password'],
+        dbname=config['database'],
+        port=config.get('port', 5432)
+    )
+
+
+def _connect_sqlserver(config: dict):
+    import pyodbc  # type: ignore
+    conn_str = (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={config['host']};"
+        f"DATABASE={config['database']};"
+        f"UID={config['user']};"
+        f"PWD={config['password']};"
+        f"Encrypt=no;"
+    )
+    return pyodbc.connect(conn_str)
+
+
+def _connect_sqlite(config: dict):
+    # 连接在线程间传递（同一时刻只有一个线程使用）
+    return sqlite3.connect(config['database'], check_same_thread=False)
+
+
+# 驱动按需导入，未使用的数据库无需安装驱动
+_CONNECTORS: Dict[str, Callable] = {
+    'mysql': _connect_mysql,
+    'postgresql': _connect_postgresql,
+    'sqlserver': _connect_sqlserver,
+    'sqlite': _connect_sqlite
+}
+
+
+def _ping(db_type: str, connection) -> bool:
+    """检测连接是否可用"""
+    try:
+        if db_type == 'mysql':
+            connection.ping(reconnect=False)
+            return True
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.rollback()
+        return True
+    except Exception as err:
+        logger.info(f"{db_type}连接检测失败: {err}")
+        return False
+
+
+class _PooledConnection:
+    __slots__ = ('raw', 'created_at', 'last_used')
+
+    def __init__(self, raw, now: float):
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+class _Waiter:
+    """排队等待连接的请求：归还的连接或新建连接的名额按先来先得交给队首"""
+    __slots__ = ('event', 'entry', 'may_create')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.entry: Optional[_PooledConnection] = None
+        self.may_create = False
+
+
+class ConnectionPool:
+    """
+    统一的数据库连接池
+    连接数在 min_size..max_size 之间；连接耗尽时按先来先得排队等待，超时抛出 PoolTimeout；
+    超过最长使用时间或空闲时间的连接被关闭重建，空闲较久的连接取出前先检测；
+    归还时回滚未结束的事务，回滚失败的连接直接丢弃
+    """
+
+    def __init__(self, db_type: str, connect: Optional[Callable[[], object]] = None,
+                 min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT, max_lifetime: float = DB_POOL_MAX_LIFETIME,
+                 idle_timeout: float = DB_POOL_IDLE_TIMEOUT, validate_after: float = DB_POOL_VALIDATE_AFTER):
+        """
+        参数:
+            db_type: 数据库类型
+            connect: 新建连接的函数，缺省按 get_db_config(db_type) 连接
+            min_size: 预热及保留的最少连接数
+            max_size: 最大连接数
+            acquire_timeout: 获取连接的默认等待时间（秒）
+            max_lifetime: 连接最长使用时间（秒），0表示不限
+            idle_timeout: 空闲连接关闭时间（秒），0表示不限
+            validate_after: 空闲超过该时间的连接取出前先检测（秒）
+        """
+        if db_type not in _CONNECTORS:
+            raise ValueError(f"Unsupported database type: {db_type}")
+        self.db_type = db_type
+        self._connect = connect or (lambda: _CONNECTORS[db_type](get_db_config(db_type)))
+        self.max_size = max(1, max_size)
+        self.min_size = max(0, min(min_size, self.max_size))
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.validate_after = validate_after
+        self._idle: Deque[_PooledConnection] = deque()
+        self._waiters: Deque[_Waiter] = deque()
+        self._checked_out: Dict[int, _PooledConnection] = {}
+        self._size = 0  # 已建立（含正在建立）的连接数
+        self._closed = False
+        self._lock = threading.Lock()
+        self.stats = {"acquisitions": 0, "waits": 0, "timeouts": 0, "wait_time_total": 0.0, "wait_time_max": 0.0,
+                      "created": 0, "closed": 0, "recycled": 0, "validation_failures": 0, "reset_failures": 0,
+                      "connect_failures": 0}
+
+    # ---- 内部方法 ----
+
+    def _is_expired(self, entry: _PooledConnection, now: float) -> bool:
+        if self.max_lifetime and now - entry.created_at > self.max_lifetime:
+            return True
+        return bool(self.idle_timeout) and now - entry.last_used > self.idle_timeout
+
+    def _close_raw(self, raw):
+        try:
+            raw.close()
+        except Exception as err:
+            logger.debug(f"关闭连接出错: {err}")
+        with self._lock:
+            self.stats["closed"] += 1
+
+    def _take_locked(self):
+        """在锁内尝试取得空闲连接或新建名额：(连接, 是否可新建)；有人排队时不插队"""
+        if self._waiters:
+            return None, False
+        if self._idle:
+            # 后进先出：常用连接保持活跃，多余的连接空闲超时后被回收
+            return self._idle.pop(), False
+        if self._size < self.max_size:
+            self._size += 1
+            return None, True
+        return None, False
+
+    def _release_slot(self):
+        """连接被关闭后归还名额，有人排队时直接交给队首新建连接"""
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.may_create = True
+                waiter.event.set()
+            else:
+                self._size -= 1
+
+    def _reap_idle(self):
+        """关闭空闲过久的连接（保留 min_size 个）"""
+        if not self.idle_timeout:
+            return
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            while (self._idle and self._size - len(expired) > self.min_size
+                   and now - self._idle[0].last_used > self.idle_timeout):
+                expired.append(self._idle.popleft())
+            self._size -= len(expired)
+        for entry in expired:
+            self._close_raw(entry.raw)
+            with self._lock:
+                self.stats["recycled"] += 1
+
+    def _new_entry(self) -> _PooledConnection:
+        try:
+            raw = self._connect()
+        except Exception:
+            with self._lock:
+                self.stats["connect_failures"] += 1
+            raise
+        with self._lock:
+            self.stats["created"] += 1
+        return _PooledConnection(raw, time.monotonic())
+
+    def _checkout(self, entry: Optional[_PooledConnection]) -> _PooledConnection:
+        """检查取得的连接，过期或检测失败时关闭并在同一名额上新建"""
+        if entry is not None:
+            now = time.monotonic()
+            if self._is_expired(entry, now):
+                self._close_raw(entry.raw)
+                with self._lock:
+                    self.stats["recycled"] += 1
+                entry = None
+            elif now - entry.last_used > self.validate_after and not _ping(self.db_type, entry.raw):
+                self._close_raw(entry.raw)
+                with self._lock:
+                    self.stats["validation_failures"] += 1
+                entry = None
+        if entry is None:
+            entry = self._new_entry()
+        return entry
+
+    # ---- 公共接口 ----
+
+    def acquire(self, timeout: Optional[float] = None):
+        """
+        获取连接，连接耗尽时排队等待
+
+        参数:
+            timeout: 最长等待时间（秒），缺省为 acquire_timeout
+
+        返回:
+            数据库驱动的原始连接，用完后必须调用 release
+
+        Raises:
+            PoolTimeout: 等待超时
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        start = time.monotonic()
+        self._reap_idle()
+        waiter = None
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.db_type}连接池已关闭")
+            entry, may_create = self._take_locked()
+            if entry is None and not may_create:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+                self.stats["waits"] += 1
+        if waiter is not None:
+            waiter.event.wait(timeout)
+            with self._lock:
+                # 交接在锁内完成，此处判断不会与归还连接竞争
+                if not waiter.event.is_set():
+                    self._waiters.remove(waiter)
+                    self.stats["timeouts"] += 1
+                    raise PoolTimeout(f"{timeout:.1f}秒内未获取到{self.db_type}连接（最大连接数 {self.max_size}）")
+            entry = waiter.entry
+        try:
+            entry = self._checkout(entry)
+        except Exception:
+            self._release_slot()
+            raise
+        waited = time.monotonic() - start
+        with self._lock:
+            self._checked_out[id(entry.raw)] = entry
+            self.stats["acquisitions"] += 1
+            self.stats["wait_time_total"] += waited
+            self.stats["wait_time_max"] = max(self.stats["wait_time_max"], waited)
+        return entry.raw
+
+    def release(self, raw, discard: bool = False):
+        """
+        归还连接：回滚未结束的事务后交给排队者或放回空闲队列
+
+        参数:
+            raw: acquire 返回的连接
+            discard: 为True时直接关闭（连接已不可用）
+        """
+        with self._lock:
+            entry = self._checked_out.pop(id(raw), None)
+        if entry is None:
+            logger.warning("归还的连接不属于该连接池，已直接关闭")
+            self._close_raw(raw)
+            return
+        if not discard:
+            try:
+                raw.rollback()
+            except Exception as err:
+                logger.info(f"连接重置失败，丢弃该连接: {err}")
+                with self._lock:
+                    self.stats["reset_failures"] += 1
+                discard = True
+        now = time.monotonic()
+        if discard or self._closed or (self.max_lifetime and now - entry.created_at > self.max_lifetime):
+            self._close_raw(raw)
+            self._release_slot()
+            return
+        entry.last_used = now
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.entry = entry
+                waiter.event.set()
+            else:
+                self._idle.append(entry)
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """
+        以上下文管理器使用连接，无论是否出错都会归还
+
+        用法:
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+        """
+        raw = self.acquire(timeout)
+        try:
+            yield raw
+        finally:
+            self.release(raw)
+
+    def warm_up(self) -> int:
+        """预先建立 min_size 个连接，返回新建的连接数"""
+        created = 0
+        while True:
+            with self._lock:
+                if self._closed or self._size >= self.min_size:
+                    return created
+                self._size += 1
+            try:
+                entry = self._new_entry()
+            except Exception as err:
+                logger.warning(f"{self.db_type}连接池预热失败: {err}")
+                self._release_slot()
+                return created
+            with self._lock:
+                self._idle.append(entry)
+            created += 1
+
+    def close(self):
+        """关闭空闲连接；使用中的连接在归还时关闭"""
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for entry in idle:
+            self._close_raw(entry.raw)
+
+    def get_stats(self) -> dict:
+        """连接池统计"""
+        with self._lock:
+            acquisitions = self.stats["acquisitions"]
+            return dict(self.stats, db_type=self.db_type, size=self._size, idle=len(self._idle),
+                        in_use=len(self._checked_out), waiters=len(self._waiters),
+                        min_size=self.min_size, max_size=self.max_size,
+                        wait_time_avg=self.stats["wait_time_total"] / acquisitions if acquisitions else 0.0)
+
+
+# 全局连接池
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(db_type: str = 'mysql', warm_up: bool = True) -> ConnectionPool:
+    """
+    获取（首次调用时创建并预热）指定数据库的连接池
+
+    参数:
+        db_type: 数据库类型
+        warm_up: 创建时是否预先建立 min_size 个连接
+
+    返回:
+        ConnectionPool
+    """
+    pool = _pools.get(db_type)
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(db_type)
+        if pool is None:
+            pool = ConnectionPool(db_type)
+            if warm_up:
+                created = pool.warm_up()
+                logger.info(f"{db_type}连接池初始化成功，预热连接 {created} 个")
+            _pools[db_type] = pool
+    return pool
+
+
+def get_pool_stats() -> Dict[str, dict]:
+    """所有已创建连接池的统计"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.db_type: pool.get_stats() for pool in pools}
+
+
+def close_connection_pools():
+    """关闭所有连接池（进程退出或切换配置时）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -1,6 +1,7 @@
 # data_processing.py
+import numpy as np
 import pandas as pd # type: ignore
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Sequence
 
 # 医疗指标翻译字典 - 集中定义
 MEDICAL_TRANSLATION: Dict[str, str] = {
@@ -119,6 +120,87 @@ def get_medical_unit(col_name: str) -> str:
             return unit
     return ""
 
+# 标识类列名单
+ID_COLS = ['patient_id', 'patient_name', 'id']
+
+def is_category_column(col_data: pd.Series) -> bool:
+    """是否按分类数据统计（分类、object、字符串及日期时间类型列）"""
+    dtype = col_data.dtype
+    # 按列读取的日期为datetime64，与逐行读取时的date对象一样按分类统计
+    return (isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_object_dtype(dtype)
+            or pd.api.types.is_string_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype))
+
+def non_null_unique(col_data: pd.Series):
+    """按首次出现顺序返回非空唯一值（不复制整列做dropna）"""
+    uniques = col_data.unique()
+    uniques = uniques[pd.notna(uniques)]
+    if pd.api.types.is_datetime64_any_dtype(col_data.dtype):
+        # 转回date/datetime对象，摘要中显示为 2024-01-01 而不是 Timestamp
+        stamps = pd.DatetimeIndex(uniques)
+        values = stamps.date if (stamps == stamps.normalize()).all() else stamps.to_pydatetime()
+        uniques = np.empty(len(values), dtype=object)
+        uniques[:] = list(values)
+    return uniques
+
+def summary_kind(columns) -> str:
+    """按结果列判断摘要类型：metrics（指标记录）、gender（性别计数）或 generic"""
+    if {'metric_name', 'metric_value', 'checkup_date'}.issubset(columns):
+        return 'metrics'
+    if set(columns) == {'gender', 'count'}:
+        return 'gender'
+    return 'generic'
+
+def summarize_numeric_column(col: str, mean_value, min_value, max_value) -> str:
+    """数值列的摘要行"""
+    # 获取单位信息
+    unit = get_medical_unit(col)
+    return (
+        f"- {translate_column(col)}: "
+        f"平均{mean_value:.1f}{unit} "
+        f"(范围: {min_value:.1f}-{max_value:.1f}{unit})"
+    )
+
+def summarize_category_column(col: str, distinct: int, unique_vals: Sequence, samples: Sequence = ()) -> List[str]:
+    """分类列的摘要行
+
+    Args:
+        col: 列名
+        distinct: 非空唯一值个数
+        unique_vals: 按首次出现顺序的唯一值（唯一值较多时只需要个数，可不完整）
+        samples: doctor_advice 列的前20条非空记录
+
+    Returns:
+        摘要行列表
+    """
+    if distinct == 0:
+        return []
+    # 特殊处理姓名类字段
+    if col == 'patient_name':
+        if distinct <= 10:
+            return [f"- 涉及患者: {', '.join(map(str, unique_vals))}"]
+        return [f"- 涉及患者: {distinct}人"]
+    if distinct <= 5:
+        return [f"- {translate_column(col)}: {', '.join(map(str, unique_vals))}"]
+    # 对于医生建议等长文本
+    if col == 'doctor_advice':
+        lines = []
+        if samples:
+            lines.append(f"- {translate_column(col)}示例:")
+            for i, advice in enumerate(samples, 1):
+                lines.append(f"  {i}. {advice[:30]}{'...' if len(advice) > 30 else ''}")
+        return lines
+    return [f"- {translate_column(col)}: {distinct}种分类"]
+
+def compose_generic_summary(row_count: int, num_summary: List[str], cat_summary: List[str]) -> str:
+    """拼接通用结果的摘要文本"""
+    summary = "\n核心分析结果\n"
+    summary += f"- 涉及记录数: {row_count} 条\n"
+    if num_summary:
+        summary += "\n数值指标分析:\n" + "\n".join(num_summary)
+    if cat_summary:
+        summary += "\n\n分类数据统计:\n" + "\n".join(cat_summary)
+    return summary
+
 def generate_textual_summary(df: Optional[pd.DataFrame]) -> str:
     """生成精简医疗数据摘要
     
@@ -133,115 +215,98 @@ def generate_textual_summary(df: Optional[pd.DataFrame]) -> str:
         return "\n核心分析结果\n- 无有效数据"
     
     try:
-        if {'metric_name', 'metric_value', 'checkup_date'}.issubset(df.columns):
+        kind = summary_kind(df.columns)
+        if kind == 'metrics':
             return _generate_metrics_summary(df)
-        if set(df.columns) == {'gender', 'count'}:
+        if kind == 'gender':
             total = df['count'].sum()
+            percentages = (df['count'] / total) * 100
             summary = "\n核心分析结果\n"
-            for _, row in df.iterrows():
-                percentage = (row['count'] / total) * 100
+            for gender, count, percentage in zip(df['gender'].tolist(), df['count'].tolist(), percentages.tolist()):
                 summary += (
-                    f"- {translate_column(row['gender'])}: "
-                    f"{row['count']}人 ({percentage:.1f}%)\n"
+                    f"- {translate_column(gender)}: "
+                    f"{count}人 ({percentage:.1f}%)\n"
                 )
             return summary
-        # 标识类列名单
-        ID_COLS = ['patient_id', 'patient_name', 'id']
-        
-        summary = "\n核心分析结果\n"
-        summary += f"- 涉及记录数: {len(df)} 条\n"
         
-        # 数值型指标分析
+        # 数值型指标分析（逐列一次聚合，跳过空值而不复制数据）
         num_summary = []
         for col in df.columns:
-            if pd.api.types.is_numeric_dtype(df[col]) and col not in ID_COLS:
-                # 计算关键指标（处理可能的空值）
-                col_data = df[col].dropna()
-                if len(col_data) == 0:
+            col_data = df[col]
+            if pd.api.types.is_numeric_dtype(col_data) and col not in ID_COLS:
+                if col_data.count() == 0:
                     continue
-                    
-                mean_value = col_data.mean()
-                min_value = col_data.min()
-                max_value = col_data.max()
-                
-                # 获取单位信息
-                unit = get_medical_unit(col)
-                
-                num_summary.append(
-                    f"- {translate_column(col)}: "
-                    f"平均{mean_value:.1f}{unit} "
-                    f"(范围: {min_value:.1f}-{max_value:.1f}{unit})"
-                )
-        
-        if num_summary:
-            summary += "\n数值指标分析:\n" + "\n".join(num_summary)
+                num_summary.append(summarize_numeric_column(col, col_data.mean(), col_data.min(), col_data.max()))
         
         # 分类数据统计（排除标识列）
         cat_summary = []
         for col in df.columns:
-            if col in ID_COLS: 
-                # 特殊处理姓名类字段
-                if col == 'patient_name':
-                    names = df[col].dropna().unique()
-                    if len(names) == 0:
-                        continue
-                    if len(names) <= 10:
-                        cat_summary.append(f"- 涉及患者: {', '.join(map(str, names))}")
-                    else:
-                        cat_summary.append(f"- 涉及患者: {len(names)}人")
+            if col in ID_COLS and col != 'patient_name':
                 continue
-                
-            if pd.api.types.is_categorical_dtype(df[col]) or pd.api.types.is_object_dtype(df[col]):
-                unique_vals = df[col].dropna().unique()
-                if len(unique_vals) == 0:
-                    continue
-                    
-                if len(unique_vals) <= 5:
-                    cat_summary.append(f"- {translate_column(col)}: {', '.join(map(str, unique_vals))}")
-                else:
-                    # 对于医生建议等长文本
-                    if col == 'doctor_advice':
-                        samples = df[col].dropna().head(20).tolist()
-                        if samples:
-                            cat_summary.append(f"- {translate_column(col)}示例:")
-                            for i, advice in enumerate(samples, 1):
-                                cat_summary.append(f"  {i}. {advice[:30]}{'...' if len(advice) > 30 else ''}")
-                    else:
-                        cat_summary.append(f"- {translate_column(col)}: {len(unique_vals)}种分类")
-        
-        if cat_summary:
-            summary += "\n\n分类数据统计:\n" + "\n".join(cat_summary)
+            if col == 'patient_name' or is_category_column(df[col]):
+                unique_vals = non_null_unique(df[col])
+                samples = df[col].dropna().head(20).tolist() if col == 'doctor_advice' else ()
+                cat_summary.extend(summarize_category_column(col, len(unique_vals), unique_vals, samples))
         
-        return summary
+        return compose_generic_summary(len(df), num_summary, cat_summary)
     
     except Exception as e:
         error_msg = f"生成摘要时出错: {str(e)}"
         print(error_msg)
         return f"## 核心分析结果\n\n- {error_msg}"
 
-def _generate_metrics_summary(df: pd.DataFrame) -> str:
-    """处理指标记录表的专用摘要"""
+def _latest_positions(codes: np.ndarray, dates: pd.Series) -> np.ndarray:
+    """每个分组中检查日期最新的行位置
+
+    日期相同时取靠后的行；分组中有空日期时与按日期排序（空值在最后）一致，取最后一个空日期行
+    """
+    positions = np.arange(len(codes))
+    is_null = dates.isna().to_numpy()
+    group_max = dates.groupby(codes).transform('max').to_numpy()
+    is_latest = ~is_null & (dates.to_numpy() == group_max)
+    latest = pd.Series(np.where(is_latest, positions, -1)).groupby(codes).max().to_numpy()
+    latest_null = pd.Series(np.where(is_null, positions, -1)).groupby(codes).max().to_numpy()
+    return np.where(latest_null >= 0, latest_null, latest)
+
+def _generate_metrics_summary(df: pd.DataFrame, max_metrics: int = 100) -> str:
+    """处理指标记录表的专用摘要
+
+    按指标一次分组聚合（计数/均值/最小/最大值及最新记录），
+    不再为每个指标单独过滤和排序，耗时随行数线性增长
+    """
     summary = "## 核心分析结果\n\n"
-    metrics = df['metric_name'].unique()
-    
-    for metric in metrics[:100]:  # 限制最多显示100个指标
-        metric_df = df[df['metric_name'] == metric]
-        latest = metric_df.sort_values('checkup_date').iloc[-1]
-        unit = latest['unit'] if 'unit' in df.columns else get_medical_unit(metric)
-        
-        # 添加统计信息
-        values = pd.to_numeric(metric_df['metric_value'], errors='coerce').dropna()
-        if len(values) > 1:
-            stats = (
-                f"最新值: {latest['metric_value']}{unit} "
-                f"(平均: {values.mean():.1f}{unit}, 范围: {values.min():.1f}-{values.max():.1f}{unit})"
+    # 按首次出现顺序编号，空指标名为-1
+    codes, metrics = pd.factorize(df['metric_name'])
+    keep = (codes >= 0) & (codes < max_metrics)  # 限制最多显示100个指标
+    frame = df if keep.all() else df[keep]
+    codes = codes[keep]
+    metrics = metrics[:max_metrics]
+    if len(metrics) == 0:
+        return summary
+
+    latest = _latest_positions(codes, frame['checkup_date'].reset_index(drop=True))
+    latest_values = frame['metric_value'].to_numpy()[latest]
+    latest_units = frame['unit'].to_numpy()[latest] if 'unit' in frame.columns else None
+
+    # 添加统计信息
+    values = pd.Series(pd.to_numeric(frame['metric_value'], errors='coerce').to_numpy())
+    stats = values.groupby(codes).agg(['count', 'mean', 'min', 'max'])
+
+    for code, metric in enumerate(metrics):
+        unit = latest_units[code] if latest_units is not None else get_medical_unit(metric)
+        count, mean_value, min_value, max_value = stats.iloc[code]
+        if count > 1:
+            stats_text = (
+                f"最新值: {latest_values[code]}{unit} "
+                f"(平均: {mean_value:.1f}{unit}, 范围: {min_value:.1f}-{max_value:.1f}{unit})"
             )
         else:
-            stats = f"最新值: {latest['metric_value']}{unit}"
+            stats_text = f"最新值: {latest_values[code]}{unit}"
             
-        summary += f"- {translate_column(metric)}: {stats}\n"
+        summary += f"- {translate_column(metric)}: {stats_text}\n"
     
     return summary
+
 def safe_translate_dataframe_columns(df: pd.DataFrame) -> pd.DataFrame:
     """安全地翻译DataFrame的列名
     
@@ -1,184 +1,241 @@
-import sqlite3
-import pyodbc
-import psycopg2
-import psycopg2.pool
+import os
 import pandas as pd
-from mysql.connector import pooling
-from mysql.connector import Error as MySQLError
-from .config import get_db_config
+import sqlparse # type: ignore
+from ..basic_function.config import get_db_config, QUERY_MAX_ROWS, QUERY_MAX_BYTES, QUERY_FETCH_BATCH
+from .connection_pool import get_connection_pool, get_pool_stats as get_connection_pool_stats
+from .sqlite_engine import get_sqlite_engine, get_sqlite_stats, sqlite_file_version
+from .result_cache import get_result_cache, DATABASE_FINGERPRINT
+from .columnar_fetch import ColumnarBuffer, column_kinds
+from .query_guard import get_query_guard, query_deadline, is_deadline_error
 import logging
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 全局连接池字典
-_connection_pools = {
-    'mysql': None,
-    'postgresql': None,
-    'sqlite': None,  # SQLite不直接使用连接池
-    'sqlserver': None
-}
-
 def init_connection_pool(db_type='mysql'):
-    """初始化数据库连接池"""
-    global _connection_pools
-    
-    # 如果已经初始化，直接返回
-    if _connection_pools.get(db_type) is not None:
-        return _connection_pools[db_type]
-    
-    # 获取数据库配置
+    """
+    获取数据库连接池（首次调用时创建并预热）
+    SQLite使用只读连接池 SQLiteEngine，接口相同
+
+    用法:
+        with init_connection_pool('mysql').connection() as connection:
+            cursor = connection.cursor()
+    """
+    if db_type == 'sqlite':
+        return get_sqlite_engine()
+    return get_connection_pool(db_type)
+
+def get_pool_stats() -> dict:
+    """各数据库连接池（含SQLite引擎）的统计"""
+    stats = get_connection_pool_stats()
+    sqlite_stats = get_sqlite_stats()
+    if sqlite_stats is not None:
+        stats['sqlite'] = sqlite_stats
+    return stats
+
+def get_db_identity(db_type: str = 'mysql') -> str:
+    """数据库标识（类型+地址+库名），用于区分不同数据库的缓存结果"""
     config = get_db_config(db_type)
-    
-    if db_type == 'mysql':
-        # 初始化MySQL连接池
-        try:
-            pool = pooling.MySQLConnectionPool(
-                pool_name="mysql_pool",
-                pool_size=5,
-                **{k: v for k, v in config.items() if k != 'use_pure'}
-            )
-            logger.info("MySQL连接池初始化成功")
-            _connection_pools[db_type] = pool
-            return pool
-        except MySQLError as e:
-            logger.error(f"MySQL连接池初始化失败: {e}")
-            raise
-    
-    elif db_type == 'postgresql':
-        # 初始化PostgreSQL连接池
-        try:
-            pool = psycopg2.pool.ThreadedConnectionPool(
-                minconn=1,
-                maxconn=5,
-                host=config['host'],
-                user=config['user'],
-                password=config['password'],
-                dbname=config['database'],
-                port=config.get('port', 5432)
-            )
-            logger.info("PostgreSQL连接池初始化成功")
-            _connection_pools[db_type] = pool
-            return pool
-        except psycopg2.Error as e:
-            logger.error(f"PostgreSQL连接池初始化失败: {e}")
-            raise
-    
-    elif db_type == 'sqlserver':
-        # 初始化SQL Server连接池
-        try:
-            # SQL Server连接字符串
-            conn_str = (
-                f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-                f"SERVER={config['host']};"
-                f"DATABASE={config['database']};"
-                f"UID={config['user']};"
-                f"PWD={config['password']};"
-                f"Encrypt=no;"
-            )
-            
-            # SQL Server连接池类
-            class SQLServerPool:
-                def __init__(self):
-                    self.connections = []
-                
-                def get_connection(self):
-                    """从连接池获取连接"""
-                    if self.connections:
-                        return self.connections.pop()
-                    else:
-                        return pyodbc.connect(conn_str)
-                
-                def release(self, conn):
-                    """释放连接回连接池"""
-                    self.connections.append(conn)
-            
-            pool = SQLServerPool()
-            logger.info("SQL Server连接池初始化成功")
-            _connection_pools[db_type] = pool
-            return pool
-        
-        except pyodbc.Error as e:
-            logger.error(f"SQL Server连接池初始化失败: {e}")
-            raise
-    
-    elif db_type == 'sqlite':
-        # SQLite不维护连接池，直接连接到数据库文件
-        _connection_pools[db_type] = True  # 标记为已初始化
-        logger.info("SQLite连接初始化成功")
-        return True
-    
-    else:
-        logger.error(f"不支持的数据库类型: {db_type}")
-        raise ValueError(f"Unsupported database type: {db_type}")
-
-def execute_query(query: str, db_type: str = 'mysql') -> pd.DataFrame:
-    """执行SQL查询并返回DataFrame结果"""
+    if db_type == 'sqlite':
+        return f"sqlite:///{os.path.abspath(config['database'])}"
+    return f"{db_type}://{config.get('host')}:{config.get('port', '')}/{config['database']}"
+
+def invalidate_result_cache(db_type: str = 'mysql', tables=None):
+    """数据导入等写操作后调用，使相关表（缺省为整个数据库）的缓存结果失效"""
+    cache = get_result_cache()
+    if cache is not None:
+        cache.invalidate(get_db_identity(db_type), frozenset(t.lower() for t in tables) if tables else None)
+
+def _probe_table_state(db_type: str, db_identity: str):
+    """
+    低开销地探测各表的最近修改状态（表名 -> 更新时间/修改计数）
+
+    返回:
+        dict，无法探测时返回None
+    """
+    if db_type == 'sqlite':
+        # SQLite只能按文件（含WAL文件）的变化整体判断
+        version = sqlite_file_version(db_identity[len('sqlite:///'):])
+        return {DATABASE_FINGERPRINT: str(version)} if version is not None else None
+
+    probes = {
+        'mysql': ("SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s",
+                  (get_db_config('mysql')['database'],)),
+        'postgresql': ("SELECT relname, n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables", None),
+        'sqlserver': ("SELECT OBJECT_NAME(object_id), MAX(last_user_update) FROM sys.dm_db_index_usage_stats "
+                      "WHERE database_id = DB_ID() GROUP BY object_id", None)
+    }
+    if db_type not in probes:
+        return None
+    sql, params = probes[db_type]
     try:
-        # 获取连接池
-        pool = init_connection_pool(db_type)
-        connection = None
-        
-        if db_type == 'mysql':
-            # MySQL查询执行
-            connection = pool.get_connection()
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(query)
-            result = cursor.fetchall()
-        
-        elif db_type == 'postgresql':
-            # PostgreSQL查询执行
-            connection = pool.getconn()
-            cursor = connection.cursor()
-            cursor.execute(query)
-            columns = [desc[0] for desc in cursor.description]
-            result = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        elif db_type == 'sqlserver':
-            # SQL Server查询执行
-            connection = pool.get_connection()
+        with init_connection_pool(db_type).connection() as connection:
             cursor = connection.cursor()
-            cursor.execute(query)
-            columns = [column[0] for column in cursor.description]
-            result = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        elif db_type == 'sqlite':
-            # SQLite查询执行
-            config = get_db_config(db_type)
-            connection = sqlite3.connect(config['database'])
-            connection.row_factory = sqlite3.Row  # 使查询结果可转为字典
-            cursor = connection.cursor()
-            cursor.execute(query)
-            result = [dict(row) for row in cursor.fetchall()]
-        
-        else:
-            logger.error(f"不支持的数据库类型: {db_type}")
-            return pd.DataFrame()
-        
-        return pd.DataFrame(result)
-    
+            try:
+                cursor.execute(sql, params) if params else cursor.execute(sql)
+                return {str(row[0]): str(row[1]) for row in cursor.fetchall() if row[0]}
+            finally:
+                cursor.close()
     except Exception as err:
-        logger.error(f"执行查询时出错: {err}")
-        return pd.DataFrame()
-    
-    finally:
-        # 释放数据库连接
+        logger.debug(f"表变化探测失败: {err}")
+        return None
+
+def execute_query(query: str, db_type: str = 'mysql', use_cache: bool = True,
+                  max_rows: int = QUERY_MAX_ROWS, max_bytes: int = QUERY_MAX_BYTES) -> pd.DataFrame:
+    """
+    执行SQL查询并返回DataFrame结果
+    相同SQL（规范化后）在所读表未变化时直接返回缓存结果
+
+    参数:
+        query: SQL语句
+        db_type: 数据库类型
+        use_cache: 是否使用结果缓存
+        max_rows: 最多读取的行数（LIMIT下推 + fetchmany）
+        max_bytes: 读取数据的大致字节上限
+
+    返回:
+        DataFrame，被截断时 df.attrs['truncated'] 为True
+    """
+    cache = get_result_cache() if use_cache else None
+    if cache is None:
+        df, _, truncated = _execute_query(query, db_type, max_rows, max_bytes)
+        df.attrs['truncated'] = truncated
+        return df
+
+    db_identity = get_db_identity(db_type)
+    if cache.should_probe(db_identity):
+        fingerprints = _probe_table_state(db_type, db_identity)
+        if fingerprints is not None:
+            cache.refresh_fingerprints(db_identity, fingerprints)
+
+    cached = cache.get(query, db_identity)
+    if cached is not None and len(cached) <= max_rows:
+        logger.info("SQL结果缓存命中")
+        cached.attrs['truncated'] = False
+        cached.attrs['guard'] = {"action": "cached"}
+        return cached
+
+    versions = cache.snapshot_versions(query, db_identity)
+    df, ok, truncated = _execute_query(query, db_type, max_rows, max_bytes)
+    # 截断的结果不完整，不写入缓存
+    if ok and not truncated:
+        cache.put(query, db_identity, df, versions)
+    df.attrs['truncated'] = truncated
+    return df
+
+def apply_row_limit(query: str, limit: int, db_type: str = 'mysql') -> str:
+    """
+    将行数限制下推到SQL中，使数据库只返回需要的行
+
+    参数:
+        query: 原始SQL
+        limit: 最多返回的行数
+        db_type: 数据库类型
+
+    返回:
+        带LIMIT的SQL；非SELECT语句或不支持的方言原样返回（由fetchmany限制）
+    """
+    statements = [st for st in sqlparse.parse(query or '') if st.token_first(skip_cm=True) is not None]
+    if len(statements) != 1 or statements[0].get_type() != 'SELECT' or db_type == 'sqlserver':
+        return query
+    # 去掉注释：LLM生成的SQL末尾常带 "-- 说明"，会把追加在同一行的 ) 或 LIMIT 注释掉
+    body = sqlparse.format(str(statements[0]), strip_comments=True).strip().rstrip(';').strip()
+    has_limit = any(t.is_keyword and t.normalized in ('LIMIT', 'FETCH', 'FOR UPDATE')
+                    for t in statements[0].tokens)
+    if has_limit:
+        # 原SQL已有LIMIT，包一层派生表取更小的限制
+        return f"SELECT * FROM (\n{body}\n) AS _limited LIMIT {int(limit)}"
+    return f"{body}\nLIMIT {int(limit)}"
+
+def _estimate_rows_bytes(rows) -> int:
+    """粗略估计一批行的内存占用"""
+    total = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray)):
+                total += len(value) + 49
+            else:
+                total += 32
+    return total
+
+def _fetch_bounded(cursor, max_rows: int, max_bytes: int, batch_size: int = QUERY_FETCH_BATCH,
+                   db_type: str = 'mysql'):
+    """
+    分批 fetchmany，每批直接写入按列的类型化缓冲区，超过行数或字节上限时停止
+
+    返回:
+        (ColumnarBuffer, 是否被截断)
+    """
+    columns = [desc[0] for desc in cursor.description]
+    buffer = ColumnarBuffer(columns, column_kinds(cursor.description, db_type))
+    size = 0
+    while True:
+        batch = cursor.fetchmany(min(batch_size, max_rows + 1 - buffer.rows))
+        if not batch:
+            return buffer, False
+        if buffer.rows + len(batch) > max_rows:
+            buffer.append(batch[:max_rows - buffer.rows])
+            return buffer, True
+        buffer.append(batch)
+        size += _estimate_rows_bytes(batch)
+        if size > max_bytes:
+            return buffer, True
+
+def _run_bounded(cursor, query: str, max_rows: int, max_bytes: int, db_type: str):
+    """执行查询并分批读取，返回 (DataFrame, 是否被截断)"""
+    cursor.execute(query)
+    if cursor.description is None:
+        return pd.DataFrame(), False
+    buffer, truncated = _fetch_bounded(cursor, max_rows, max_bytes, db_type=db_type)
+    if truncated:
+        logger.warning(f"查询结果超过上限，已截断为 {buffer.rows} 行")
         if db_type == 'mysql':
-            if connection and connection.is_connected():
+            # 未读完的结果需要读完后连接才能归还连接池：分批读取并丢弃，
+            # 不用 fetchall 一次取出剩余的行（字节上限截断时可能还剩接近 max_rows 行）
+            while cursor.fetchmany(QUERY_FETCH_BATCH):
+                pass
+    return buffer.to_dataframe(), truncated
+
+def _execute_query(query: str, db_type: str = 'mysql', max_rows: int = QUERY_MAX_ROWS,
+                   max_bytes: int = QUERY_MAX_BYTES):
+    """
+    执行SQL查询，最多读取 max_rows 行 / 约 max_bytes 字节
+    执行前由代价守卫检查，决定记录在 df.attrs['guard']
+
+    返回:
+        (DataFrame, 是否执行成功, 是否被截断)，失败或被拒绝时为空DataFrame
+    """
+    guard = get_query_guard()
+    decision = None
+    try:
+        # 连接在with结束时归还连接池（出错时同样归还）
+        with init_connection_pool(db_type).connection() as connection:
+            decision = guard.check(connection, query, db_type)
+            if decision.action == 'reject':
+                logger.warning(f"查询被代价守卫拒绝: {decision.reason}")
+                df = pd.DataFrame()
+                df.attrs['guard'] = decision.to_dict()
+                return df, False, False
+            if decision.limit is not None:
+                max_rows = min(max_rows, decision.limit)
+            # 多取一行用于判断是否还有更多数据
+            limited = apply_row_limit(query, max_rows + 1, db_type)
+            cursor = connection.cursor()
+            try:
+                with query_deadline(connection, db_type, decision.deadline_ms):
+                    df, truncated = _run_bounded(cursor, limited, max_rows, max_bytes, db_type)
+            finally:
                 cursor.close()
-                connection.close()
-        
-        elif db_type == 'postgresql':
-            if connection:
-                connection.commit()
-                pool.putconn(connection)
-        
-        elif db_type == 'sqlserver':
-            if connection:
-                # 释放回连接池，不实际关闭连接
-                pool.release(connection)
-        
-        elif db_type == 'sqlite':
-            if connection:
-                connection.close()
+            df.attrs['guard'] = decision.to_dict()
+            return df, True, truncated
+
+    except Exception as err:
+        df = pd.DataFrame()
+        if decision is not None and is_deadline_error(err):
+            guard.record_timeout()
+            logger.error(f"查询超过执行时限 {decision.deadline_ms} 毫秒: {err}")
+            df.attrs['guard'] = dict(decision.to_dict(), timed_out=True)
+        else:
+            logger.error(f"执行查询时出错: {err}")
+        return df, False, False
@@ -0,0 +1,505 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlparse import tokens as T
+from sqlparse.lexer import Lexer
+from ..basic_function.config import (
+    INDEX_ADVISOR_ENABLED, INDEX_ADVISOR_MAX_QUERIES, INDEX_ADVISOR_WORKLOAD_PATH, INDEX_ADVISOR_MAX_COLUMNS
+)
+from ..nlp_to_sql.json_handler import append_json_line, read_json_lines
+from .sql_validator import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+# 不适合建普通索引的列类型（MySQL 需要前缀长度）
+_UNINDEXABLE_TYPES = {'TEXT', 'TINYTEXT', 'MEDIUMTEXT', 'LONGTEXT', 'BLOB', 'MEDIUMBLOB', 'LONGBLOB', 'JSON'}
+_EQ_OPERATORS = {'=', '<=>'}
+_RANGE_OPERATORS = {'<', '>', '<=', '>='}
+_CLAUSES = {'SELECT', 'FROM', 'WHERE', 'ON', 'GROUP BY', 'ORDER BY', 'HAVING', 'LIMIT', 'USING'}
+# 没有统计信息时的条件选择率（等值条件对枚举列取 1/取值个数）
+_EQ_SELECTIVITY = 0.05
+_RANGE_SELECTIVITY = 0.25
+_BETWEEN_SELECTIVITY = 0.1
+_LIKE_PREFIX_SELECTIVITY = 0.1
+# 通过索引回表读取一行的代价约为顺序扫描一行的倍数：选择率高于其倒数时索引不如全表扫描
+_LOOKUP_COST = 3.0
+# 索引只用于避免排序/分组时节省的比例
+_ORDERING_GAIN = 0.2
+_PREDICATE_KEYWORDS = {'IN', 'IS', 'BETWEEN', 'LIKE'}
+# 其后的括号是分组或子查询而不是函数调用
+_LOGICAL_KEYWORDS = {'WHERE', 'ON', 'AND', 'OR', 'NOT', 'IN', 'EXISTS', 'HAVING', 'WHEN', 'THEN', 'ELSE', 'ANY', 'ALL'}
+
+
+def _significant_tokens(sql: str):
+    return [(ttype, value) for ttype, value in Lexer.get_default_instance().get_tokens(sql or '')
+            if not value.isspace() and ttype not in T.Comment]
+
+
+def fingerprint(sql: str) -> str:
+    """查询指纹：常量替换为?、关键字大写、空白归一，同一模板的查询合并统计"""
+    parts = []
+    for ttype, value in _significant_tokens(sql):
+        if ttype in T.Literal:
+            parts.append('?')
+        elif ttype in T.Keyword:
+            parts.append(' '.join(value.upper().split()))
+        elif value != ';':
+            parts.append(value)
+    return ' '.join(parts)
+
+
+@dataclass
+class WorkloadEntry:
+    """同一指纹查询的累计执行情况"""
+    sql: str  # 最近一次执行的SQL
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    @property
+    def avg_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+class QueryWorkload:
+    """
+    已执行查询的负载记录（按指纹合并，LRU淘汰）
+    配置了文件路径时同时追加写入 JSON Lines，供命令行工具离线分析
+    """
+
+    def __init__(self, max_queries: int = INDEX_ADVISOR_MAX_QUERIES, path: str = INDEX_ADVISOR_WORKLOAD_PATH):
+        self.max_queries = max_queries
+        self.path = path
+        self._entries: "OrderedDict[str, WorkloadEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, seconds: float, persist: bool = True):
+        """记录一次执行"""
+        if not sql:
+            return
+        key = fingerprint(sql)
+        ms = seconds * 1000
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = WorkloadEntry(sql)
+                if len(self._entries) > self.max_queries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+                entry.sql = sql
+            entry.count += 1
+            entry.total_ms += ms
+            entry.max_ms = max(entry.max_ms, ms)
+        if persist and self.path:
+            append_json_line({"sql": sql, "ms": round(ms, 3), "ts": time.time()}, self.path)
+
+    def entries(self) -> List[WorkloadEntry]:
+        with self._lock:
+            return [WorkloadEntry(e.sql, e.count, e.total_ms, e.max_ms) for e in self._entries.values()]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"queries": len(self._entries), "executions": sum(e.count for e in self._entries.values()),
+                    "total_ms": round(sum(e.total_ms for e in self._entries.values()), 3)}
+
+
+def load_workload_file(path: str) -> List[WorkloadEntry]:
+    """读取 QueryWorkload 写出的 JSON Lines 负载文件"""
+    workload = QueryWorkload(max_queries=1 << 30, path="")
+    for record in read_json_lines(path):
+        if record.get("sql"):
+            workload.record(record["sql"], float(record.get("ms", 0)) / 1000, persist=False)
+    return workload.entries()
+
+
+@dataclass
+class TableAccess:
+    """一条查询对某张表的访问方式（列按出现顺序）"""
+    eq: List[str] = field(default_factory=list)  # 等值条件（含连接列、IN、IS NULL）
+    range: List[str] = field(default_factory=list)  # 范围条件（含前缀LIKE）
+    group: List[str] = field(default_factory=list)
+    order: List[str] = field(default_factory=list)
+    selectivity: Dict[str, float] = field(default_factory=dict)  # 过滤列 -> 估计选择率
+
+
+def _filter(entry: TableAccess, target: List[str], col: str, selectivity: float):
+    _add(target, col)
+    entry.selectivity[col] = min(entry.selectivity.get(col, 1.0), selectivity)
+
+
+def _add(target: List[str], col: str):
+    if col not in target:
+        target.append(col)
+
+
+def extract_access(sql: str, schema) -> Dict[str, TableAccess]:
+    """
+    解析查询中可由索引加速的列：WHERE/ON 中可下推的比较条件、GROUP BY 和 ORDER BY 列
+    被函数包裹的列、不等条件和以通配符开头的 LIKE 无法使用索引，不计入
+
+    返回:
+        表名 -> TableAccess
+    """
+    aliases = {}
+    for name, table in referenced_tables(sql).items():
+        info = schema.table(table) or next((t for t in schema.tables if t.name.lower() == table.lower()), None)
+        if info is not None:
+            aliases[name] = info
+    tables = {t.name: t for t in aliases.values()}
+    if not tables:
+        return {}
+
+    def resolve(qualifier: Optional[str], column: str):
+        column = column.strip('`"')
+        if qualifier is not None:
+            info = aliases.get(qualifier.strip('`"').lower())
+            candidates = [info] if info is not None else []
+        else:
+            candidates = list(tables.values())
+        matches = [t for t in candidates if t.column(column) is not None]
+        if len(matches) != 1:
+            return None
+        col = matches[0].column(column)
+        if col.base_type in _UNINDEXABLE_TYPES:
+            return None
+        return matches[0].name, col.name
+
+    tokens = _significant_tokens(sql)
+    n = len(tokens)
+    access: Dict[str, TableAccess] = {}
+    clauses = ['SELECT']
+    i = 0
+    while i < n:
+        ttype, value = tokens[i]
+        if value == '(':
+            clauses.append(clauses[-1])
+            i += 1
+            continue
+        if value == ')':
+            if len(clauses) > 1:
+                clauses.pop()
+            i += 1
+            continue
+        if ttype in T.Keyword:
+            word = ' '.join(value.upper().split())
+            if word in _CLAUSES:
+                clauses[-1] = word
+            elif word.endswith('JOIN'):
+                clauses[-1] = 'FROM'
+            elif ttype is T.Keyword.DML:
+                clauses[-1] = 'SELECT'
+            i += 1
+            continue
+        if ttype is not T.Name or (i + 1 < n and tokens[i + 1][1] == '('):
+            i += 1
+            continue
+
+        # 列引用：col / alias.col / db.table.col
+        start = i
+        parts = [value]
+        while i + 2 < n and tokens[i + 1][1] == '.' and tokens[i + 2][0] is T.Name:
+            parts.append(tokens[i + 2][1])
+            i += 2
+        end = i
+        i += 1
+        clause = clauses[-1]
+        if clause not in ('WHERE', 'ON', 'GROUP BY', 'ORDER BY'):
+            continue
+        # 作为函数参数时无法使用索引（YEAR等函数名被识别为关键字）
+        if start >= 2 and tokens[start - 1][1] == '(' and (
+                tokens[start - 2][0] is T.Name
+                or (tokens[start - 2][0] in T.Keyword and tokens[start - 2][1].upper() not in _LOGICAL_KEYWORDS)):
+            continue
+        resolved = resolve(parts[-2] if len(parts) >= 2 else None, parts[-1])
+        if resolved is None:
+            continue
+        table, col = resolved
+        entry = access.setdefault(table, TableAccess())
+        if clause == 'GROUP BY':
+            _add(entry.group, col)
+            continue
+        if clause == 'ORDER BY':
+            _add(entry.order, col)
+            continue
+
+        nxt = tokens[end + 1] if end + 1 < n else (None, '')
+        prv = tokens[start - 1] if start >= 1 else (None, '')
+        if nxt[0] in T.Operator.Comparison or (nxt[0] in T.Keyword and nxt[1].upper() in _PREDICATE_KEYWORDS):
+            op = nxt[1].upper()
+        elif prv[0] in T.Operator.Comparison:
+            op = prv[1]  # 列在比较的右侧：5 < age、a.id = b.id
+        else:
+            continue
+        if op in _EQ_OPERATORS or op in ('IN', 'IS'):
+            enum_values = schema.table(table).column(col).enum_values
+            _filter(entry, entry.eq, col, 1 / len(enum_values) if enum_values else _EQ_SELECTIVITY)
+        elif op in _RANGE_OPERATORS:
+            _filter(entry, entry.range, col, _RANGE_SELECTIVITY)
+        elif op == 'BETWEEN':
+            _filter(entry, entry.range, col, _BETWEEN_SELECTIVITY)
+        elif op == 'LIKE' and end + 2 < n and tokens[end + 2][0] in T.Literal.String:
+            pattern = tokens[end + 2][1].strip('\'"')
+            if pattern and pattern[0] not in '%_':
+                _filter(entry, entry.range, col, _LIKE_PREFIX_SELECTIVITY)
+    return access
+
+
+@dataclass
+class IndexRecommendation:
+    """推荐的复合索引"""
+    table: str
+    columns: Tuple[str, ...]
+    benefit_ms: float  # 估计可减少的负载耗时（毫秒，启发式）
+    queries: int  # 受益的查询模板数
+    executions: int  # 受益的执行次数
+
+    @property
+    def name(self) -> str:
+        name = f"idx_adv_{self.table}_{'_'.join(self.columns)}"
+        if len(name) > 64:
+            digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+            name = f"{name[:55]}_{digest}"
+        return name
+
+    def ddl(self, db_type: str = 'mysql', database: Optional[str] = None) -> str:
+        """建索引语句（SQLite 使用 IF NOT EXISTS，database 为 SQLite 附加库名时写在索引名前）"""
+        columns = ', '.join(self.columns)
+        if db_type == 'sqlite':
+            prefix = f"{database}." if database else ""
+            return f"CREATE INDEX IF NOT EXISTS {prefix}{self.name} ON {self.table} ({columns})"
+        table = f"{database}.{self.table}" if database else self.table
+        return f"CREATE INDEX {self.name} ON {table} ({columns})"
+
+    def to_dict(self) -> dict:
+        return {"table": self.table, "columns": list(self.columns), "name": self.name,
+                "benefit_ms": round(self.benefit_ms, 3), "queries": self.queries, "executions": self.executions}
+
+
+def _saving(columns: Sequence[str], access: TableAccess) -> float:
+    """
+    索引能为该查询节省的耗时比例（0~1）
+
+    可用前缀为等值列后最多接一个范围列，或接分组/排序列；过滤列按选择率之积计算回表代价，
+    只能避免排序/分组时按固定比例计。分组/排序列之后的过滤列无法用于定位（前导列没有约束），不再计入
+    """
+    selectivity, filtered, ordered = 1.0, False, False
+    for col in columns:
+        if ordered and (col in access.eq or col in access.range):
+            break
+        if col in access.eq:
+            selectivity *= access.selectivity[col]
+            filtered = True
+        elif col in access.range:
+            selectivity *= access.selectivity[col]
+            filtered = True
+            break
+        elif col in access.group or col in access.order:
+            ordered = True
+        else:
+            break
+    saved = max(0.0, 1 - _LOOKUP_COST * selectivity) if filtered else 0.0
+    if ordered:
+        saved += _ORDERING_GAIN * (1 - saved)
+    return saved
+
+
+def _candidates(access: TableAccess, max_columns: int) -> List[Tuple[str, ...]]:
+    """由一条查询的访问方式生成候选索引（等值列在前，其后为范围列或分组/排序列）"""
+    result = []
+    eq = access.eq[:max_columns]
+    if access.range:
+        result.append(tuple(eq + access.range[:1])[:max_columns])
+        result.extend((col,) for col in access.range)
+    for tail in (access.group, access.order):
+        if tail:
+            result.append(tuple(eq + [c for c in tail if c not in eq])[:max_columns])
+    if eq:
+        result.append(tuple(eq))
+    return [c for c in dict.fromkeys(result) if c]
+
+
+def _known_indexes(schema, existing: Optional[Dict[str, List[Tuple[str, ...]]]]) -> Dict[str, List[Tuple[str, ...]]]:
+    """已有索引：数据库中读取的索引，缺省使用结构文件中的索引、主键和外键列"""
+    if existing is not None:
+        return {table: list(indexes) for table, indexes in existing.items()}
+    known: Dict[str, List[Tuple[str, ...]]] = {}
+    for idx in schema.indexes:
+        known.setdefault(idx.table, []).append(tuple(idx.columns))
+    for table in schema.tables:
+        for col in table.columns:
+            if col.is_primary_key:
+                known.setdefault(table.name, []).append((col.name,))
+    # InnoDB 为外键列自动建立索引
+    for rel in schema.relationships:
+        known.setdefault(rel.from_table, []).append((rel.from_column,))
+    return known
+
+
+def recommend_indexes(workload: Iterable[WorkloadEntry], schema,
+                      existing: Optional[Dict[str, List[Tuple[str, ...]]]] = None,
+                      max_columns: int = INDEX_ADVISOR_MAX_COLUMNS, limit: int = 10) -> List[IndexRecommendation]:
+    """
+    按负载推荐复合索引
+
+    每条查询的耗时乘以索引可节省的比例（按可用前缀的估计选择率）作为收益，扣除已有（及已选）
+    索引已能节省的部分后贪心选择收益最大的候选
+
+    参数:
+        workload: 查询负载
+        schema: 数据库结构快照
+        existing: 表 -> 已有索引的列，缺省取结构文件中的索引、主键和外键列
+        max_columns: 复合索引最多列数
+        limit: 最多推荐的索引数
+
+    返回:
+        按估计收益从高到低排列的推荐
+    """
+    queries = []  # (WorkloadEntry, 表 -> TableAccess)
+    candidates: Dict[str, set] = {}
+    for entry in workload:
+        try:
+            access = extract_access(entry.sql, schema)
+        except Exception as err:
+            logger.debug(f"查询解析失败，跳过: {err}")
+            continue
+        if not access:
+            continue
+        queries.append((entry, access))
+        for table, table_access in access.items():
+            candidates.setdefault(table, set()).update(_candidates(table_access, max_columns))
+
+    indexes = _known_indexes(schema, existing)
+
+    def score(table: str, columns: Tuple[str, ...]):
+        benefit, hits, executions = 0.0, 0, 0
+        for entry, access in queries:
+            table_access = access.get(table)
+            if table_access is None:
+                continue
+            best = max((_saving(cols, table_access) for cols in indexes.get(table, [])), default=0.0)
+            gain = _saving(columns, table_access) - best
+            if gain > 1e-9:
+                # 没有计时的查询（如从SQL文件导入）按每次执行1ms估计
+                benefit += (entry.total_ms or entry.count) * gain
+                hits += 1
+                executions += entry.count
+        return benefit, hits, executions
+
+    recommendations = []
+    while len(recommendations) < limit:
+        best = None
+        for table, columns_set in candidates.items():
+            for columns in columns_set:
+                if any(cols[:len(columns)] == columns for cols in indexes.get(table, [])):
+                    continue
+                benefit, hits, executions = score(table, columns)
+                # 收益相同时选择列更少的索引
+                key = (benefit, -len(columns))
+                if hits and (best is None or key > best[0]):
+                    best = (key, IndexRecommendation(table, columns, benefit, hits, executions))
+        if best is None:
+            break
+        chosen = best[1]
+        recommendations.append(chosen)
+        indexes.setdefault(chosen.table, []).append(chosen.columns)
+    return recommendations
+
+
+def existing_indexes(connection, db_type: str, database: Optional[str] = None) -> Dict[str, List[Tuple[str, ...]]]:
+    """
+    从数据库读取已有索引（含主键）
+
+    返回:
+        表名 -> 各索引的列
+    """
+    cursor = connection.cursor()
+    try:
+        if db_type == 'sqlite':
+            prefix = f"{database}." if database else ""
+            result: Dict[str, List[Tuple[str, ...]]] = {}
+            cursor.execute(f"SELECT name, tbl_name FROM {prefix}sqlite_master WHERE type = 'index'")
+            for name, table in cursor.fetchall():
+                cols = cursor.execute(f'PRAGMA {prefix}index_info("{name}")').fetchall()
+                result.setdefault(table, []).append(tuple(c[2] for c in sorted(cols)))
+            cursor.execute(f"SELECT name, sql FROM {prefix}sqlite_master WHERE type = 'table'")
+            for table, ddl in cursor.fetchall():
+                # INTEGER PRIMARY KEY 即rowid，不出现在索引列表中
+                if ddl and re.search(r'INTEGER\s+PRIMARY\s+KEY', ddl, re.IGNORECASE):
+                    pk = [c[1] for c in cursor.execute(f'PRAGMA {prefix}table_info("{table}")').fetchall() if c[5]]
+                    result.setdefault(table, []).append(tuple(pk))
+            return result
+        cursor.execute("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+                       "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX", (database,))
+        grouped: "OrderedDict[tuple, list]" = OrderedDict()
+        for table, index, column in cursor.fetchall():
+            grouped.setdefault((table, index), []).append(column)
+        result = {}
+        for (table, _), columns in grouped.items():
+            result.setdefault(table, []).append(tuple(columns))
+        return result
+    finally:
+        cursor.close()
+
+
+def apply_indexes(connection, db_type: str, recommendations: Sequence[IndexRecommendation],
+                  database: Optional[str] = None) -> List[dict]:
+    """
+    创建推荐的索引，已有相同列前缀索引的跳过；SQLite 建索引后执行 ANALYZE 更新统计信息
+
+    返回:
+        每个推荐的处理结果（含DDL和状态 created/exists/failed）
+    """
+    current = existing_indexes(connection, db_type, database)
+    results = []
+    cursor = connection.cursor()
+    try:
+        for rec in recommendations:
+            ddl = rec.ddl(db_type, database)
+            if any(cols[:len(rec.columns)] == rec.columns for cols in current.get(rec.table, [])):
+                results.append(dict(rec.to_dict(), ddl=ddl, status='exists'))
+                continue
+            try:
+                start = time.perf_counter()
+                cursor.execute(ddl)
+                connection.commit()
+                current.setdefault(rec.table, []).append(rec.columns)
+                results.append(dict(rec.to_dict(), ddl=ddl, status='created',
+                                    seconds=round(time.perf_counter() - start, 3)))
+                logger.info(f"已创建索引: {ddl}")
+            except Exception as err:
+                logger.error(f"创建索引失败 {ddl}: {err}")
+                results.append(dict(rec.to_dict(), ddl=ddl, status='failed', error=str(err)))
+        if db_type == 'sqlite' and any(r['status'] == 'created' for r in results):
+            # SQLite 没有统计信息时优先使用任意可用索引，低选择率的索引反而比全表扫描慢
+            cursor.execute(f"ANALYZE {database}" if database else "ANALYZE")
+            connection.commit()
+    finally:
+        cursor.close()
+    return results
+
+
+# 全局查询负载
+_workload: Optional[QueryWorkload] = None
+_workload_lock = threading.Lock()
+
+
+def get_query_workload() -> Optional[QueryWorkload]:
+    """获取全局查询负载记录，未启用时返回None"""
+    global _workload
+    if not INDEX_ADVISOR_ENABLED:
+        return None
+    if _workload is None:
+        with _workload_lock:
+            if _workload is None:
+                _workload = QueryWorkload()
+    return _workload
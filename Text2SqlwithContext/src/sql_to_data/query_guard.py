@@ -0,0 +1,321 @@
+import re
+import json
+import math
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Optional
+from sqlparse import tokens as T
+from sqlparse.lexer import Lexer
+from ..basic_function.config import (
+    QUERY_GUARD_ENABLED, QUERY_GUARD_REJECT_ROWS, QUERY_GUARD_LIMIT_ROWS, QUERY_GUARD_LIMIT,
+    QUERY_DEADLINE_MS, QUERY_GUARD_DEADLINE_MS
+)
+from .sql_validator import referenced_tables
+
+logger = logging.getLogger(__name__)
+
+# 出现这些关键字/聚合函数时，数据库必须处理完所有行才能返回第一行，加LIMIT不能减少扫描
+_BLOCKING_KEYWORDS = {'GROUP BY', 'ORDER BY', 'DISTINCT', 'HAVING', 'UNION', 'UNION ALL', 'EXCEPT', 'INTERSECT', 'OVER'}
+_AGGREGATES = {'COUNT', 'SUM', 'AVG', 'MIN', 'MAX', 'GROUP_CONCAT', 'STRING_AGG', 'ARRAY_AGG', 'STDDEV', 'VARIANCE'}
+
+# SQLite 进度回调的虚拟机指令间隔
+_SQLITE_PROGRESS_STEPS = 10000
+# SQLite 没有行数估计：按索引等值查找时查询规划器默认每个键约10行
+_SQLITE_INDEX_LOOKUP_ROWS = 10
+_SQLITE_PLAN_RE = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS (\S+))?(.*)$')
+
+
+@dataclass(frozen=True)
+class GuardDecision:
+    """代价守卫对一次查询的决定（记录在请求指标中）"""
+    action: str  # allow / limit / deadline / reject / skipped
+    rows_examined: Optional[float] = None  # EXPLAIN估计的扫描行数
+    reason: str = ""
+    limit: Optional[int] = None  # action为limit时的返回行数上限
+    deadline_ms: Optional[int] = None  # 执行时限（毫秒）
+    explain_ms: float = 0.0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def is_streamable(query: str) -> bool:
+    """查询能否边扫描边返回（加LIMIT后数据库可提前结束扫描）"""
+    tokens = [t for t in Lexer.get_default_instance().get_tokens(query or '')
+              if not t[1].isspace() and t[0] not in T.Comment]
+    for k, (ttype, value) in enumerate(tokens):
+        word = value.upper()
+        if ttype in T.Keyword and ' '.join(word.split()) in _BLOCKING_KEYWORDS:
+            return False
+        if word in _AGGREGATES and k + 1 < len(tokens) and tokens[k + 1][1] == '(':
+            return False
+    return True
+
+
+def _explain_mysql(cursor, query: str) -> float:
+    """
+    EXPLAIN 逐查询块估计扫描行数
+    嵌套循环中每张表的扫描次数为前面各表过滤后行数之积
+    """
+    cursor.execute(f"EXPLAIN {query}")
+    names = [d[0].lower() for d in cursor.description]
+    blocks = {}
+    for row in cursor.fetchall():
+        entry = dict(zip(names, row))
+        blocks.setdefault(entry.get('id'), []).append(entry)
+    total = 0.0
+    for block in blocks.values():
+        loops = 1.0
+        for entry in block:
+            rows = float(entry.get('rows') or 0)
+            total += loops * rows
+            loops *= max(rows * float(entry.get('filtered') or 100) / 100, 1.0)
+    return total
+
+
+def _pg_rows_examined(node: dict) -> float:
+    children = node.get('Plans', [])
+    if not children:
+        return float(node.get('Plan Rows', 0))
+    if node.get('Node Type') == 'Nested Loop' and len(children) == 2:
+        outer, inner = children
+        return _pg_rows_examined(outer) + float(outer.get('Plan Rows', 0)) * _pg_rows_examined(inner)
+    return sum(_pg_rows_examined(child) for child in children)
+
+
+def _explain_postgresql(cursor, query: str) -> float:
+    """EXPLAIN (FORMAT JSON)：叶子节点的估计行数之和，嵌套循环的内层乘以外层行数"""
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return _pg_rows_examined(plan[0]['Plan'])
+
+
+def _sqlite_table_rows(cursor, table: str) -> float:
+    """表行数的低开销估计（MAX(rowid) 只读索引的最后一页）"""
+    try:
+        row = cursor.execute(f'SELECT MAX(rowid) FROM "{table.replace(chr(34), chr(34) * 2)}"').fetchone()
+        return float(row[0] or 0)
+    except Exception:
+        return 0.0
+
+
+def _explain_sqlite(cursor, query: str) -> float:
+    """
+    EXPLAIN QUERY PLAN 不含行数，按计划中的 SCAN/SEARCH 结合表行数估计
+    同一父节点下的 SCAN/SEARCH 依次构成嵌套循环
+    """
+    plan = cursor.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    tables = referenced_tables(query)
+    loops_by_parent = {}
+    total = 0.0
+    for _, parent, _, detail in plan:
+        match = _SQLITE_PLAN_RE.match(detail)
+        if not match or match.group(2).startswith('('):
+            continue
+        kind, name, alias, rest = match.groups()
+        table = tables.get((alias or name).lower(), name)
+        rows = _sqlite_table_rows(cursor, table)
+        if kind == 'SEARCH':
+            if 'PRIMARY KEY' in rest or 'ROWID' in rest.upper():
+                rows = 1.0 if '=' in rest and '>' not in rest and '<' not in rest else rows / 4
+            elif '>' in rest or '<' in rest:
+                rows = rows / 4
+            else:
+                rows = min(rows, _SQLITE_INDEX_LOOKUP_ROWS)
+        loops = loops_by_parent.get(parent, 1.0)
+        total += loops * rows
+        loops_by_parent[parent] = loops * max(rows, 1.0)
+    return total
+
+
+_EXPLAINERS = {
+    'mysql': _explain_mysql,
+    'postgresql': _explain_postgresql,
+    'sqlite': _explain_sqlite
+}
+
+
+@contextmanager
+def query_deadline(connection, db_type: str, deadline_ms: Optional[int]):
+    """
+    在连接上设置单次查询的执行时限，退出时恢复
+
+    MySQL 使用会话变量 MAX_EXECUTION_TIME，PostgreSQL 使用 SET LOCAL statement_timeout
+    （归还连接池时回滚，设置随事务结束），SQL Server 使用连接的查询超时，
+    SQLite 通过进度回调在超时后中断执行
+    """
+    if not deadline_ms:
+        yield
+        return
+    if db_type == 'sqlite':
+        end = time.monotonic() + deadline_ms / 1000
+        connection.set_progress_handler(lambda: int(time.monotonic() > end), _SQLITE_PROGRESS_STEPS)
+        try:
+            yield
+        finally:
+            connection.set_progress_handler(None, 0)
+    elif db_type == 'sqlserver':
+        previous = connection.timeout
+        connection.timeout = max(1, math.ceil(deadline_ms / 1000))
+        try:
+            yield
+        finally:
+            connection.timeout = previous
+    elif db_type in ('mysql', 'postgresql'):
+        statement = (f"SET SESSION MAX_EXECUTION_TIME = {int(deadline_ms)}" if db_type == 'mysql'
+                     else f"SET LOCAL statement_timeout = {int(deadline_ms)}")
+        cursor = connection.cursor()
+        try:
+            cursor.execute(statement)
+            applied = True
+        except Exception as err:
+            # MariaDB等不支持该变量时不设时限
+            logger.info(f"未能设置查询时限: {err}")
+            applied = False
+        finally:
+            cursor.close()
+        try:
+            yield
+        finally:
+            if applied and db_type == 'mysql':
+                cursor = connection.cursor()
+                try:
+                    cursor.execute("SET SESSION MAX_EXECUTION_TIME = DEFAULT")
+                except Exception as err:
+                    logger.info(f"查询时限恢复失败: {err}")
+                finally:
+                    cursor.close()
+    else:
+        yield
+
+
+def is_deadline_error(err: Exception) -> bool:
+    """异常是否由执行时限触发"""
+    if getattr(err, 'errno', None) in (3024, 1969):  # MySQL ER_QUERY_TIMEOUT / MariaDB ER_STATEMENT_TIMEOUT
+        return True
+    if getattr(err, 'pgcode', None) == '57014':  # query_canceled
+        return True
+    text = str(err).lower()
+    return 'interrupted' in text or 'hyt00' in text or 'timeout expired' in text
+
+
+class QueryGuard:
+    """
+    查询代价守卫
+    执行前用 EXPLAIN 估计扫描行数：超过拒绝阈值的查询不执行；超过限制阈值时，
+    可边扫描边返回的查询收紧LIMIT，其余查询使用更短的执行时限
+    """
+
+    def __init__(self, enabled: bool = QUERY_GUARD_ENABLED, reject_rows: int = QUERY_GUARD_REJECT_ROWS,
+                 limit_rows: int = QUERY_GUARD_LIMIT_ROWS, limit: int = QUERY_GUARD_LIMIT,
+                 deadline_ms: int = QUERY_DEADLINE_MS, strict_deadline_ms: int = QUERY_GUARD_DEADLINE_MS):
+        """
+        参数:
+            enabled: 是否执行EXPLAIN检查（关闭时仍使用默认执行时限）
+            reject_rows: 估计扫描行数超过该值时拒绝执行，0表示不拒绝
+            limit_rows: 估计扫描行数超过该值时收紧LIMIT或缩短时限，0表示不处理
+            limit: 收紧后的返回行数
+            deadline_ms: 所有查询的默认执行时限（毫秒），0表示不限
+            strict_deadline_ms: 高代价查询的执行时限（毫秒）
+        """
+        self.enabled = enabled
+        self.reject_rows = reject_rows
+        self.limit_rows = limit_rows
+        self.limit = limit
+        self.deadline_ms = deadline_ms
+        self.strict_deadline_ms = strict_deadline_ms
+        self._lock = threading.Lock()
+        self.stats = {"checks": 0, "allow": 0, "limit": 0, "deadline": 0, "reject": 0, "skipped": 0,
+                      "timeouts": 0, "explain_seconds": 0.0}
+
+    def decide(self, rows_examined: float, query: str, explain_ms: float = 0.0) -> GuardDecision:
+        """按估计扫描行数决定处理方式"""
+        deadline = self.deadline_ms or None
+        if self.reject_rows and rows_examined > self.reject_rows:
+            return GuardDecision('reject', rows_examined, f"估计扫描 {rows_examined:,.0f} 行，超过上限 {self.reject_rows:,}",
+                                 explain_ms=explain_ms)
+        if self.limit_rows and rows_examined > self.limit_rows:
+            if is_streamable(query):
+                return GuardDecision('limit', rows_examined, f"估计扫描 {rows_examined:,.0f} 行，只返回前 {self.limit} 行",
+                                     limit=self.limit, deadline_ms=deadline, explain_ms=explain_ms)
+            strict = min(filter(None, (self.strict_deadline_ms, self.deadline_ms)), default=None)
+            return GuardDecision('deadline', rows_examined, f"估计扫描 {rows_examined:,.0f} 行，限时 {strict} 毫秒",
+                                 deadline_ms=strict, explain_ms=explain_ms)
+        return GuardDecision('allow', rows_examined, deadline_ms=deadline, explain_ms=explain_ms)
+
+    def check(self, connection, query: str, db_type: str) -> GuardDecision:
+        """
+        在将要执行查询的连接上运行EXPLAIN并作出决定
+
+        返回:
+            GuardDecision；无法估计时为 skipped（仍使用默认执行时限）
+        """
+        explain = _EXPLAINERS.get(db_type) if self.enabled else None
+        if explain is None:
+            reason = "代价守卫未启用" if not self.enabled else f"{db_type}不支持代价估计"
+            decision = GuardDecision('skipped', reason=reason, deadline_ms=self.deadline_ms or None)
+        else:
+            start = time.perf_counter()
+            cursor = connection.cursor()
+            try:
+                rows = explain(cursor, query)
+            except Exception as err:
+                rows = None
+                reason = f"EXPLAIN失败: {err}"
+            finally:
+                cursor.close()
+            explain_ms = (time.perf_counter() - start) * 1000
+            if rows is None:
+                try:
+                    # PostgreSQL 中出错的语句使事务失效，回滚后才能继续执行
+                    connection.rollback()
+                except Exception:
+                    pass
+                decision = GuardDecision('skipped', reason=reason, deadline_ms=self.deadline_ms or None,
+                                         explain_ms=explain_ms)
+            else:
+                decision = self.decide(rows, query, explain_ms)
+            with self._lock:
+                self.stats["explain_seconds"] += explain_ms / 1000
+        with self._lock:
+            self.stats["checks"] += 1
+            self.stats[decision.action] += 1
+        if decision.action != 'allow':
+            logger.info(f"查询代价守卫: {decision.action} {decision.reason}")
+        return decision
+
+    def record_timeout(self):
+        with self._lock:
+            self.stats["timeouts"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, settings={
+                "enabled": self.enabled, "reject_rows": self.reject_rows, "limit_rows": self.limit_rows,
+                "limit": self.limit, "deadline_ms": self.deadline_ms, "strict_deadline_ms": self.strict_deadline_ms
+            })
+
+
+# 全局代价守卫
+_guard: Optional[QueryGuard] = None
+_guard_lock = threading.Lock()
+
+
+def get_query_guard() -> QueryGuard:
+    """获取全局查询代价守卫"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = QueryGuard()
+    return _guard
+
+
+def get_guard_stats() -> Optional[dict]:
+    """代价守卫统计，未创建时返回None"""
+    return _guard.get_stats() if _guard is not None else None
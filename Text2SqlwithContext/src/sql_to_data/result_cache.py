@@ -0,0 +1,360 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Mapping, Optional, Tuple
+import pandas as pd # type: ignore
+import sqlparse # type: ignore
+from sqlparse import tokens as T # type: ignore
+from sqlparse.sql import Identifier, IdentifierList, Parenthesis # type: ignore
+from ..basic_function.config import (
+    RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRY_BYTES,
+    RESULT_CACHE_TTL, RESULT_CACHE_PROBE_INTERVAL
+)
+
+logger = logging.getLogger(__name__)
+
+# 结果随时间/调用变化的函数，包含这些函数的查询不缓存
+_VOLATILE_FUNCTIONS = {
+    'NOW', 'CURDATE', 'CURTIME', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'SYSDATE',
+    'UTC_DATE', 'UTC_TIME', 'UTC_TIMESTAMP', 'LOCALTIME', 'LOCALTIMESTAMP', 'UNIX_TIMESTAMP',
+    'RAND', 'RANDOM', 'UUID', 'UUID_SHORT', 'NEWID', 'GETDATE', 'LAST_INSERT_ID', 'CONNECTION_ID'
+}
+
+# 探测结果中表示整个数据库（如SQLite文件修改时间）的键
+DATABASE_FINGERPRINT = '*'
+
+_TABLE_PREFIX_KEYWORDS = {'FROM', 'JOIN', 'INNER JOIN', 'LEFT JOIN', 'RIGHT JOIN', 'FULL JOIN', 'CROSS JOIN',
+                          'LEFT OUTER JOIN', 'RIGHT OUTER JOIN', 'FULL OUTER JOIN', 'STRAIGHT_JOIN',
+                          'NATURAL JOIN'}
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    规范化SQL文本：去掉注释和末尾分号，空白合并为一个空格，关键字转大写
+    字符串字面量和标识符保持原样
+
+    参数:
+        sql: SQL文本
+
+    返回:
+        规范化后的SQL
+    """
+    if not sql or not sql.strip():
+        return ''
+    tokens = [t for t in sqlparse.parse(sql.strip().rstrip(';'))[0].flatten() if t.ttype not in T.Comment]
+    parts = []
+    previous = None
+    for i, token in enumerate(tokens):
+        if token.is_whitespace:
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+            continue
+        # 别名决定结果列名，AS之后的关键字（如 AS count）保持原样
+        after_as = previous is not None and previous.normalized == 'AS'
+        # 函数名（紧跟左括号的名称，如 count(*)）不区分大小写
+        is_function = token.ttype in T.Name and i + 1 < len(tokens) and tokens[i + 1].value == '('
+        if (token.ttype in T.Keyword or token.ttype in T.Name.Builtin or is_function) and not after_as:
+            parts.append(token.value.upper())
+        else:
+            parts.append(token.value)
+        previous = token
+    return ''.join(parts).strip().rstrip(';').strip()
+
+
+def _strip_quotes(name: str) -> str:
+    return name.strip('`"[]')
+
+
+def _collect_tables(token_list, tables: set, ctes: set):
+    """递归遍历语法树，收集 FROM/JOIN 之后的表名"""
+    expect_table = False
+    for token in token_list.tokens:
+        if token.is_whitespace or token.ttype in T.Comment:
+            continue
+        if token.ttype in T.Keyword.CTE:
+            # WITH name AS (...)：记录CTE名，避免误当作表
+            continue
+        if token.is_keyword:
+            expect_table = token.normalized in _TABLE_PREFIX_KEYWORDS
+            continue
+        if isinstance(token, Parenthesis):
+            _collect_tables(token, tables, ctes)
+            expect_table = False
+            continue
+        if expect_table:
+            identifiers = token.get_identifiers() if isinstance(token, IdentifierList) else [token]
+            for identifier in identifiers:
+                if not isinstance(identifier, Identifier):
+                    continue
+                subquery = next((t for t in identifier.tokens if isinstance(t, Parenthesis)), None)
+                if subquery is not None:
+                    _collect_tables(subquery, tables, ctes)
+                    continue
+                name = identifier.get_real_name()
+                if name:
+                    tables.add(_strip_quotes(name).lower())
+            expect_table = False
+            continue
+        if isinstance(token, Identifier) and any(isinstance(t, Parenthesis) for t in token.tokens):
+            # CTE定义或带别名的子查询
+            if token.get_name():
+                ctes.add(_strip_quotes(token.get_name()).lower())
+            for t in token.tokens:
+                if isinstance(t, Parenthesis):
+                    _collect_tables(t, tables, ctes)
+            continue
+        if isinstance(token, IdentifierList):
+            for t in token.get_identifiers():
+                if isinstance(t, Identifier) and any(isinstance(p, Parenthesis) for p in t.tokens):
+                    if t.get_name():
+                        ctes.add(_strip_quotes(t.get_name()).lower())
+                    for p in t.tokens:
+                        if isinstance(p, Parenthesis):
+                            _collect_tables(p, tables, ctes)
+            continue
+        if token.is_group:
+            _collect_tables(token, tables, ctes)
+
+
+def extract_tables(sql: str) -> FrozenSet[str]:
+    """
+    从sqlparse语法树中提取查询读取的表（小写，不含库名前缀，排除CTE名）
+
+    参数:
+        sql: SQL文本
+
+    返回:
+        表名集合
+    """
+    tables: set = set()
+    ctes: set = set()
+    for statement in sqlparse.parse(sql or ''):
+        _collect_tables(statement, tables, ctes)
+    return frozenset(tables - ctes)
+
+
+def is_cacheable(sql: str) -> bool:
+    """只缓存不含易变函数的单条SELECT查询"""
+    statements = [s for s in sqlparse.parse(sql or '') if s.token_first(skip_cm=True) is not None]
+    if len(statements) != 1 or statements[0].get_type() != 'SELECT':
+        return False
+    for token in statements[0].flatten():
+        if token.value.upper() in _VOLATILE_FUNCTIONS and token.ttype not in T.Literal.String:
+            return False
+    return True
+
+
+def make_result_key(normalized_sql: str, db_identity: str) -> str:
+    """缓存键：规范化SQL + 数据库标识"""
+    return hashlib.sha256(f"{db_identity}\n{normalized_sql}".encode('utf-8')).hexdigest()
+
+
+@dataclass
+class _Entry:
+    df: pd.DataFrame
+    db_identity: str
+    tables: FrozenSet[str]
+    versions: Tuple[Tuple[int, int], ...]
+    size: int
+    created: float
+
+
+class ResultCache:
+    """
+    SQL结果缓存
+    以规范化SQL和数据库标识为键，记录每个结果读取的表及当时的表版本；
+    表版本在数据导入或探测到表变化时递增，版本不一致的结果视为失效。
+    按DataFrame内存占用限制总大小，LRU淘汰。
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES, max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES,
+                 ttl: float = RESULT_CACHE_TTL, probe_interval: float = RESULT_CACHE_PROBE_INTERVAL):
+        """
+        参数:
+            max_bytes: 缓存结果总内存上限（字节）
+            max_entry_bytes: 单个结果内存上限，超过则不缓存
+            ttl: 结果有效期（秒），0表示仅依赖表版本失效
+            probe_interval: 表变化探测的最小间隔（秒），0表示不探测
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.probe_interval = probe_interval
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._epochs: Dict[str, int] = {}
+        self._fingerprints: Dict[str, Dict[str, object]] = {}
+        self._last_probe: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "puts": 0, "evictions": 0,
+                      "uncacheable": 0, "too_large": 0, "invalidations": 0}
+
+    def _table_version(self, db_identity: str, table: str) -> Tuple[int, int]:
+        # (数据库级epoch, 表级版本)，整体导入只需递增epoch
+        return self._epochs.get(db_identity, 0), self._versions.get((db_identity, table), 0)
+
+    def _current_versions(self, db_identity: str, tables: FrozenSet[str]) -> Tuple[Tuple[int, int], ...]:
+        return tuple(self._table_version(db_identity, t) for t in sorted(tables))
+
+    def get(self, sql: str, db_identity: str) -> Optional[pd.DataFrame]:
+        """
+        查询缓存
+
+        返回:
+            DataFrame副本，未命中或已失效时返回None
+        """
+        key = make_result_key(normalize_sql(sql), db_identity)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            expired = self.ttl and time.time() - entry.created > self.ttl
+            if expired or entry.versions != self._current_versions(db_identity, entry.tables):
+                self._remove(key)
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            df = entry.df
+        # 返回副本，调用方对DataFrame的修改不影响缓存
+        return df.copy()
+
+    def snapshot_versions(self, sql: str, db_identity: str) -> Tuple[Tuple[int, int], ...]:
+        """执行查询前记录所读表的版本，查询期间表发生变化时结果不会以新版本写入"""
+        tables = extract_tables(sql)
+        with self._lock:
+            return self._current_versions(db_identity, tables)
+
+    def put(self, sql: str, db_identity: str, df: pd.DataFrame,
+            versions: Optional[Tuple[Tuple[int, int], ...]] = None) -> bool:
+        """
+        写入缓存（不可缓存或过大的结果跳过）
+
+        参数:
+            versions: 执行查询前由 snapshot_versions 记录的表版本，缺省为当前版本
+
+        返回:
+            是否已缓存
+        """
+        if df is None or not is_cacheable(sql):
+            self.stats["uncacheable"] += 1
+            return False
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_entry_bytes:
+            self.stats["too_large"] += 1
+            return False
+        tables = extract_tables(sql)
+        key = make_result_key(normalize_sql(sql), db_identity)
+        with self._lock:
+            current = self._current_versions(db_identity, tables)
+            if versions is not None and versions != current:
+                # 查询期间表已变化
+                self.stats["stale"] += 1
+                return False
+            self._remove(key)
+            self._entries[key] = _Entry(df.copy(), db_identity, tables, current, size, time.time())
+            self._bytes += size
+            self.stats["puts"] += 1
+            while self._bytes > self.max_bytes and self._entries:
+                old_key = next(iter(self._entries))
+                self._remove(old_key)
+                self.stats["evictions"] += 1
+        return True
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def invalidate(self, db_identity: str, tables: Optional[FrozenSet[str]] = None):
+        """
+        递增表版本，使读取这些表的结果失效
+
+        参数:
+            db_identity: 数据库标识
+            tables: 发生变化的表，为None时整个数据库的结果全部失效
+        """
+        with self._lock:
+            if tables is None:
+                self._epochs[db_identity] = self._epochs.get(db_identity, 0) + 1
+                self._fingerprints.pop(db_identity, None)
+            else:
+                for table in tables:
+                    key = (db_identity, table.lower())
+                    self._versions[key] = self._versions.get(key, 0) + 1
+            self.stats["invalidations"] += 1
+
+    def should_probe(self, db_identity: str) -> bool:
+        """是否到了再次探测表变化的时间（同时占用本轮探测）"""
+        if not self.probe_interval:
+            return False
+        now = time.time()
+        with self._lock:
+            if now - self._last_probe.get(db_identity, 0.0) < self.probe_interval:
+                return False
+            self._last_probe[db_identity] = now
+            return True
+
+    def refresh_fingerprints(self, db_identity: str, fingerprints: Mapping[str, object]):
+        """
+        根据探测结果（表名 -> 更新时间/修改计数等）使发生变化的表失效
+        首次探测只记录基线
+        """
+        current = {name.lower(): value for name, value in fingerprints.items()}
+        with self._lock:
+            previous = self._fingerprints.get(db_identity)
+            self._fingerprints[db_identity] = current
+        if previous is None:
+            return
+        changed = {t for t in set(previous) | set(current) if previous.get(t) != current.get(t)}
+        if DATABASE_FINGERPRINT in changed:
+            logger.info("检测到数据库变化，结果缓存全部失效")
+            self.invalidate(db_identity)
+            with self._lock:
+                self._fingerprints[db_identity] = current
+            return
+        if changed:
+            logger.info(f"检测到表变化，结果缓存失效: {sorted(changed)}")
+            self.invalidate(db_identity, frozenset(changed))
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        """缓存统计"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes,
+                        hit_rate=round(self.stats["hits"] / lookups, 4) if lookups else 0.0)
+
+
+# 全局结果缓存
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """获取全局结果缓存（未启用时返回None）"""
+    global _result_cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+    return _result_cache
+
+
+def get_result_cache_stats() -> dict:
+    """结果缓存统计（未启用时返回空字典）"""
+    cache = get_result_cache()
+    return cache.get_stats() if cache else {}
@@ -0,0 +1,355 @@
+import io
+import os
+import re
+import time
+import hashlib
+import logging
+import tempfile
+from decimal import Decimal
+from typing import Callable, Iterator, List, Optional, Sequence, Tuple
+from ..basic_function.config import SEED_BATCH_ROWS, SEED_MYSQL_LOAD_DATA
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_TABLE = '_seed_checksums'
+
+# 切分语句时需要整体跳过的记号：字符串、引用标识符、注释；分号为语句结束
+_STRING_MYSQL = r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\""
+_STRING_STANDARD = r"'(?:[^']|'')*'"
+_COMMENTS = r"--(?=\s)[^\n]*|--$|/\*(?!!).*?\*/"
+
+
+def _token_pattern(db_type: str) -> "re.Pattern":
+    if db_type == 'mysql':
+        return re.compile(rf"{_STRING_MYSQL}|`[^`]*`|{_COMMENTS}|\#[^\n]*|;", re.DOTALL | re.MULTILINE)
+    quoted = r'"[^"]*"|\[[^\]]*\]' if db_type == 'sqlserver' else r'"[^"]*"'
+    return re.compile(rf"{_STRING_STANDARD}|{quoted}|{_COMMENTS}|;", re.DOTALL | re.MULTILINE)
+
+
+def split_statements(text: str, db_type: str = 'mysql') -> Iterator[str]:
+    """
+    将SQL脚本切分为语句：忽略字符串、引用标识符和注释中的分号，并去掉注释
+
+    参数:
+        text: SQL脚本
+        db_type: 数据库类型（决定字符串转义和注释语法）
+
+    返回:
+        逐条语句（不含结尾分号）
+    """
+    parts = []
+    pos = 0
+    for match in _token_pattern(db_type).finditer(text):
+        token = match.group()
+        if token == ';':
+            parts.append(text[pos:match.start()])
+            statement = ''.join(parts).strip()
+            if statement:
+                yield statement
+            parts = []
+            pos = match.end()
+        elif token.startswith(('--', '#', '/*')):
+            parts.append(text[pos:match.start()])
+            parts.append(' ')
+            pos = match.end()
+    parts.append(text[pos:])
+    statement = ''.join(parts).strip()
+    if statement:
+        yield statement
+
+
+_INSERT_RE = re.compile(
+    r"^INSERT\s+INTO\s+(?P<table>[`\"\[\]\w.]+)\s*(?:\((?P<columns>[^()]*)\))?\s*VALUES\s*(?P<values>\(.*)$",
+    re.IGNORECASE | re.DOTALL
+)
+
+_MYSQL_ESCAPES = {'0': '\0', 'b': '\b', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+
+
+def _value_pattern(db_type: str) -> "re.Pattern":
+    string = r"'(?:[^'\\]|\\.|'')*'" if db_type == 'mysql' else r"'(?:[^']|'')*'"
+    return re.compile(
+        rf"\s*(?:(?P<str>{string})|(?P<num>[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)"
+        r"|(?P<null>NULL\b)|(?P<bool>TRUE\b|FALSE\b)|(?P<punct>[(),]))",
+        re.IGNORECASE
+    )
+
+
+def _unquote(literal: str, db_type: str) -> str:
+    body = literal[1:-1].replace("''", "'")
+    if db_type != 'mysql' or '\\' not in body:
+        return body
+    return re.sub(r"\\(.)", lambda m: _MYSQL_ESCAPES.get(m.group(1), m.group(1)), body, flags=re.DOTALL)
+
+
+def parse_values(values: str, db_type: str = 'mysql') -> Optional[List[tuple]]:
+    """
+    解析 VALUES 后的多行字面量 (..), (..)
+
+    返回:
+        行列表；含函数调用、表达式或 ON DUPLICATE KEY 等子句时返回None（按原语句执行）
+    """
+    pattern = _value_pattern(db_type)
+    rows = []
+    pos = 0
+    end = len(values.rstrip())
+    while pos < end:
+        match = pattern.match(values, pos)
+        if not match or match.group('punct') != '(':
+            return None
+        pos = match.end()
+        row = []
+        while True:
+            match = pattern.match(values, pos)
+            if not match or match.group('punct'):
+                return None
+            if match.group('str') is not None:
+                row.append(_unquote(match.group('str'), db_type))
+            elif match.group('num') is not None:
+                num = match.group('num')
+                row.append(int(num) if re.fullmatch(r"[+-]?\d+", num) else Decimal(num))
+            elif match.group('null') is not None:
+                row.append(None)
+            else:
+                row.append(match.group('bool').upper() == 'TRUE')
+            pos = match.end()
+            match = pattern.match(values, pos)
+            if not match or match.group('punct') not in (',', ')'):
+                return None
+            pos = match.end()
+            if match.group('punct') == ')':
+                break
+        rows.append(tuple(row))
+        match = pattern.match(values, pos)
+        if match and match.group('punct') == ',':
+            pos = match.end()
+        elif pos < end and values[pos:end].strip():
+            return None
+        else:
+            break
+    return rows or None
+
+
+def _copy_text(rows: Sequence[tuple]) -> str:
+    """按 PostgreSQL COPY / MySQL LOAD DATA 的文本格式输出（制表符分隔，\\N 为空值）"""
+    def field(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return '1' if value else '0'
+        text = str(value)
+        if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+            text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+        return text
+    return ''.join('\t'.join(field(v) for v in row) + '\n' for row in rows)
+
+
+class _InsertBatch:
+    """连续的、写入同一张表同一组列的INSERT，合并后批量写入"""
+
+    def __init__(self, table: str, columns: Optional[str]):
+        self.table = table
+        self.columns = columns
+        self.rows: List[tuple] = []
+
+    def matches(self, table: str, columns: Optional[str]) -> bool:
+        return self.table == table and self.columns == columns
+
+    @property
+    def column_list(self) -> str:
+        return f" ({self.columns})" if self.columns else ""
+
+
+class SeedImportError(Exception):
+    """种子文件导入失败（已回滚）"""
+
+    def __init__(self, file_name: str, statement: str, error: Exception):
+        self.file_name = file_name
+        self.statement = statement
+        self.error = error
+        super().__init__(f"{file_name} 导入失败: {error}")
+
+
+class SeedLoader:
+    """
+    种子数据导入
+    按语法切分语句，连续的INSERT解析为行后按方言批量写入
+    （MySQL executemany 合并为多行INSERT或 LOAD DATA LOCAL INFILE，PostgreSQL COPY，
+    SQL Server fast_executemany，SQLite executemany）；
+    所有文件在同一事务中导入，并记录文件校验和，未变化的文件再次导入时跳过
+    """
+
+    def __init__(self, connection, db_type: str = 'mysql', batch_rows: int = SEED_BATCH_ROWS,
+                 load_data_local: bool = SEED_MYSQL_LOAD_DATA,
+                 progress: Optional[Callable[[dict], None]] = None):
+        """
+        参数:
+            connection: 可写的数据库连接（由调用方负责归还）
+            db_type: 数据库类型
+            batch_rows: 每批写入的行数
+            load_data_local: MySQL是否使用 LOAD DATA LOCAL INFILE
+            progress: 进度回调，参数为包含文件名、语句数、行数、已处理字节数的dict
+        """
+        self.connection = connection
+        self.db_type = db_type
+        self.batch_rows = max(1, batch_rows)
+        self.load_data_local = load_data_local and db_type == 'mysql'
+        self.progress = progress
+        self.placeholder = '%s' if db_type in ('mysql', 'postgresql') else '?'
+        self._last_report = 0.0
+
+    # ---- 校验和 ----
+
+    def _ensure_checksum_table(self, cursor):
+        ddl = (f"CREATE TABLE {CHECKSUM_TABLE} (file_name VARCHAR(255) PRIMARY KEY, "
+               f"checksum CHAR(64) NOT NULL, applied_at VARCHAR(32) NOT NULL)")
+        if self.db_type == 'sqlserver':
+            cursor.execute(f"IF OBJECT_ID('{CHECKSUM_TABLE}') IS NULL {ddl}")
+        else:
+            cursor.execute(ddl.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+
+    def _stored_checksum(self, cursor, file_name: str) -> Optional[str]:
+        cursor.execute(f"SELECT checksum FROM {CHECKSUM_TABLE} WHERE file_name = {self.placeholder}", (file_name,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def _record_checksum(self, cursor, file_name: str, checksum: str):
+        cursor.execute(f"DELETE FROM {CHECKSUM_TABLE} WHERE file_name = {self.placeholder}", (file_name,))
+        cursor.execute(f"INSERT INTO {CHECKSUM_TABLE} (file_name, checksum, applied_at) "
+                       f"VALUES ({self.placeholder}, {self.placeholder}, {self.placeholder})",
+                       (file_name, checksum, time.strftime('%Y-%m-%d %H:%M:%S')))
+
+    # ---- 批量写入 ----
+
+    def _write_batch(self, cursor, batch: _InsertBatch):
+        if not batch.rows:
+            return
+        rows = batch.rows
+        if self.db_type == 'postgresql':
+            cursor.copy_expert(f"COPY {batch.table}{batch.column_list} FROM STDIN",
+                               io.StringIO(_copy_text(rows)))
+        elif self.load_data_local:
+            self._load_data_local(cursor, batch)
+        else:
+            marks = ', '.join([self.placeholder] * len(rows[0]))
+            sql = f"INSERT INTO {batch.table}{batch.column_list} VALUES ({marks})"
+            if self.db_type == 'sqlserver':
+                cursor.fast_executemany = True
+            elif self.db_type == 'sqlite':
+                # sqlite3 不支持绑定Decimal
+                rows = [tuple(float(v) if isinstance(v, Decimal) else v for v in row) for row in rows]
+            # mysql.connector 会将 INSERT 的 executemany 改写为多行INSERT
+            cursor.executemany(sql, rows)
+        batch.rows = []
+
+    def _load_data_local(self, cursor, batch: _InsertBatch):
+        fd, path = tempfile.mkstemp(prefix='seed_', suffix='.tsv')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                f.write(_copy_text(batch.rows))
+            cursor.execute(
+                f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {batch.table} CHARACTER SET utf8mb4 "
+                f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n'{batch.column_list}"
+            )
+        finally:
+            os.remove(path)
+
+    def _report(self, info: dict, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_report < 1.0:
+            return
+        self._last_report = now
+        logger.info(f"导入 {info['file']}: {info['statements']} 条语句, {info['rows']} 行, "
+                    f"{info['bytes_done']}/{info['bytes_total']} 字节")
+        if self.progress is not None:
+            self.progress(dict(info))
+
+    def _load_text(self, cursor, file_name: str, text: str) -> Tuple[int, int]:
+        """执行一个文件的全部语句，返回(语句数, 批量写入的行数)"""
+        info = {"file": file_name, "statements": 0, "rows": 0, "bytes_done": 0, "bytes_total": len(text)}
+        batch: Optional[_InsertBatch] = None
+        consumed = 0
+        for statement in split_statements(text, self.db_type):
+            consumed += len(statement) + 1
+            match = _INSERT_RE.match(statement)
+            rows = parse_values(match.group('values'), self.db_type) if match else None
+            try:
+                if rows is not None:
+                    table = match.group('table')
+                    columns = ' '.join(match.group('columns').split()) if match.group('columns') else None
+                    if batch is None or not batch.matches(table, columns) or \
+                            (batch.rows and len(batch.rows[0]) != len(rows[0])):
+                        if batch is not None:
+                            self._write_batch(cursor, batch)
+                        batch = _InsertBatch(table, columns)
+                    batch.rows.extend(rows)
+                    info["rows"] += len(rows)
+                    if len(batch.rows) >= self.batch_rows:
+                        self._write_batch(cursor, batch)
+                else:
+                    if batch is not None:
+                        self._write_batch(cursor, batch)
+                        batch = None
+                    cursor.execute(statement)
+                    if cursor.description is not None:
+                        cursor.fetchall()
+            except Exception as err:
+                raise SeedImportError(file_name, statement[:200], err) from err
+            info["statements"] += 1
+            info["bytes_done"] = min(consumed, len(text))
+            self._report(info)
+        if batch is not None:
+            try:
+                self._write_batch(cursor, batch)
+            except Exception as err:
+                raise SeedImportError(file_name, f"INSERT INTO {batch.table} ...", err) from err
+        info["bytes_done"] = len(text)
+        self._report(info, force=True)
+        return info["statements"], info["rows"]
+
+    def load_files(self, paths: Sequence[str], force: bool = False) -> List[dict]:
+        """
+        在同一事务中导入多个种子文件，失败时整体回滚
+
+        参数:
+            paths: 种子文件路径
+            force: 为True时忽略校验和，全部重新导入
+
+        返回:
+            每个文件的结果 {file, status: imported/skipped, statements, rows, seconds}
+
+        Raises:
+            SeedImportError: 某条语句执行失败（MySQL的DDL会隐式提交，无法回滚）
+        """
+        results = []
+        cursor = self.connection.cursor()
+        try:
+            self._ensure_checksum_table(cursor)
+            for path in paths:
+                file_name = os.path.basename(path)
+                with open(path, 'rb') as f:
+                    raw = f.read()
+                checksum = hashlib.sha256(raw).hexdigest()
+                if not force and self._stored_checksum(cursor, file_name) == checksum:
+                    logger.info(f"{file_name} 未变化，跳过导入")
+                    results.append({"file": file_name, "status": "skipped", "statements": 0, "rows": 0,
+                                    "seconds": 0.0})
+                    continue
+                start = time.perf_counter()
+                statements, rows = self._load_text(cursor, file_name, raw.decode('utf-8-sig'))
+                self._record_checksum(cursor, file_name, checksum)
+                results.append({"file": file_name, "status": "imported", "statements": statements, "rows": rows,
+                                "seconds": round(time.perf_counter() - start, 3)})
+            self.connection.commit()
+            return results
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+def load_seed_files(connection, db_type: str, paths: Sequence[str], force: bool = False,
+                    progress: Optional[Callable[[dict], None]] = None) -> List[dict]:
+    """导入种子文件（见 SeedLoader.load_files）"""
+    return SeedLoader(connection, db_type, progress=progress).load_files(paths, force=force)
@@ -1,22 +1,74 @@
 import json
+import time
+import datetime
 from typing import Self
 import pandas as pd # type: ignore
 from .database_interaction import execute_query
-from .data_processing import generate_textual_summary, translate_column
-from ..data_to_image.visualization import plot_bar_chart, plot_line_chart, plot_pie_chart
+from .data_processing import generate_textual_summary, translate_column, summary_kind
+from .summary_pushdown import summarize_with_pushdown
+from .sql_validator import validate_sql
+from .index_advisor import get_query_workload
+from ..basic_function.schema_registry import get_schema_snapshot
+from ..basic_function.config import get_db_config, CHART_SPEC_MAX_POINTS, QUERY_PREVIEW_ROWS, SUMMARY_PUSHDOWN_ENABLED
+from ..nlp_to_sql.json_handler import append_json_line
+from ..data_to_image.visualization import build_bar_chart_spec, build_line_chart_spec, build_pie_chart_spec, to_client_spec
 import warnings
-import matplotlib.pyplot as plt # type: ignore
 warnings.filterwarnings("ignore", category=UserWarning, module="matplotlib")
 
 class SQLProcessor:
-    def __init__(self, sql_file_path='integration/sql/results.json'):
+    """
+    请求级的SQL处理流水线：执行SQL、生成摘要/图表/预览
+    通过 from_sql 直接传入SQL时不读写任何文件，可安全地并发处理多个请求
+    """
+    def __init__(self, sql_file_path='integration/sql/results.json', audit_path=None):
         self.sql_file_path = sql_file_path
-        self.df = None
+        self.audit_path = audit_path  # 可选的审计日志（JSON Lines）
+        self.sql_query = None
+        self.query_meta = {}
+        self._inline_sql = False
+        self.df = None  # 完整结果（可能因行数/字节上限被截断）
+        self.preview_df = None  # 第一阶段读取的预览结果
+        self.has_more = False  # 预览之外是否还有数据
+        self.truncated = False  # 完整结果是否被截断
+        self.total_rows = None  # 摘要下推时由数据库统计的总行数
+        self.validation_errors = []  # SQL本地校验错误（ValidationIssue）
+        self.query_metrics = []  # 每次执行的代价守卫决定
+        self.guard_rejection = None  # 被代价守卫拒绝时的决定
+        self._corrected_sql = None
         self.text_summary = ""
-        self.charts = {}
+        self.charts = {}  # 图表类型 -> 图表描述（普通数据，由渲染进程生成PNG）
         self.query_title = ""
+        # 共享的不可变结构快照（文件未变化时不读磁盘）
+        try:
+            self.schema = get_schema_snapshot()
+        except (OSError, ValueError) as e:
+            print(f"数据库结构加载失败: {e}")
+            self.schema = None
         
+    @classmethod
+    def from_sql(cls, sql_query, query_meta=None, audit_path=None):
+        """
+        由内存中的SQL创建处理器
+
+        Args:
+            sql_query: 生成的SQL
+            query_meta: 查询元数据（query_id、natural_language_query等）
+            audit_path: 审计日志路径，为None时不落盘
+
+        Returns:
+            SQLProcessor: 不依赖 results.json 的处理器
+        """
+        processor = cls(sql_file_path=None, audit_path=audit_path)
+        processor.sql_query = sql_query
+        processor.query_meta = dict(query_meta or {})
+        processor._inline_sql = True
+        return processor
+
     def load_sql(self):
+        if self._inline_sql:
+            print(f"加载SQL查询: {self.sql_query or '无SQL查询'}")
+            self.query_title = (self.query_meta.get('natural_language_query') or '医疗查询分析').replace('\n', ' ').strip()
+            return self.sql_query
         try:
             with open(self.sql_file_path, 'r', encoding='utf-8') as file:
                 data = json.load(file)
@@ -28,56 +80,146 @@ class SQLProcessor:
             return None
     
     def correct_table_name(self, sql_query):
-        # 所有表名映射到带库名的格式
-        replacements = {
-            'table_name': 'medical.medical_checkup',
-            'database_schema': 'medical.medical_checkup',
-            'medical.database_schema': 'medical.medical_checkup',
-            '`database_schema`': '`medical`.`medical_checkup`',
-            'medical.patient_records': 'medical.medical_checkup',
-            'patient_records': 'medical.medical_checkup',
-            'FROM medical.patient_records': 'FROM medical.medical_checkup',
-            'FROM patient_records': 'FROM medical.medical_checkup',
-            'patients': 'medical.patients',
-            'FROM patients': 'FROM medical.patients',
-            'patient_metrics': 'medical.patient_metrics',
-            'FROM patient_metrics': 'FROM medical.patient_metrics'
-        }
-    
-        corrected_sql = sql_query
-        for wrong, right in replacements.items():
-            corrected_sql = corrected_sql.replace(wrong, right)
-    
-        # 特殊处理：如果SQL中未指定库名，自动添加
-        tables_in_db = ['medical_checkup', 'patients', 'patient_metrics']
-        for table in tables_in_db:
-            if f'FROM {table}' in corrected_sql and f'FROM medical.{table}' not in corrected_sql:
-                corrected_sql = corrected_sql.replace(f'FROM {table}', f'FROM medical.{table}')
-    
-        return corrected_sql
-    
-    def execute_query(self, sql_query):
-        if not sql_query: # type: ignore
+        """
+        在本地校验并改写SQL：修正错误表名、补全库名，解析别名后检查表/列是否存在
+        未知标识符及非SELECT语句不会发送到数据库
+
+        返回:
+            改写后的SQL；校验失败时返回None，结构化错误见 self.validation_errors
+        """
+        self.validation_errors = []
+        if self.schema is None:
+            return sql_query
+        result = validate_sql(sql_query, self.schema, get_db_config('mysql')['database'])
+        if not result.ok:
+            self.validation_errors = list(result.issues)
+            print(f"SQL校验失败: {result.message}")
             return None
-        corrected_sql = self.correct_table_name(sql_query) # type: ignore
-        self.df = execute_query(corrected_sql, "mysql")
-        
-        if self.df is not None:
-            for col in self.df.columns:
-                if col in ['fasting_glucose', 'age', 'bmi']:
+        return result.sql
+
+    @property
+    def validation_message(self):
+        return "；".join(issue.message for issue in self.validation_errors)
+
+    @property
+    def rejection(self):
+        """SQL未通过本地校验或被代价守卫拒绝时的错误信息，未拒绝时为None"""
+        if self.validation_errors:
+            return {"error": f"SQL校验失败: {self.validation_message}",
+                    "validation_errors": [issue.to_dict() for issue in self.validation_errors]}
+        if self.guard_rejection:
+            return {"error": f"查询代价过高，已拒绝执行: {self.guard_rejection['reason']}",
+                    "query_guard": self.guard_rejection}
+        return None
+
+    def _run(self, stage, **kwargs):
+        """执行已修正的SQL，记录代价守卫的决定和执行耗时（供索引顾问分析）"""
+        start = time.perf_counter()
+        df = execute_query(self._corrected_sql, "mysql", **kwargs)
+        elapsed = time.perf_counter() - start
+        guard = df.attrs.get('guard') if df is not None else None
+        if guard:
+            self.query_metrics.append(dict(guard, stage=stage, elapsed_ms=round(elapsed * 1000, 3)))
+            if guard['action'] == 'reject':
+                self.guard_rejection = guard
+            elif guard['action'] != 'cached':
+                workload = get_query_workload()
+                if workload is not None:
+                    workload.record(self._corrected_sql, elapsed)
+        return self._coerce_numeric(df)
+
+    def _coerce_numeric(self, df):
+        if df is not None:
+            numeric_columns = self.schema.numeric_columns if self.schema else {'fasting_glucose', 'age', 'bmi'}
+            for col in df.columns:
+                if col in numeric_columns:
                     try:
-                        self.df[col] = pd.to_numeric(self.df[col], errors='ignore')
+                        df[col] = pd.to_numeric(df[col], errors='ignore')
                     except:
                         pass
+        return df
+
+    def execute_query(self, sql_query):
+        """一次性读取完整结果（受行数/字节上限约束）"""
+        if not sql_query: # type: ignore
+            return None
+        self._corrected_sql = self.correct_table_name(sql_query) # type: ignore
+        if self._corrected_sql is None:
+            return None
+        self.df = self._run('full')
+        self.truncated = bool(self.df.attrs.get('truncated')) if self.df is not None else False
+        self.preview_df = self.df
+        self.has_more = False
         return self.df
 
+    def execute_preview(self, sql_query, rows=QUERY_PREVIEW_ROWS):
+        """
+        第一阶段：LIMIT下推，只读取前rows行
+        结果不超过rows行时即为完整结果，无需第二阶段
+
+        返回:
+            预览DataFrame
+        """
+        if not sql_query: # type: ignore
+            return None
+        self._corrected_sql = self.correct_table_name(sql_query) # type: ignore
+        if self._corrected_sql is None:
+            return None
+        self.preview_df = self._run('preview', max_rows=rows)
+        self.has_more = self.preview_df is not None and bool(self.preview_df.attrs.get('truncated'))
+        if not self.has_more:
+            self.df = self.preview_df
+        return self.preview_df
+
+    def ensure_full_result(self):
+        """第二阶段：摘要/图表等需要全部数据时才读取剩余数据"""
+        if self.df is None and self.has_more and self._corrected_sql:
+            self.df = self._run('full')
+            self.truncated = self.df is not None and bool(self.df.attrs.get('truncated'))
+        return self.df
+
+    @property
+    def row_count(self):
+        """结果行数：已读取完整结果时为其行数，摘要下推时为数据库统计的总行数"""
+        if self.df is not None:
+            return len(self.df)
+        if self.total_rows is not None:
+            return self.total_rows
+        return 0 if self.preview_df is None else len(self.preview_df)
+
+    def _can_push_down_summary(self):
+        """结果超过预览行数且为通用结果时，摘要统计交给数据库计算"""
+        return (SUMMARY_PUSHDOWN_ENABLED and self.df is None and self.has_more and self._corrected_sql
+                and self.preview_df is not None and not self.preview_df.empty
+                and summary_kind(self.preview_df.columns) == 'generic')
+
     def generate_summary(self):
+        if self._can_push_down_summary():
+            result = summarize_with_pushdown(self._corrected_sql, self.preview_df, self.schema, "mysql")
+            if result is not None:
+                self.text_summary, self.total_rows = result
+                return self.text_summary
+        self.ensure_full_result()
         if self.df is not None and not self.df.empty:
             self.text_summary = generate_textual_summary(self.df)
             return self.text_summary
         return "无法生成摘要: 无数据或查询失败"
     
+    def _charts_need_full_result(self):
+        """
+        柱状图只在结果不超过20行时生成；结果超过预览行数（且预览不少于20行）时，
+        只有折线图/饼图需要完整数据
+        """
+        if self.df is not None or not self.has_more or self.preview_df is None or len(self.preview_df) < 20:
+            return True
+        columns = set(self.preview_df.columns)
+        return {'metric_value', 'checkup_date'}.issubset(columns) or {'gender', 'count'}.issubset(columns)
+
     def generate_charts(self):
+        if not self._charts_need_full_result():
+            self.charts = {}
+            return self.charts
+        self.ensure_full_result()
         if self.df is None or self.df.empty:
             self.charts = {}
             return self.charts
@@ -114,7 +256,7 @@ class SQLProcessor:
                     pass
             
             # 生成折线图
-            fig = plot_line_chart(
+            line_chart = build_line_chart_spec(
                 line_data.sort_values('checkup_date'),
                 x_column='checkup_date',
                 y_columns=['metric_value'],
@@ -122,11 +264,11 @@ class SQLProcessor:
                 xlabel='检查日期',  # 直接使用中文，不翻译
                 ylabel=metric_name  # 直接使用指标名称
             )
-            if fig:
-                self.charts['line'] = fig
+            if line_chart:
+                self.charts['line'] = line_chart
         # 饼图 - 添加饼图生成逻辑
         if {'gender', 'count'}.issubset(columns):
-            pie_chart = plot_pie_chart(
+            pie_chart = build_pie_chart_spec(
                 self.df, 
                 'gender', 
                 values='count',
@@ -154,7 +296,7 @@ class SQLProcessor:
             x_col = x_candidates[0]
             y_col = y_candidates[0]
         
-            bar_chart = plot_bar_chart(
+            bar_chart = build_bar_chart_spec(
                 self.df,
                 x_col,
                 [y_col],
@@ -166,25 +308,69 @@ class SQLProcessor:
                 self.charts['bar'] = bar_chart
 
         return self.charts  # 统一返回
+
+    def client_chart_specs(self, max_points=CHART_SPEC_MAX_POINTS):
+        """供浏览器直接渲染的图表描述（折线图已降采样），不在服务端绘图"""
+        return {chart_type: to_client_spec(spec, max_points) for chart_type, spec in self.charts.items() if spec}
     
+    def build_preview(self, rows=10):
+        """生成前rows行的数据预览（列名已翻译）"""
+        preview_data = []
+        source = self.preview_df if self.preview_df is not None else self.df
+        if source is not None and not source.empty:
+            preview_df = source.head(rows).copy()
+            preview_df.columns = [translate_column(col) for col in preview_df.columns]
+            for i in range(preview_df.shape[1]):
+                column = preview_df.iloc[:, i]
+                if pd.api.types.is_datetime64_any_dtype(column):
+                    # 列式读取的日期列为datetime64，转为字符串以便JSON序列化
+                    fmt = '%Y-%m-%d' if (column.dropna() == column.dropna().dt.normalize()).all() else '%Y-%m-%d %H:%M:%S'
+                    preview_df.isetitem(i, column.dt.strftime(fmt))
+            # NaN/NaT 不是合法JSON，统一替换为None
+            preview_df = preview_df.astype(object).where(preview_df.notna(), None)
+            preview_data = preview_df.to_dict(orient='records')
+        return preview_data
+
+    def audit(self, sql_query, status):
+        """将本次执行写入审计日志（未配置时跳过）"""
+        if not self.audit_path:
+            return
+        append_json_line({
+            "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+            "query_id": self.query_meta.get("query_id"),
+            "natural_language_query": self.query_meta.get("natural_language_query"),
+            "generated_sql": sql_query,
+            "status": status,
+            "row_count": self.row_count,
+            "query_metrics": self.query_metrics
+        }, self.audit_path)
+
     def process(self):
         sql_query = self.load_sql()
         if not sql_query:
+            self.audit(sql_query, "error")
             return {"status": "error", "message": "无可用SQL查询"}
         
-        self.execute_query(sql_query)
+        # 先读取预览，结果较多时摘要/图表再读取完整数据
+        self.execute_preview(sql_query)
+        rejection = self.rejection
+        if rejection:
+            self.audit(sql_query, "rejected")
+            details = {k: v for k, v in rejection.items() if k != 'error'}
+            return {"status": "error", "message": rejection['error'], **details}
         summary = self.generate_summary()
         self.generate_charts()
         
-        preview_data = []
-        if self.df is not None and not self.df.empty:
-            preview_df = self.df.head(10).copy()
-            preview_df.columns = [translate_column(col) for col in preview_df.columns]
-            preview_data = preview_df.to_dict(orient='records')
+        preview_data = self.build_preview()
+        self.audit(sql_query, "success")
         
         return {
             "status": "success",
+            "generated_sql": sql_query,
             "summary": summary,
             "charts": list(self.charts.keys()),
-            "dataframe": preview_data
+            "dataframe": preview_data,
+            "row_count": self.row_count,
+            "truncated": self.truncated,
+            "query_metrics": self.query_metrics
         }
@@ -0,0 +1,425 @@
+import difflib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict, field
+from typing import Dict, List, Optional, Tuple
+from sqlparse import tokens as T
+from sqlparse.lexer import Lexer
+from sqlparse.sql import Token
+
+# 模型常用的错误表名 -> 实际表名
+TABLE_ALIASES = {
+    'table_name': 'medical_checkup',
+    'database_schema': 'medical_checkup',
+    'patient_records': 'medical_checkup'
+}
+
+# 保留字及语法中的固定用词：sqlparse 还会把 data、user、level、date 等常见标识符识别为关键字，
+# 这些词以外的关键字出现在表名、列名位置时按标识符校验
+_RESERVED_WORDS = {
+    'ALL', 'AND', 'ANY', 'AS', 'ASC', 'BETWEEN', 'BINARY', 'BY', 'CASE', 'CAST', 'COLLATE', 'CROSS',
+    'CURRENT', 'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'CURRENT_USER', 'DEFAULT', 'DESC',
+    'DISTINCT', 'DISTINCTROW', 'DIV', 'DUAL', 'ELSE', 'END', 'ESCAPE', 'EXISTS', 'FALSE', 'FETCH', 'FIRST',
+    'FOLLOWING', 'FOR', 'FORCE', 'FROM', 'FULL', 'GROUP', 'HAVING', 'IGNORE', 'IN', 'INDEX', 'INNER', 'INTERVAL',
+    'IS', 'JOIN', 'KEY', 'LAST', 'LATERAL', 'LEFT', 'LIKE', 'LIMIT', 'LOCALTIME', 'LOCALTIMESTAMP', 'LOCK',
+    'MOD', 'NATURAL', 'NEXT', 'NOT', 'NULL', 'NULLS', 'OFFSET', 'ON', 'ONLY', 'OR', 'ORDER', 'OUTER', 'OVER',
+    'PARTITION', 'PRECEDING', 'RANGE', 'RECURSIVE', 'REGEXP', 'RIGHT', 'RLIKE', 'ROLLUP', 'ROW', 'ROWS',
+    'SELECT', 'SEPARATOR', 'SHARE', 'SOME', 'STRAIGHT_JOIN', 'THEN', 'TRUE', 'UNBOUNDED', 'UNION', 'UNKNOWN',
+    'UPDATE', 'USE', 'USING', 'WHEN', 'WHERE', 'WINDOW', 'WITH', 'XOR',
+    # 时间单位（INTERVAL 30 DAY、EXTRACT(YEAR FROM ...)）和 CAST/CONVERT 的目标类型
+    'MICROSECOND', 'SECOND', 'MINUTE', 'HOUR', 'DAY', 'WEEK', 'MONTH', 'QUARTER', 'YEAR',
+    'CHAR', 'DATETIME', 'DECIMAL', 'DOUBLE', 'FLOAT', 'INT', 'INTEGER', 'JSON', 'NCHAR', 'SIGNED', 'UNSIGNED',
+    'VARCHAR'
+}
+# 查询中不允许出现的关键字（SELECT ... INTO 会写文件或变量）
+_FORBIDDEN_KEYWORDS = {'INTO'}
+# 其后的名称不是列名（排序规则、窗口名、字符集）
+_NAME_AFTER_SKIP = {'COLLATE', 'OVER', 'WINDOW', 'USING', 'CHARACTER SET', 'CHARSET'}
+# 其后括号内是索引名（索引提示）
+_INDEX_HINT_KEYWORDS = {'INDEX', 'KEY'}
+# 校验结果缓存（结果不可变；键含结构摘要，结构变化后自然失效）
+_CACHE_SIZE = 256
+_cache: "OrderedDict[tuple, ValidationResult]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class ValidationIssue:
+    """结构化的校验错误"""
+    code: str  # empty / multiple_statements / not_select / unknown_database / unknown_table / unknown_alias / unknown_column
+    message: str
+    identifier: Optional[str] = None
+    suggestions: Tuple[str, ...] = ()
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(frozen=True)
+class ValidationResult:
+    """校验结果：通过时 sql 为改写后的查询（表名已带库名、错误表名已修正）"""
+    sql: str
+    issues: Tuple[ValidationIssue, ...] = ()
+    tables: Tuple[str, ...] = ()  # 查询用到的表（结构中的实际表名）
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    @property
+    def message(self) -> str:
+        return "；".join(issue.message for issue in self.issues)
+
+
+@dataclass
+class _TableRef:
+    qualifier: Optional[Token]
+    table: Token
+    alias: Optional[Token]
+
+
+@dataclass
+class _ColumnRef:
+    database: Optional[Token]
+    qualifier: Optional[Token]
+    column: Token
+
+
+@dataclass
+class _Level:
+    """一层括号（最外层为整条语句）"""
+    select: bool  # 是否为子查询
+    skip_names: bool = False  # 索引提示的括号
+    derived: bool = False  # FROM/JOIN 后的派生表
+    cte_body: bool = False  # WITH 中的公用表表达式
+    in_from: bool = False
+    expect_table: bool = False
+    expect_derived_alias: bool = False
+    expect_cte: bool = False
+    pending_cte_body: bool = False
+
+
+@dataclass
+class _References:
+    tables: List[_TableRef] = field(default_factory=list)
+    columns: List[_ColumnRef] = field(default_factory=list)
+    derived: List[str] = field(default_factory=list)  # 派生表别名和公用表表达式名（列不做校验）
+    output_aliases: List[str] = field(default_factory=list)
+
+
+def _unquote(name: str) -> str:
+    if len(name) >= 2 and (name[0], name[-1]) in (('`', '`'), ('"', '"'), ('[', ']')):
+        return name[1:-1]
+    return name
+
+
+def _is_name(tok: Optional[Token]) -> bool:
+    return tok is not None and tok.ttype is T.Name
+
+
+def _is_punct(tok: Optional[Token], value: str) -> bool:
+    return tok is not None and tok.ttype is T.Punctuation and tok.value == value
+
+
+def _is_keyword(tok: Optional[Token], *values: str) -> bool:
+    return tok is not None and tok.is_keyword and (not values or tok.normalized in values)
+
+
+def _tokenize(sql: str) -> List[Token]:
+    return [Token(ttype, value) for ttype, value in Lexer.get_default_instance().get_tokens(sql)]
+
+
+def _significant(tokens: List[Token]) -> List[Token]:
+    """
+    去掉空白和注释；被识别为关键字或内置名称、但不是保留字的单词（如 table_name、data、level、date）
+    改为按名称处理，与其他表名、列名一样校验和改写（原地修改，改写结果仍可由全部单元拼接得到）
+    """
+    result = []
+    for tok in tokens:
+        if tok.is_whitespace or tok.ttype in T.Comment:
+            continue
+        if tok.ttype in (T.Keyword, T.Name.Builtin) and tok.value.isidentifier() \
+                and tok.value.upper() not in _RESERVED_WORDS:
+            tok.ttype, tok.is_keyword, tok.normalized = T.Name, False, tok.value
+        result.append(tok)
+    return result
+
+
+def _collect(tokens: List[Token]) -> _References:
+    """
+    单遍扫描词法单元，收集表引用、列引用和别名定义
+
+    参数:
+        tokens: 去掉空白和注释后的词法单元
+    """
+    refs = _References()
+    n = len(tokens)
+
+    def at(k):
+        return tokens[k] if 0 <= k < n else None
+
+    stack = [_Level(select=True)]
+    i = 0
+    while i < n:
+        tok, level = tokens[i], stack[-1]
+        prev, nxt = at(i - 1), at(i + 1)
+
+        if _is_punct(tok, '('):
+            stack.append(_Level(
+                select=nxt is not None and nxt.ttype in (T.Keyword.DML, T.Keyword.CTE),
+                skip_names=_is_keyword(prev, *_INDEX_HINT_KEYWORDS),
+                derived=level.expect_table,
+                cte_body=level.pending_cte_body
+            ))
+            level.expect_table = level.pending_cte_body = False
+            i += 1
+            continue
+        if _is_punct(tok, ')'):
+            closed = stack.pop() if len(stack) > 1 else level
+            parent = stack[-1]
+            if closed.derived:
+                parent.expect_derived_alias = True
+            if closed.cte_body and _is_punct(nxt, ','):
+                parent.expect_cte = True
+                i += 2
+                continue
+            i += 1
+            continue
+        if _is_punct(tok, ','):
+            level.expect_table = level.in_from
+            i += 1
+            continue
+
+        if tok.ttype is T.Keyword.CTE:
+            level.expect_cte = True
+        elif tok.is_keyword:
+            word = tok.normalized
+            if word == 'FROM' and level.select:
+                level.in_from = level.expect_table = True
+            elif word.endswith('JOIN') and level.select:
+                level.in_from = level.expect_table = True
+            elif word not in ('AS', 'RECURSIVE', 'LATERAL') and level.select:
+                level.in_from = level.expect_table = level.expect_derived_alias = False
+        if not _is_name(tok) or level.skip_names:
+            i += 1
+            continue
+
+        if level.expect_cte:
+            # WITH name [(col, ...)] AS (...)
+            refs.derived.append(_unquote(tok.value))
+            level.expect_cte = False
+            j = i + 1
+            if _is_punct(at(j), '('):
+                j += 1
+                while j < n and not _is_punct(tokens[j], ')'):
+                    if _is_name(tokens[j]):
+                        refs.output_aliases.append(_unquote(tokens[j].value))
+                    j += 1
+                j += 1
+            if _is_keyword(at(j), 'AS'):
+                j += 1
+            level.pending_cte_body = True
+            i = j
+            continue
+
+        if level.expect_table:
+            if _is_punct(nxt, '.') and _is_name(at(i + 2)):
+                qualifier, table, j = tok, tokens[i + 2], i + 3
+            else:
+                qualifier, table, j = None, tok, i + 1
+            alias = None
+            if _is_keyword(at(j), 'AS') and _is_name(at(j + 1)):
+                alias, j = tokens[j + 1], j + 2
+            elif _is_name(at(j)):
+                alias, j = tokens[j], j + 1
+            refs.tables.append(_TableRef(qualifier, table, alias))
+            level.expect_table = False
+            i = j
+            continue
+
+        if level.expect_derived_alias:
+            refs.derived.append(_unquote(tok.value))
+            level.expect_derived_alias = False
+        elif _is_punct(nxt, '('):
+            pass  # 函数名
+        elif _is_punct(nxt, '.'):
+            third = at(i + 2)
+            if _is_name(third) and _is_punct(at(i + 3), '.') and at(i + 4) is not None:
+                refs.columns.append(_ColumnRef(tok, third, tokens[i + 4]))
+                i += 5
+                continue
+            if third is not None and (_is_name(third) or third.ttype is T.Wildcard):
+                refs.columns.append(_ColumnRef(None, tok, third))
+                i += 3
+                continue
+        elif _is_keyword(prev, 'AS'):
+            if level.select:
+                refs.output_aliases.append(_unquote(tok.value))
+        elif _is_keyword(prev, *_NAME_AFTER_SKIP):
+            pass
+        elif level.select and prev is not None and (
+                _is_punct(prev, ')') or _is_name(prev) or prev.ttype in T.Literal or _is_keyword(prev, 'END')):
+            # 省略AS的列别名：SELECT COUNT(*) cnt
+            refs.output_aliases.append(_unquote(tok.value))
+        else:
+            refs.columns.append(_ColumnRef(None, None, tok))
+        i += 1
+    return refs
+
+
+def _rename(tok: Token, name: str, database: Optional[str] = None):
+    """改写表名单元，保留原引号风格"""
+    quoted = tok.value.startswith('`')
+    parts = [database, name] if database else [name]
+    tok.value = '.'.join(f"`{p}`" if quoted else p for p in parts)
+
+
+def _suggest(name: str, candidates) -> Tuple[str, ...]:
+    return tuple(difflib.get_close_matches(name, list(candidates), n=3, cutoff=0.6))
+
+
+def referenced_tables(sql: str) -> Dict[str, str]:
+    """
+    查询中引用的表（不校验是否存在）
+
+    返回:
+        表名或别名（小写） -> 表名（不含库名）
+    """
+    tokens = _significant(_tokenize(sql or ''))
+    result = {}
+    for ref in _collect(tokens).tables:
+        table = _unquote(ref.table.value)
+        result[table.lower()] = table
+        if ref.alias is not None:
+            result[_unquote(ref.alias.value).lower()] = table
+    return result
+
+
+def validate_sql(sql: str, schema, database: Optional[str] = None) -> ValidationResult:
+    """
+    在本地校验并改写生成的SQL，不访问数据库
+
+    只接受单条 SELECT（可带 WITH）语句；表名按结构修正并加上库名，
+    表别名、派生表和列别名解析后逐一检查列引用
+
+    参数:
+        sql: 生成的SQL
+        schema: 数据库结构快照（SchemaSnapshot）
+        database: 需要补全的库名，为None时不加库名
+
+    返回:
+        ValidationResult: issues 为空时 sql 为改写后的查询
+    """
+    key = (sql, schema.schema_hash, database)
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+            return result
+    result = _validate(sql, schema, database)
+    with _cache_lock:
+        _cache[key] = result
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def _validate(sql: str, schema, database: Optional[str]) -> ValidationResult:
+    if not sql or not sql.strip():
+        return ValidationResult(sql or "", (ValidationIssue('empty', "SQL为空"),))
+
+    all_tokens = _tokenize(sql)
+    tokens = _significant(all_tokens)
+
+    # 语句检查
+    depth = 0
+    for k, tok in enumerate(tokens):
+        if _is_punct(tok, '('):
+            depth += 1
+        elif _is_punct(tok, ')'):
+            depth -= 1
+        elif _is_punct(tok, ';') and depth == 0 and any(not _is_punct(t, ';') for t in tokens[k + 1:]):
+            return ValidationResult(sql, (ValidationIssue('multiple_statements', "只允许执行单条查询语句"),))
+    first = tokens[0] if tokens else None
+    if first is None or first.ttype not in (T.Keyword.DML, T.Keyword.CTE) or first.normalized not in ('SELECT', 'WITH'):
+        return ValidationResult(sql, (ValidationIssue('not_select', "只允许执行SELECT查询",
+                                                      first.value if first is not None else None),))
+    for tok in tokens:
+        if (tok.ttype is T.Keyword.DML and tok.normalized != 'SELECT') or tok.ttype is T.Keyword.DDL \
+                or _is_keyword(tok, *_FORBIDDEN_KEYWORDS):
+            return ValidationResult(sql, (ValidationIssue('not_select', f"查询中不允许出现 {tok.value}", tok.value),))
+
+    refs = _collect(tokens)
+    issues: List[ValidationIssue] = []
+    tables_by_key = {t.name.lower(): t for t in schema.tables}
+    derived = {name.lower() for name in refs.derived}
+    database_key = database.lower() if database else None
+
+    # 表引用：修正表名、补全库名，记录可用于限定列的名称
+    qualifiers: Dict[str, Optional[object]] = {name: None for name in derived}
+    renamed: Dict[str, str] = {}
+    used = []
+    for ref in refs.tables:
+        raw = _unquote(ref.table.value)
+        key = raw.lower()
+        alias = _unquote(ref.alias.value).lower() if ref.alias is not None else None
+        if ref.qualifier is None and key in derived:
+            if alias:
+                qualifiers[alias] = None
+            continue
+        if ref.qualifier is not None and database_key and _unquote(ref.qualifier.value).lower() != database_key:
+            issues.append(ValidationIssue('unknown_database', f"不允许访问库 {_unquote(ref.qualifier.value)}",
+                                          _unquote(ref.qualifier.value), (database,)))
+            continue
+        table = tables_by_key.get(key) or tables_by_key.get(TABLE_ALIASES.get(key, ''))
+        if table is None:
+            issues.append(ValidationIssue('unknown_table', f"数据库中不存在表 {raw}", raw,
+                                          _suggest(raw, tables_by_key) or tuple(tables_by_key)))
+            continue
+        if table.name not in used:
+            used.append(table.name)
+        if ref.qualifier is None:
+            _rename(ref.table, table.name, database)
+        elif raw != table.name:
+            _rename(ref.table, table.name)
+        if alias:
+            qualifiers[alias] = table
+        else:
+            qualifiers[key] = qualifiers[table.name.lower()] = table
+            if raw != table.name:
+                renamed[key] = table.name
+
+    # 列引用
+    scope = [tables_by_key[name.lower()] for name in used]
+    known_columns = {c.name.lower() for t in scope for c in t.columns}
+    output_aliases = {name.lower() for name in refs.output_aliases}
+    table_failed = bool(issues)
+    for ref in refs.columns:
+        column = _unquote(ref.column.value)
+        if ref.database is not None:
+            if database_key and _unquote(ref.database.value).lower() != database_key:
+                issues.append(ValidationIssue('unknown_database', f"不允许访问库 {_unquote(ref.database.value)}",
+                                              _unquote(ref.database.value), (database,)))
+                continue
+        if ref.qualifier is not None:
+            name = _unquote(ref.qualifier.value)
+            key = name.lower()
+            if key not in qualifiers:
+                if not table_failed:
+                    issues.append(ValidationIssue('unknown_alias', f"未知的表或别名 {name}", name,
+                                                  _suggest(key, qualifiers)))
+                continue
+            if key in renamed:
+                _rename(ref.qualifier, renamed[key])
+            table = qualifiers[key]
+            if table is None or ref.column.ttype is T.Wildcard:
+                continue
+            if table.column(column) is None and column.lower() not in {c.lower() for c in table.column_names}:
+                issues.append(ValidationIssue('unknown_column', f"表 {table.name} 中不存在列 {column}",
+                                              f"{name}.{column}", _suggest(column, table.column_names)))
+        elif not table_failed and column.lower() not in known_columns and column.lower() not in output_aliases:
+            candidates = [c.name for t in scope for c in t.columns] + refs.output_aliases
+            issues.append(ValidationIssue('unknown_column', f"查询的表中不存在列 {column}", column,
+                                          _suggest(column, candidates)))
+
+    return ValidationResult(''.join(t.value for t in all_tokens), tuple(issues), tuple(used))
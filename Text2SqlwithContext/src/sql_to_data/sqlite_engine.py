@@ -0,0 +1,266 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Optional, Tuple
+from urllib.parse import quote
+from ..basic_function.config import (
+    get_db_config, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_STATEMENT_CACHE,
+    SQLITE_IN_MEMORY, SQLITE_REPLICA_CHECK_INTERVAL, SQLITE_POOL_SIZE, SQLITE_ENABLE_WAL,
+    DB_POOL_ACQUIRE_TIMEOUT
+)
+from .connection_pool import PoolTimeout
+
+logger = logging.getLogger(__name__)
+
+
+def sqlite_file_version(path: str) -> Optional[tuple]:
+    """
+    数据库文件的版本标识：WAL模式下提交先写入 -wal 文件，主文件的修改时间在检查点前不变，
+    因此同时计入 -wal 文件的修改时间和大小
+
+    返回:
+        版本元组，文件不存在时返回None
+    """
+    try:
+        main = os.stat(path)
+    except OSError:
+        return None
+    try:
+        wal = os.stat(f"{path}-wal")
+        wal_version = (wal.st_mtime_ns, wal.st_size)
+    except OSError:
+        wal_version = None
+    return (main.st_mtime_ns, main.st_size, wal_version)
+
+
+class SQLiteEngine:
+    """
+    SQLite只读查询引擎
+    只读连接（query_only + mmap + 较大的页缓存 + 预编译语句缓存）保存在最多 pool_size 个的连接池中，
+    各请求线程后进先出地复用，不再为每次查询（或每个请求线程）新建连接；
+    可选将数据库整体载入共享内存副本，源文件变化后自动重新载入
+    """
+
+    def __init__(self, path: str, mmap_size: int = SQLITE_MMAP_SIZE, cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+                 statement_cache: int = SQLITE_STATEMENT_CACHE, in_memory: bool = SQLITE_IN_MEMORY,
+                 check_interval: float = SQLITE_REPLICA_CHECK_INTERVAL, pool_size: int = SQLITE_POOL_SIZE,
+                 acquire_timeout: float = DB_POOL_ACQUIRE_TIMEOUT, enable_wal: bool = SQLITE_ENABLE_WAL):
+        """
+        参数:
+            path: 数据库文件路径
+            mmap_size: 内存映射读取的字节数
+            cache_size_kb: 每个连接的页缓存大小（KiB）
+            statement_cache: 每个连接缓存的预编译语句数
+            in_memory: 是否使用内存副本
+            check_interval: 内存副本检查源文件变化的间隔（秒），0表示不检查
+            pool_size: 最大连接数，连接耗尽时排队等待
+            acquire_timeout: 获取连接的默认等待时间（秒）
+            enable_wal: 是否将数据库文件切换为WAL模式（持久修改文件，只读介质上自动跳过）
+        """
+        self.path = os.path.abspath(path)
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.statement_cache = statement_cache
+        self.in_memory = in_memory
+        self.check_interval = check_interval
+        self.pool_size = max(1, pool_size)
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._idle: Deque[Tuple[sqlite3.Connection, int]] = deque()  # (连接, 副本代数)
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._generation = 0  # 内存副本每次重新载入后递增，旧代数的连接在取出时关闭重建
+        self._replica_uri: Optional[str] = None
+        self._replica_holder: Optional[sqlite3.Connection] = None
+        self._source_version: Optional[tuple] = None
+        self._last_check = 0.0
+        self.stats = {"acquisitions": 0, "waits": 0, "timeouts": 0, "connections_opened": 0, "connections_closed": 0,
+                      "replica_loads": 0, "replica_load_seconds": 0.0}
+        if in_memory:
+            self.load_replica()
+        elif enable_wal:
+            self._enable_wal()
+
+    def _file_uri(self) -> str:
+        return f"file:{quote(self.path)}?mode=ro"
+
+    def _enable_wal(self):
+        """切换为WAL日志模式（写入时不阻塞读取），该设置保存在数据库文件中"""
+        if not os.path.exists(self.path):
+            logger.warning(f"SQLite数据库文件不存在: {self.path}")
+            return
+        # WAL需要修改数据库文件并在同一目录下创建 -wal/-shm 文件
+        if not (os.access(self.path, os.W_OK) and os.access(os.path.dirname(self.path), os.W_OK)):
+            logger.info(f"SQLite数据库文件或目录不可写，保持原日志模式: {self.path}")
+            return
+        try:
+            conn = sqlite3.connect(self.path)
+            try:
+                mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            finally:
+                conn.close()
+            if str(mode).lower() != 'wal':
+                logger.info(f"SQLite未能切换为WAL模式，当前为 {mode}")
+        except sqlite3.Error as err:
+            # 只读文件系统等情况下保持原日志模式
+            logger.info(f"SQLite未能切换为WAL模式: {err}")
+
+    def load_replica(self):
+        """将数据库文件整体复制到共享内存数据库，之后的查询不再读磁盘"""
+        with self._reload_lock:
+            start = time.perf_counter()
+            version = sqlite_file_version(self.path)
+            generation = self._generation + 1
+            uri = f"file:text2sql_replica_{id(self)}_{generation}?mode=memory&cache=shared"
+            # 内存数据库在最后一个连接关闭时释放，由holder保持
+            holder = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            source = sqlite3.connect(self._file_uri(), uri=True)
+            try:
+                source.backup(holder)
+            finally:
+                source.close()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                old_holder = self._replica_holder
+                self._replica_holder = holder
+                self._replica_uri = uri
+                self._source_version = version
+                self._generation = generation
+                self._last_check = time.monotonic()
+                self.stats["replica_loads"] += 1
+                self.stats["replica_load_seconds"] += elapsed
+            if old_holder is not None:
+                # 仍在使用旧副本的线程在下次获取连接时切换
+                old_holder.close()
+            logger.info(f"SQLite内存副本载入完成，用时 {elapsed:.3f} 秒")
+
+    def _maybe_reload(self):
+        """源文件修改后重新载入内存副本（按间隔检查）"""
+        if not self.in_memory or not self.check_interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return
+            self._last_check = now
+        version = sqlite_file_version(self.path)
+        if version is not None and version != self._source_version:
+            try:
+                self.load_replica()
+            except sqlite3.Error as err:
+                logger.error(f"SQLite内存副本重新载入失败，继续使用旧副本: {err}")
+
+    def _open(self) -> sqlite3.Connection:
+        uri = self._replica_uri if self.in_memory else self._file_uri()
+        # 连接在池中被不同请求线程轮流使用（同一时刻只被一个线程持有）
+        conn = sqlite3.connect(uri, uri=True, cached_statements=self.statement_cache, check_same_thread=False)
+        if not self.in_memory:
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            conn.execute(f"PRAGMA cache_size={-int(self.cache_size_kb)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA query_only=1")
+        with self._lock:
+            self.stats["connections_opened"] += 1
+        return conn
+
+    def _close_conn(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error as err:
+            logger.debug(f"关闭SQLite连接出错: {err}")
+        with self._lock:
+            self.stats["connections_closed"] += 1
+
+    def _take(self) -> Tuple[sqlite3.Connection, int]:
+        """取出最近归还的空闲连接，内存副本已重新载入时关闭旧连接并新建"""
+        with self._lock:
+            entry = self._idle.pop() if self._idle else None
+            generation = self._generation
+        if entry is not None and entry[1] == generation:
+            return entry
+        if entry is not None:
+            self._close_conn(entry[0])
+        return self._open(), generation
+
+    @contextmanager
+    def connection(self, timeout: Optional[float] = None):
+        """
+        从连接池获取只读连接（与 ConnectionPool.connection 接口一致），退出时归还而不关闭
+
+        参数:
+            timeout: 连接耗尽时最长等待时间（秒），缺省为 acquire_timeout
+
+        Raises:
+            PoolTimeout: 等待超时
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        self._maybe_reload()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["waits"] += 1
+            if not self._slots.acquire(timeout=timeout):
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                raise PoolTimeout(f"{timeout:.1f}秒内未获取到sqlite连接（最大连接数 {self.pool_size}）")
+        try:
+            conn, generation = self._take()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.stats["acquisitions"] += 1
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                reusable = generation == self._generation
+                if reusable:
+                    self._idle.append((conn, generation))
+            if not reusable:
+                self._close_conn(conn)
+            self._slots.release()
+
+    def close(self):
+        """释放内存副本并关闭空闲连接；正在使用的连接在归还时关闭"""
+        with self._lock:
+            holder = self._replica_holder
+            self._replica_holder = None
+            self._generation += 1
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close_conn(conn)
+        if holder is not None:
+            holder.close()
+
+    def get_stats(self) -> dict:
+        """引擎统计"""
+        with self._lock:
+            return dict(self.stats, db_type='sqlite', path=self.path, in_memory=self.in_memory,
+                        generation=self._generation, pool_size=self.pool_size, idle=len(self._idle),
+                        mmap_size=self.mmap_size,
+                        cache_size_kb=self.cache_size_kb, statement_cache=self.statement_cache)
+
+
+# 全局SQLite引擎
+_engine: Optional[SQLiteEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_sqlite_engine() -> SQLiteEngine:
+    """获取（首次调用时创建）配置中SQLite数据库的查询引擎"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = SQLiteEngine(get_db_config('sqlite')['database'])
+    return _engine
+
+
+def get_sqlite_stats() -> Optional[dict]:
+    """SQLite引擎统计，未创建时返回None"""
+    return _engine.get_stats() if _engine is not None else None
@@ -0,0 +1,137 @@
+import logging
+from typing import List, Optional, Sequence, Tuple
+import pandas as pd # type: ignore
+from .database_interaction import execute_query
+from .data_processing import (
+    ID_COLS, is_category_column, non_null_unique, summarize_numeric_column,
+    summarize_category_column, compose_generic_summary
+)
+
+logger = logging.getLogger(__name__)
+
+# 各数据库的标识符引号
+_QUOTES = {
+    'mysql': ('`', '`'),
+    'postgresql': ('"', '"'),
+    'sqlite': ('"', '"'),
+    'sqlserver': ('[', ']')
+}
+
+
+def quote_identifier(name: str, db_type: str = 'mysql') -> str:
+    """按数据库方言引用列名"""
+    left, right = _QUOTES.get(db_type, ('"', '"'))
+    return f"{left}{str(name).replace(right, right * 2)}{right}"
+
+
+def _derived_table(sql: str) -> str:
+    return sql.strip().rstrip(';').strip()
+
+
+def classify_columns(preview_df: pd.DataFrame, schema=None) -> Tuple[List[str], List[str]]:
+    """
+    确定结果列中需要数值统计和分类统计的列
+
+    列类型取自 db_schema.json；不在结构中的列（别名、计算列）按预览数据的类型判断。
+    日期列与 generate_textual_summary 一致按分类列统计（COUNT DISTINCT）
+
+    返回:
+        (数值列, 分类列)
+    """
+    known = schema.columns_by_name if schema is not None else {}
+    numeric, categorical = [], []
+    for col in preview_df.columns:
+        if col in ID_COLS:
+            if col == 'patient_name':
+                categorical.append(col)
+            continue
+        info = known.get(col)
+        if info is not None:
+            if info.is_numeric:
+                numeric.append(col)
+            else:
+                categorical.append(col)
+        elif pd.api.types.is_numeric_dtype(preview_df[col]):
+            numeric.append(col)
+        elif is_category_column(preview_df[col]):
+            categorical.append(col)
+    return numeric, categorical
+
+
+def build_aggregate_query(sql: str, numeric: Sequence[str], categorical: Sequence[str],
+                          db_type: str = 'mysql') -> str:
+    """
+    将原SQL作为派生表，一次查询得到行数及各列的统计值
+
+    参数:
+        sql: 原查询
+        numeric: 数值列（COUNT/AVG/MIN/MAX）
+        categorical: 分类列（COUNT DISTINCT）
+        db_type: 数据库类型
+
+    返回:
+        只返回一行的聚合SQL
+    """
+    select = ["COUNT(*) AS row_count"]
+    for i, col in enumerate(numeric):
+        column = quote_identifier(col, db_type)
+        # SQL Server 对整数列的AVG做整数除法
+        avg_arg = f"CAST({column} AS FLOAT)" if db_type == 'sqlserver' else column
+        select += [f"COUNT({column}) AS n{i}_count", f"AVG({avg_arg}) AS n{i}_avg",
+                   f"MIN({column}) AS n{i}_min", f"MAX({column}) AS n{i}_max"]
+    for i, col in enumerate(categorical):
+        select.append(f"COUNT(DISTINCT {quote_identifier(col, db_type)}) AS c{i}_distinct")
+    return f"SELECT {', '.join(select)} FROM ({_derived_table(sql)}) AS _summary"
+
+
+def _distinct_values(sql: str, col: str, limit: int, db_type: str) -> list:
+    """读取某列不超过limit个非空唯一值（预览中未出现全部取值时使用）"""
+    column = quote_identifier(col, db_type)
+    df = execute_query(f"SELECT DISTINCT {column} FROM ({_derived_table(sql)}) AS _summary "
+                       f"WHERE {column} IS NOT NULL", db_type, max_rows=limit)
+    if df is None or df.empty:
+        return []
+    # 与预览中的取值同样规整（日期统一为date/datetime对象），便于去重
+    return list(non_null_unique(df.iloc[:, 0]))
+
+
+def summarize_with_pushdown(sql: str, preview_df: pd.DataFrame, schema=None,
+                            db_type: str = 'mysql') -> Optional[Tuple[str, int]]:
+    """
+    由数据库计算摘要所需的统计值，只使用预览行补充分类取值和示例
+
+    参数:
+        sql: 已修正的原查询
+        preview_df: 第一阶段读取的预览结果（原结果的前若干行）
+        schema: 数据库结构快照
+        db_type: 数据库类型
+
+    返回:
+        (摘要文本, 结果总行数)，聚合查询失败时返回None，由调用方回退到读取完整结果
+    """
+    numeric, categorical = classify_columns(preview_df, schema)
+    agg_df = execute_query(build_aggregate_query(sql, numeric, categorical, db_type), db_type)
+    if agg_df is None or agg_df.empty:
+        logger.warning("摘要聚合查询失败，回退到读取完整结果")
+        return None
+    row = agg_df.iloc[0]
+    row_count = int(row['row_count'])
+
+    num_summary = []
+    for i, col in enumerate(numeric):
+        if pd.isna(row[f'n{i}_count']) or row[f'n{i}_count'] == 0:
+            continue
+        num_summary.append(summarize_numeric_column(col, float(row[f'n{i}_avg']), row[f'n{i}_min'], row[f'n{i}_max']))
+
+    cat_summary = []
+    for i, col in enumerate(categorical):
+        distinct = int(row[f'c{i}_distinct'])
+        # 预览是结果的前缀，其中的取值顺序即完整结果中的首次出现顺序
+        unique_vals = list(non_null_unique(preview_df[col]))
+        limit = 10 if col == 'patient_name' else 5
+        if len(unique_vals) < distinct <= limit:
+            unique_vals += [v for v in _distinct_values(sql, col, limit, db_type) if v not in unique_vals]
+        samples = preview_df[col].dropna().head(20).tolist() if col == 'doctor_advice' else ()
+        cat_summary.extend(summarize_category_column(col, distinct, unique_vals, samples))
+
+    return compose_generic_summary(row_count, num_summary, cat_summary), row_count
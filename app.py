@@ -1,19 +1,32 @@
 import sys
 import os
+import json
+import multiprocessing
 from pathlib import Path
 from dotenv import load_dotenv
-import matplotlib.pyplot as plt  # type: ignore
 import matplotlib  # type: ignore
 matplotlib.use('Agg')
 import pandas as pd  # type: ignore
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from Text2SqlwithContext.src.basic_function.set_env import update_env_vars
 from Text2SqlwithContext.src.sql_to_data.sql_processor import SQLProcessor
-from Text2SqlwithContext.src.nlp_to_sql.json_handler import read_json, write_json
 from Text2SqlwithContext.src.nlp_to_sql.sql_generator import generate_sql_from_nl
+from Text2SqlwithContext.src.nlp_to_sql.llm_client import stream_llm_model
 from Text2SqlwithContext.src.nlp_to_sql.context_manager import ContextualConversation
+from Text2SqlwithContext.src.nlp_to_sql.schema_linker import link_schema, get_schema_linker
+from Text2SqlwithContext.src.basic_function.schema_registry import get_schema_snapshot
+from Text2SqlwithContext.src.basic_function.config import SQL_AUDIT_PATH, CHART_CACHE_MAX_AGE, CHART_RESPONSE_MODE, get_db_config
+from Text2SqlwithContext.src.data_to_image.chart_renderer import get_chart_renderer
+from Text2SqlwithContext.src.data_to_image.chart_store import get_chart_store, is_chart_id
 from flask_cors import CORS
-from Text2SqlwithContext.src.sql_to_data.database_interaction import init_connection_pool
+from Text2SqlwithContext.src.sql_to_data.database_interaction import init_connection_pool, invalidate_result_cache, get_pool_stats
+from Text2SqlwithContext.src.sql_to_data.result_cache import get_result_cache_stats
+from Text2SqlwithContext.src.sql_to_data.query_guard import get_guard_stats
+from Text2SqlwithContext.src.sql_to_data.index_advisor import (
+    get_query_workload, recommend_indexes, existing_indexes, apply_indexes
+)
+from Text2SqlwithContext.src.sql_to_data.seed_loader import load_seed_files, SeedImportError
+from Text2SqlwithContext.src.nlp_to_sql.llm_cache import get_llm_cache_stats
 import mysql.connector  # type: ignore
 
 
@@ -33,113 +46,147 @@ def serve_static_files(filename):
     else:
         return '', 404
 
-context_manager = ContextualConversation()
+# 图表渲染进程以spawn方式启动，会以 __mp_main__ 重新执行本模块的顶层代码：
+# 会话存储（journal存储启动时会恢复并截断日志）、模式链接索引和渲染进程池只在主进程中创建
+IS_RENDER_WORKER = multiprocessing.parent_process() is not None
+
+context_manager = ContextualConversation() if not IS_RENDER_WORKER else None
 session_id = "user_session"
 
 def get_project_root():
     return Path(__file__).resolve().parent
 
-def run_sql_processor_and_collect_message(sql_file_path):
+if not IS_RENDER_WORKER:
+    # 启动时解析数据库结构并建立模式链接索引
+    try:
+        get_schema_linker(get_schema_snapshot())
+    except Exception as e:
+        print(f"模式链接索引初始化失败: {e}", file=sys.stderr)
+
+    # 启动并预热图表渲染进程池
+    get_chart_renderer()
+
+# 字段名中英文映射
+COLUMN_NAME_MAP = {
+    "abnormal_glucose_count": "异常血糖次数",
+    "patient_names": "患者姓名",
+    "count":"人数",
+    "percentage":"比例"
+    # 可以继续添加更多字段映射
+}
+
+def build_table_data(preview_records):
+    """将预览记录转换为前端表格数据（中文列名和中文key的rows）"""
+    if not preview_records:
+        return {'columns': [], 'rows': []}
+    preview_df = pd.DataFrame(preview_records)
+    # 只取前10行
+    preview_df = preview_df.head(10)
+    # 转为dict列表
+    table_data = preview_df.to_dict(orient='records')
+    table_columns = list(preview_df.columns)
+    # 字段名翻译
+    table_columns_cn = [COLUMN_NAME_MAP.get(col, col) for col in table_columns]
+    # rows字段的key也映射为中文
+    table_data_cn = [
+        {COLUMN_NAME_MAP.get(k, k): v for k, v in row.items()} for row in table_data
+    ]
+    return {'columns': table_columns_cn, 'rows': table_data_cn}
+
+def save_charts(charts):
+    """将图表存入内容寻址的图表存储并返回图表URL（相同图表只渲染一次）"""
+    chart_ids = get_chart_store().store_charts(charts)
+    return {chart_type: f"/api/chart/{chart_id}" for chart_type, chart_id in chart_ids.items()}
+
+def resolve_chart_mode(data):
+    """请求中的图表返回模式：png（服务端渲染）或 spec（浏览器渲染）"""
+    mode = (data.get('chart_mode') or CHART_RESPONSE_MODE or 'png').lower()
+    return mode if mode in ('png', 'spec') else 'png'
+
+def build_chart_payload(processor, chart_mode):
+    """
+    生成图表返回内容
+
+    返回:
+        (chart_urls, chart_specs)：spec模式下只登记图表描述，图片URL在下载时才按需渲染
+    """
+    if not processor.charts:
+        return {}, {}
+    if chart_mode == 'spec':
+        chart_ids = get_chart_store().register_specs(processor.charts)
+        chart_urls = {chart_type: f"/api/chart/{chart_id}" for chart_type, chart_id in chart_ids.items()}
+        return chart_urls, processor.client_chart_specs()
+    return save_charts(processor.charts), {}
+
+def build_result_message(summary, has_charts, has_rows, truncated=False, row_count=0):
+    """组装返回给前端的分析说明文本"""
+    messages = ["开始执行SQL并分析结果...", "医疗数据分析摘要:", str(summary)]
+    if truncated:
+        messages.append(f"\n查询结果超过读取上限，以上分析仅基于前{row_count}行数据")
+    messages.append("\n已生成相应的数据可视化图表\n" if has_charts else "\n未生成任何图表\n")
+    messages.append("已生成数据预览 ")
+    if not has_rows:
+        messages.append("无数据可显示")
+    messages.append("\n分析完成!")
+    return '\n'.join(messages)
+
+def run_sql_processor_and_collect_message(generated_sql, query_meta=None, chart_mode='png'):
     messages = []
     messages.append("开始执行SQL并分析结果...")
 
-    import json
-    with open(sql_file_path, "r", encoding="utf-8") as f:
-        sql_json = json.load(f)
-    generated_sql = sql_json.get("generated_sql", "")
     if isinstance(generated_sql, str) and generated_sql.strip().startswith("生成错误"):
         error_msg = f"加载SQL查询: {generated_sql}"
         print(error_msg, file=sys.stderr)
-        return '', '', {}, error_msg, []
+        return '', '', {}, error_msg, [], {}, {}
 
-    processor = SQLProcessor(sql_file_path)
+    # 请求级流水线，SQL直接在内存中传递
+    processor = SQLProcessor.from_sql(generated_sql, query_meta, audit_path=SQL_AUDIT_PATH or None)
     result = processor.process()
     if result['status'] == 'error':
         messages.append(f"处理失败: {result['message']}")
         if 'sql_error' in result:
             print(f"SQL执行错误: {result['sql_error']}", file=sys.stderr)
-        return '', '\n'.join(messages), {}, result['message'], []
-    messages.append("医疗数据分析摘要:")
-    messages.append(str(result['summary']))
-    chart_urls = {}
-    if processor.charts:
-        messages.append("\n已生成相应的数据可视化图表\n")
-        output_dir = Path(__file__).parent / "Text2SqlwithContext" / "integration" / "output"
-        os.makedirs(output_dir, exist_ok=True)
-        for chart_type, fig in processor.charts.items():
-            if fig:
-                plt.figure(fig.number)
-                chart_path = output_dir / f"{chart_type}_chart.png"
-                plt.savefig(str(chart_path))
-                plt.close()
-                chart_urls[chart_type] = f"/api/chart/{chart_type}_chart.png"
-    else:
-        messages.append("\n未生成任何图表\n")
-    
-    messages.append("已生成数据预览 ")
-    table_data = []
-    # 字段名中英文映射
-    column_name_map = {
-        "abnormal_glucose_count": "异常血糖次数",
-        "patient_names": "患者姓名",
-        "count":"人数",
-        "percentage":"比例"
-        # 可以继续添加更多字段映射
-    }
-    if result['dataframe']:
-        preview_df = pd.DataFrame(result['dataframe'])
-        # 只取前10行
-        preview_df = preview_df.head(10)
-        # 转为dict列表
-        table_data = preview_df.to_dict(orient='records')
-        table_columns = list(preview_df.columns)
-        # 字段名翻译
-        table_columns_cn = [column_name_map.get(col, col) for col in table_columns]
-        # rows字段的key也映射为中文
-        table_data_cn = [
-            {column_name_map.get(k, k): v for k, v in row.items()} for row in table_data
-        ]
-    else:
-        messages.append("无数据可显示")
-        table_columns = []
-        table_columns_cn = []
-        table_data_cn = []
-    messages.append("\n分析完成!")
+        return '', '\n'.join(messages), {}, result['message'], [], {}, \
+            {k: result[k] for k in ('validation_errors', 'query_guard') if k in result}
+    chart_urls, chart_specs = build_chart_payload(processor, chart_mode)
+    table_data = build_table_data(result['dataframe'])
+    message = build_result_message(result['summary'], bool(processor.charts), bool(result['dataframe']),
+                                   result['truncated'], result['row_count'])
+    result_info = {"row_count": result['row_count'], "truncated": result['truncated'],
+                   "query_metrics": result['query_metrics']}
     # 返回中文列名和中文key的rows
-    return result.get('generated_sql', ''), '\n'.join(messages), chart_urls, '', {'columns': table_columns_cn, 'rows': table_data_cn}
+    return result.get('generated_sql', ''), message, chart_urls, '', table_data, chart_specs, result_info
 
 @app.route('/api/query', methods=['POST'])
 def api_query():
     data = request.json
     user_query = data.get('question', '')
     session_id = data.get('conversation_id', 'user_session')
+    chart_mode = resolve_chart_mode(data)
     if not user_query.strip():
         return jsonify({"error": "问题不能为空", "sql": "", "result": [], "conversation_id": session_id})
 
-    project_root = get_project_root()
-    db_schema_path = project_root/ "Text2SqlwithContext" / "integration" / "input" / "db_schema.json"
     try:
-        with open(db_schema_path, "r", encoding="utf-8") as f:
-            db_schema = f.read()
-        
+        # 共享的结构快照，文件未变化时不读磁盘
+        schema_snapshot = get_schema_snapshot()
     except Exception as e:
         return jsonify({"error": f"数据库结构文件读取失败: {e}", "sql": "", "result": [], "conversation_id": session_id})
-    enhanced_query = context_manager.enhance_query(session_id, user_query)
+    enhanced_query, prompt_metrics = context_manager.enhance_query_with_metrics(session_id, user_query)
+    # 模式链接：仅向LLM发送相关的表和列
+    link_result = link_schema(enhanced_query, schema_snapshot)
     query_data = {
         "query_id": "q_user",
         "natural_language_query": enhanced_query,
-        "database_schema": db_schema
+        "database_schema": link_result.schema_text,
+        "schema_hash": link_result.schema_hash
     }
     result = generate_sql_from_nl(query_data)
     sql = result.get("generated_sql", "")
-    project_root = get_project_root()
-    output_dir = project_root / "Text2SqlwithContext" / "integration" / "sql"
-    os.makedirs(output_dir, exist_ok=True)
-    sql_output_path = output_dir / "results.json"
-    results = {"generated_sql": sql}
-    write_json(results, str(sql_output_path))
     try:
-        sql, message, chart_urls, error, table_data = run_sql_processor_and_collect_message(str(sql_output_path))
+        sql, message, chart_urls, error, table_data, chart_specs, result_info = run_sql_processor_and_collect_message(sql, {
+            "query_id": result.get("query_id"),
+            "natural_language_query": user_query
+        }, chart_mode)
         if error and error.startswith("加载SQL查询: 生成错误"):
             return jsonify({
                 "sql": "",
@@ -164,7 +211,15 @@ def api_query():
             "conversation_id": session_id,
             "error": error,
             "chart_urls": chart_urls,
-            "table_data": table_data
+            "chart_specs": chart_specs,
+            "table_data": table_data,
+            "row_count": result_info.get("row_count", 0),
+            "truncated": result_info.get("truncated", False),
+            "validation_errors": result_info.get("validation_errors", []),
+            "query_guard": result_info.get("query_guard"),
+            "query_metrics": result_info.get("query_metrics", []),
+            "schema_linking": link_result.to_metadata(),
+            "prompt_metrics": prompt_metrics
         })
     except Exception as e:
         error_msg = str(e)
@@ -178,42 +233,203 @@ def api_query():
             "table_data": {"columns": [], "rows": []}
         })
 
+def sse_event(event, data):
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.route('/api/query/stream', methods=['POST'])
+def api_query_stream():
+    """
+    流式查询接口：逐token推送SQL生成过程，随后依次推送
+    sql、preview（数据预览）、summary（摘要）、charts（图表URL及spec模式下的图表描述）和done事件
+    """
+    data = request.json or {}
+    user_query = data.get('question', '')
+    session_id = data.get('conversation_id') or 'user_session'
+    chart_mode = resolve_chart_mode(data)
+
+    def single_error(error):
+        return Response(sse_event('error', {"error": error, "conversation_id": session_id}),
+                        mimetype='text/event-stream')
+
+    if not user_query.strip():
+        return single_error("问题不能为空")
+    try:
+        schema_snapshot = get_schema_snapshot()
+    except Exception as e:
+        return single_error(f"数据库结构文件读取失败: {e}")
+    enhanced_query, prompt_metrics = context_manager.enhance_query_with_metrics(session_id, user_query)
+    link_result = link_schema(enhanced_query, schema_snapshot)
+
+    def generate():
+        yield sse_event('start', {"conversation_id": session_id, "schema_linking": link_result.to_metadata(),
+                                  "prompt_metrics": prompt_metrics})
+        result = None
+        for item in stream_llm_model(enhanced_query, link_result.schema_text, link_result.schema_hash):
+            if item.get("done"):
+                result = item["result"]
+            else:
+                yield sse_event('token', {"delta": item["delta"]})
+        if not result or not result.get("success"):
+            yield sse_event('error', {"error": (result or {}).get("error", "SQL生成失败"), "conversation_id": session_id})
+            return
+        sql = result.get("generated_sql") or ""
+        if sql.strip().startswith("生成错误"):
+            error_msg = f"加载SQL查询: {sql}"
+            print(error_msg, file=sys.stderr)
+            yield sse_event('error', {"error": error_msg, "conversation_id": session_id})
+            return
+        yield sse_event('sql', {"sql": sql, "metadata": result.get("metadata", {})})
+
+        try:
+            processor = SQLProcessor.from_sql(sql, {"natural_language_query": user_query},
+                                              audit_path=SQL_AUDIT_PATH or None)
+            sql_query = processor.load_sql()
+            # 第一阶段只读取预览行，尽快推送给前端
+            processor.execute_preview(sql_query)
+            rejection = processor.rejection
+            if rejection:
+                # 未知表/列、非SELECT语句或代价过高的查询不执行
+                processor.audit(sql_query, "rejected")
+                yield sse_event('error', dict(rejection, conversation_id=session_id))
+                return
+
+            preview = processor.build_preview()
+            table_data = build_table_data(preview)
+            yield sse_event('preview', {"table_data": table_data, "has_more": processor.has_more})
+
+            summary = processor.generate_summary()
+            yield sse_event('summary', {"summary": summary})
+
+            processor.generate_charts()
+            chart_urls, chart_specs = build_chart_payload(processor, chart_mode)
+            yield sse_event('charts', {"chart_urls": chart_urls, "chart_specs": chart_specs})
+            processor.audit(sql_query, "success")
+        except Exception as e:
+            yield sse_event('error', {"error": str(e), "conversation_id": session_id})
+            return
+
+        context_manager.add_history(
+            session_id=session_id,
+            user_query=user_query,
+            generated_sql=sql,
+            result=table_data
+        )
+        row_count = processor.row_count
+        yield sse_event('done', {
+            "conversation_id": session_id,
+            "row_count": row_count,
+            "truncated": processor.truncated,
+            "query_metrics": processor.query_metrics,
+            "message": build_result_message(summary, bool(processor.charts), bool(preview),
+                                            processor.truncated, row_count)
+        })
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/connect_db', methods=['POST'])
 def connect_db():
     seed_dir = os.path.join('Text2SqlwithContext', 'seed')
-    sql_files = [f for f in os.listdir(seed_dir) if f.endswith('.sql')]
+    sql_files = sorted(f for f in os.listdir(seed_dir) if f.endswith('.sql'))
     if not sql_files:
         print("数据库导入失败：未找到SQL文件", file=sys.stderr)
         return jsonify({'success': False, 'error': '数据库导入失败'})
-    import_results = []
+    options = request.get_json(silent=True) or {}
+    # force=true 时忽略校验和，全部重新导入
+    force = bool(options.get('force'))
+    indexes = []
     try:
-        pool = init_connection_pool('mysql')
-        connection = pool.get_connection()
-        cursor = connection.cursor()
-        for sql_file in sql_files:
-            sql_path = os.path.join(seed_dir, sql_file)
-            with open(sql_path, 'r', encoding='utf-8') as f:
-                sql_content = f.read()
-            for statement in [s.strip() for s in sql_content.split(';') if s.strip()]:
-                try:
-                    cursor.execute(statement)
-                except Exception as e:
-                    connection.rollback()
-                    print(f"数据库导入异常: {e}", file=sys.stderr)
-                    return jsonify({'success': False, 'error': '数据库导入失败', 'detail': str(e)})
-            connection.commit()
-            import_results.append(f"{sql_file} 导入成功")
-        cursor.close()
-        connection.close()
-        return jsonify({'success': True, 'message': '，'.join(import_results)})
+        # 连接在with结束时归还连接池，导入失败时也不会泄漏
+        with init_connection_pool('mysql').connection() as connection:
+            results = load_seed_files(connection, 'mysql', [os.path.join(seed_dir, f) for f in sql_files],
+                                      force=force)
+            if options.get('apply_indexes'):
+                # 按已记录的查询负载创建推荐索引
+                recommendations = recommend_workload_indexes(connection, int(options.get('max_indexes', 5)))
+                indexes = apply_indexes(connection, 'mysql', recommendations, get_db_config('mysql')['database'])
     except Exception as e:
+        # MySQL的DDL会隐式提交，部分数据可能已变化
+        invalidate_result_cache('mysql')
+        detail = str(e.error) if isinstance(e, SeedImportError) else str(e)
         print(f"数据库导入异常: {e}", file=sys.stderr)
-        return jsonify({'success': False, 'error': '数据库导入失败', 'detail': str(e)})
+        return jsonify({'success': False, 'error': '数据库导入失败', 'detail': detail})
+    if any(r['status'] == 'imported' for r in results):
+        # 导入后数据已变化，旧的查询结果全部失效
+        invalidate_result_cache('mysql')
+    import_results = [
+        f"{r['file']} 导入成功（{r['statements']}条语句，{r['rows']}行，{r['seconds']}秒）" if r['status'] == 'imported'
+        else f"{r['file']} 未变化，已跳过"
+        for r in results
+    ]
+    import_results += [f"索引 {r['name']} {INDEX_STATUS_TEXT[r['status']]}" for r in indexes]
+    return jsonify({'success': True, 'message': '，'.join(import_results), 'files': results, 'indexes': indexes})
+
+INDEX_STATUS_TEXT = {'created': '已创建', 'exists': '已存在', 'failed': '创建失败'}
+
+def recommend_workload_indexes(connection=None, limit=5):
+    """按当前进程记录的查询负载推荐索引（有连接时以数据库中的实际索引为准）"""
+    workload = get_query_workload()
+    if workload is None:
+        return []
+    existing = existing_indexes(connection, 'mysql', get_db_config('mysql')['database']) if connection else None
+    return recommend_indexes(workload.entries(), get_schema_snapshot(), existing=existing, limit=limit)
+
+@app.route('/api/index/advice')
+def index_advice():
+    """索引建议及DDL（POST /api/connect_db 传 apply_indexes=true 时创建）"""
+    limit = request.args.get('limit', 5, type=int)
+    try:
+        with init_connection_pool('mysql').connection() as connection:
+            recommendations = recommend_workload_indexes(connection, limit)
+    except Exception as e:
+        print(f"读取数据库索引失败，按结构文件中的索引推荐: {e}", file=sys.stderr)
+        recommendations = recommend_workload_indexes(None, limit)
+    database = get_db_config('mysql')['database']
+    workload = get_query_workload()
+    return jsonify({
+        'workload': workload.get_stats() if workload is not None else None,
+        'recommendations': [dict(r.to_dict(), ddl=r.ddl('mysql', database)) for r in recommendations]
+    })
 
-@app.route('/api/chart/<filename>')
-def get_chart(filename):
-    output_dir = Path(__file__).parent / "Text2SqlwithContext" / "integration" / "output"
-    return send_from_directory(str(output_dir), filename)
+@app.route('/api/cache/stats')
+def cache_stats():
+    """各级缓存的统计信息"""
+    return jsonify({
+        'llm_cache': get_llm_cache_stats(),
+        'result_cache': get_result_cache_stats(),
+        'chart_store': get_chart_store().get_stats()
+    })
+
+@app.route('/api/pool/stats')
+def pool_stats():
+    """数据库连接池统计（使用中/等待中的连接数、等待时间等）"""
+    return jsonify(get_pool_stats())
+
+@app.route('/api/guard/stats')
+def guard_stats():
+    """查询代价守卫统计（各决定的次数、超时次数、EXPLAIN耗时）"""
+    return jsonify(get_guard_stats() or {})
+
+@app.route('/api/context/stats')
+def context_stats():
+    """对话会话统计（会话数、过期及淘汰次数、提示token估计）"""
+    return jsonify(context_manager.get_stats())
+
+@app.route('/api/chart/<chart_id>')
+def get_chart(chart_id):
+    # 图表ID由内容决定，同一ID的图片永不变化，可长期缓存
+    chart_id = chart_id[:-4] if chart_id.endswith('.png') else chart_id
+    if not is_chart_id(chart_id):
+        return '', 404
+    # spec模式下的图表在首次下载时才渲染
+    png = get_chart_store().get_or_render(chart_id)
+    if png is None:
+        return '', 404
+    response = Response(png, mimetype='image/png')
+    response.set_etag(chart_id)
+    response.headers['Cache-Control'] = f'public, max-age={CHART_CACHE_MAX_AGE}, immutable'
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
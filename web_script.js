@@ -1,8 +1,15 @@
 // 系统配置
 let config = {
     apiUrl: 'http://localhost:5000/api/query',
-    connectUrl: 'http://localhost:5000/api/connect_db'
+    streamUrl: 'http://localhost:5000/api/query/stream',
+    connectUrl: 'http://localhost:5000/api/connect_db',
+    // spec：后端返回图表描述，由浏览器用Chart.js绘制；png：后端渲染图片
+    chartMode: 'spec'
 };
+// 当前图表的PNG下载地址（spec模式下由后端按需渲染）
+let chartDownloadUrls = {};
+// 已创建的Chart.js实例，重新绘制前需销毁
+const chartInstances = {};
 let conversationId = null;
 
 // 连接数据库按钮逻辑
@@ -75,27 +82,36 @@ document.querySelectorAll('#chartTypeToggle [data-chart]').forEach(btn => {
         this.classList.add('active');
     });
 });
-// 后端图片展示逻辑
-function showChartImages(chartUrls) {
+// 图表展示逻辑：有图表描述时在浏览器绘制，否则显示后端图片
+function showCharts(chartUrls, chartSpecs) {
     const types = ['bar', 'pie', 'line'];
-    const now = Date.now(); // 当前时间戳
+    chartDownloadUrls = chartUrls || {};
     types.forEach(type => {
         const img = document.getElementById(type+'ChartImg');
         const none = document.getElementById(type+'ChartNone');
-        if (chartUrls && chartUrls[type]) {
-            // 加时间戳防止缓存
-            img.src = chartUrls[type] + '?t=' + now;
+        const canvasWrap = document.getElementById(type+'ChartCanvasWrap');
+        if (chartInstances[type]) {
+            chartInstances[type].destroy();
+            delete chartInstances[type];
+        }
+        img.style.display = 'none';
+        canvasWrap.style.display = 'none';
+        none.style.display = 'none';
+        if (chartSpecs && chartSpecs[type] && typeof Chart !== 'undefined') {
+            canvasWrap.style.display = 'block';
+            chartInstances[type] = renderChartSpec(document.getElementById(type+'ChartCanvas'), chartSpecs[type]);
+        } else if (chartUrls && chartUrls[type]) {
+            // 图表URL由内容决定，相同图表可直接使用浏览器缓存
+            img.src = chartUrls[type];
             img.style.display = 'block';
-            none.style.display = 'none';
         } else {
-            img.style.display = 'none';
             none.style.display = 'block';
         }
     });
     // 默认切换到有图的类型，否则切到bar
     let shown = false;
     types.forEach(type => {
-        if (chartUrls && chartUrls[type]) {
+        if ((chartUrls && chartUrls[type]) || (chartSpecs && chartSpecs[type])) {
             document.getElementById(type+'ChartBox').style.display = 'flex';
             document.querySelector(`[data-chart="${type}"]`).classList.add('active');
             shown = true;
@@ -110,6 +126,55 @@ function showChartImages(chartUrls) {
     }
 }
 
+// 按后端返回的图表描述绘制Chart.js图表
+const CHART_COLORS = ['#4e79a7', '#f28e2b', '#e15759', '#76b7b2', '#59a14f', '#edc948', '#b07aa1', '#ff9da7'];
+function renderChartSpec(canvas, spec) {
+    const isDate = spec.x_is_date;
+    const labels = spec.x.map(v => (isDate && v) ? String(v).slice(0, 10) : v);
+    const title = spec.title + (spec.downsampled ? `（${spec.total_points}个点已抽样显示）` : '');
+    if (spec.type === 'pie') {
+        const s = spec.series[0];
+        const total = s.values.reduce((a, b) => a + (b || 0), 0);
+        return new Chart(canvas, {
+            type: 'pie',
+            data: { labels: labels, datasets: [{ data: s.values, backgroundColor: CHART_COLORS }] },
+            options: {
+                maintainAspectRatio: false,
+                plugins: {
+                    title: { display: true, text: title },
+                    tooltip: { callbacks: { label: ctx => {
+                        const pct = total ? (ctx.parsed * 100 / total).toFixed(1) : '0.0';
+                        return `${ctx.label}: ${pct}% (${ctx.parsed}${s.unit || ''})`;
+                    } } }
+                }
+            }
+        });
+    }
+    return new Chart(canvas, {
+        type: spec.type === 'line' ? 'line' : 'bar',
+        data: {
+            labels: labels,
+            datasets: spec.series.map((s, i) => ({
+                label: s.label,
+                data: s.values,
+                borderColor: CHART_COLORS[i % CHART_COLORS.length],
+                backgroundColor: CHART_COLORS[i % CHART_COLORS.length],
+                pointRadius: spec.type === 'line' && labels.length > 100 ? 0 : 3,
+                spanGaps: true
+            }))
+        },
+        options: {
+            maintainAspectRatio: false,
+            animation: false,
+            plugins: { title: { display: true, text: title }, legend: { display: spec.series.length > 1 || spec.type === 'bar' } },
+            scales: {
+                x: { title: { display: !!spec.xlabel, text: spec.xlabel } },
+                y: { title: { display: !!spec.ylabel, text: spec.ylabel } }
+            }
+        }
+    });
+}
+
 // 下载当前图表图片
 function getCurrentChartType() {
     const activeBtn = document.querySelector('#chartTypeToggle .active[data-chart]');
@@ -118,9 +183,11 @@ function getCurrentChartType() {
 document.getElementById('downloadChartBtn').addEventListener('click', function() {
     const type = getCurrentChartType();
     const img = document.getElementById(type + 'ChartImg');
-    if (img && img.src && img.style.display !== 'none') {
+    // 优先使用后端PNG（spec模式下首次下载时渲染）
+    const url = chartDownloadUrls[type] || ((img && img.src && img.style.display !== 'none') ? img.src : '');
+    if (url) {
         const a = document.createElement('a');
-        a.href = img.src;
+        a.href = url;
         a.download = type + '_chart.png';
         document.body.appendChild(a);
         a.click();
@@ -132,7 +199,7 @@ document.getElementById('downloadChartBtn').addEventListener('click', function()
 
 
 
-// 发送消息到后端
+// 发送消息到后端（优先使用流式接口，不可用时回退到普通接口）
 async function sendMessage() {
     const userInput = document.getElementById('userInput');
     const message = userInput.value.trim();
@@ -140,10 +207,109 @@ async function sendMessage() {
     addMessage(message, 'user');
     userInput.value = '';
     showTypingIndicator();
+    const state = { started: false, sqlPre: null, sqlText: '' };
+    try {
+        await sendMessageStream(message, state);
+        return;
+    } catch (error) {
+        if (state.started) {
+            removeTypingIndicator();
+            showErrorSystemMessage('请求处理失败');
+            return;
+        }
+    }
+    await sendMessageJson(message);
+}
+
+// 流式接口：解析SSE事件并逐步渲染
+async function sendMessageStream(message, state) {
+    const response = await fetch(config.streamUrl, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ question: message, conversation_id: conversationId, chart_mode: config.chartMode })
+    });
+    if (!response.ok || !response.body) {
+        throw new Error('stream unavailable');
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let index;
+        while ((index = buffer.indexOf('\n\n')) >= 0) {
+            const raw = buffer.slice(0, index);
+            buffer = buffer.slice(index + 2);
+            const evt = parseSseEvent(raw);
+            if (evt) handleStreamEvent(evt.event, evt.data, state);
+        }
+    }
+    removeTypingIndicator();
+}
+
+function parseSseEvent(raw) {
+    let event = 'message';
+    const dataLines = [];
+    raw.split('\n').forEach(line => {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+    });
+    if (dataLines.length === 0) return null;
+    return { event: event, data: JSON.parse(dataLines.join('\n')) };
+}
+
+function handleStreamEvent(event, data, state) {
+    state.started = true;
+    if (data.conversation_id) {
+        conversationId = data.conversation_id;
+    }
+    switch (event) {
+        case 'token':
+            removeTypingIndicator();
+            if (!state.sqlPre) state.sqlPre = addSqlMessage('');
+            state.sqlText += data.delta;
+            state.sqlPre.textContent = state.sqlText;
+            break;
+        case 'sql':
+            if (!state.sqlPre) state.sqlPre = addSqlMessage('');
+            state.sqlPre.textContent = data.sql;
+            showTypingIndicator();
+            break;
+        case 'preview':
+            if (data.table_data && data.table_data.columns && data.table_data.columns.length > 0) {
+                showTableData(data.table_data.columns, data.table_data.rows);
+            } else {
+                hideTableData();
+            }
+            break;
+        case 'summary':
+            removeTypingIndicator();
+            addMessage(String(data.summary), 'system');
+            break;
+        case 'charts':
+            document.getElementById('visualizationContainer').style.display = 'block';
+            showCharts(data.chart_urls, data.chart_specs);
+            break;
+        case 'error':
+            removeTypingIndicator();
+            if (state.sqlPre && !state.sqlText) state.sqlPre.closest('.message').remove();
+            showErrorSystemMessage(data.error);
+            break;
+        case 'done':
+            removeTypingIndicator();
+            break;
+    }
+}
+
+// 普通接口：一次性返回完整结果
+async function sendMessageJson(message) {
     try {
         const response = await axios.post(config.apiUrl, {
             question: message,
-            conversation_id: conversationId
+            conversation_id: conversationId,
+            chart_mode: config.chartMode
         });
         removeTypingIndicator();
         handleResponse(response.data);
@@ -183,7 +349,7 @@ function handleResponse(data) {
     // 新增：处理 chart_urls
     if (data.chart_urls) {
         document.getElementById('visualizationContainer').style.display = 'block';
-        showChartImages(data.chart_urls);
+        showCharts(data.chart_urls, data.chart_specs);
     }
     // 新增：处理表格数据
     if (data.table_data && data.table_data.columns && data.table_data.rows && data.table_data.columns.length > 0) {
@@ -298,6 +464,7 @@ function addSqlMessage(sql) {
     `;
     chatMessages.appendChild(messageDiv);
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageDiv.querySelector('pre');
 }
 
 function showTypingIndicator() {